@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк поиска по базе знаний (BM25) на синтетическом корпусе
+
+Пример:
+    python scripts/bench_knowledge.py --sizes 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from core.knowledge import KnowledgeBase
+
+SYLLABLES = [
+    "ка", "ро", "ми", "на", "ле", "ст", "ра", "те", "го", "ви", "за", "по",
+    "лу", "бе", "ны", "ко", "ри", "да", "ме", "то", "сла", "гра", "про", "кон"
+]
+ENDINGS = ["", "а", "ы", "ом", "ами", "ов", "е", "ий", "ая"]
+
+
+def build_vocabulary(size: int, rng: random.Random) -> list:
+    """Словарь псевдорусских слов"""
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_chunk(vocabulary: list, weights: list, length: int, rng: random.Random) -> str:
+    """Чанк текста с распределением слов по закону Ципфа"""
+    words = rng.choices(vocabulary, cum_weights=weights, k=length)
+    return " ".join(word + rng.choice(ENDINGS) for word in words)
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(size: int, args, rng: random.Random):
+    vocabulary = build_vocabulary(args.vocabulary, rng)
+    weights, total = [], 0.0
+    for rank in range(1, len(vocabulary) + 1):
+        total += 1.0 / rank
+        weights.append(total)
+
+    kb = KnowledgeBase("bench")
+    started = time.perf_counter()
+    for i in range(size):
+        await kb.add_document(make_chunk(vocabulary, weights, args.chunk_tokens, rng), f"chunk-{i}")
+    build_time = time.perf_counter() - started
+
+    latencies = []
+    for _ in range(args.queries):
+        query = make_chunk(vocabulary, weights, rng.randint(2, 4), rng)
+        started = time.perf_counter()
+        await kb.search(query, n_results=5)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    print(
+        f"{size:>9} chunks | build {build_time:8.1f}s | "
+        f"p50 {statistics.median(latencies):8.2f}ms | "
+        f"p95 {percentile(latencies, 0.95):8.2f}ms | "
+        f"p99 {percentile(latencies, 0.99):8.2f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--chunk-tokens", type=int, default=40)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        await run(size, args, random.Random(args.seed))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
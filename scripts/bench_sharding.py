@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест обработки обновлений в нескольких процессах (ShardRouter)
+
+Синтетические обновления Telegram распределяются по процессам по chat_id;
+обработка каждого — разбор JSON и CPU работа (имитация поиска и разметки)
+плюс ожидание ввода-вывода (имитация LLM и Telegram API). Проверяется, что
+порядок обновлений внутри чата сохраняется.
+
+Пример:
+    python scripts/bench_sharding.py --workers 1 2 4 --updates 2000 --cpu-ms 5
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from core.sharding import ShardRouter
+
+
+class SyntheticHandler:
+    """Обработчик процесса: CPU работа и ожидание на каждое обновление"""
+
+    def __init__(self, cpu_ms: float, io_ms: float, results):
+        self.cpu_ms = cpu_ms
+        self.io_ms = io_ms
+        self.results = results
+        self.last_seen = {}
+        self.processed = 0
+        self.out_of_order = 0
+
+    async def startup(self):
+        pass
+
+    async def process(self, update: dict):
+        message = json.loads(json.dumps(update))["message"]
+        chat_id = message["chat"]["id"]
+        if self.last_seen.get(chat_id, -1) > update["update_id"]:
+            self.out_of_order += 1
+        self.last_seen[chat_id] = update["update_id"]
+
+        deadline = time.perf_counter() + self.cpu_ms / 1000
+        digest = message["text"].encode()
+        while time.perf_counter() < deadline:
+            digest = hashlib.sha256(digest).digest()
+        if self.io_ms:
+            await asyncio.sleep(self.io_ms / 1000)
+        self.processed += 1
+
+    async def shutdown(self):
+        self.results.put((self.processed, self.out_of_order))
+
+
+def make_updates(count: int, chats: int, rng: random.Random) -> list:
+    return [
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": rng.randint(1, chats), "type": "private"},
+                "text": f"вопрос {update_id}"
+            }
+        }
+        for update_id in range(count)
+    ]
+
+
+async def run(workers: int, updates: list, args) -> dict:
+    results = multiprocessing.get_context("spawn").Queue()
+    router = ShardRouter(
+        workers,
+        functools.partial(SyntheticHandler, args.cpu_ms, args.io_ms, results),
+        queue_size=args.queue_size,
+        concurrency=args.concurrency
+    )
+    router.start()
+    await router.wait_ready()
+
+    started = time.perf_counter()
+    for update in updates:
+        await router.submit(update)
+    await router.stop()
+    elapsed = time.perf_counter() - started
+
+    processed = out_of_order = 0
+    for _ in range(workers):
+        done, violations = results.get()
+        processed += done
+        out_of_order += violations
+    return {
+        "elapsed": elapsed,
+        "processed": processed,
+        "out_of_order": out_of_order,
+        "throughput": processed / elapsed
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--cpu-ms", type=float, default=5.0)
+    parser.add_argument("--io-ms", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    updates = make_updates(args.updates, args.chats, random.Random(args.seed))
+    print(f"CPU cores: {os.cpu_count()}, updates: {args.updates}, chats: {args.chats}, "
+          f"cpu {args.cpu_ms} ms + io {args.io_ms} ms per update")
+    print(f"{'workers':>8} {'seconds':>9} {'updates/s':>10} {'speedup':>8} {'reordered':>10}")
+    baseline = None
+    for workers in args.workers:
+        result = await run(workers, updates, args)
+        baseline = baseline or result["throughput"]
+        print(f"{workers:>8} {result['elapsed']:>9.2f} {result['throughput']:>10.1f} "
+              f"{result['throughput'] / baseline:>7.2f}x {result['out_of_order']:>10}")
+        if result["processed"] != len(updates):
+            print(f"  ! processed {result['processed']} of {len(updates)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
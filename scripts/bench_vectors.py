@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк векторного поиска: recall@k и QPS int8/IVF относительно точного float32
+
+Пример:
+    python scripts/bench_vectors.py --sizes 10000 100000 --nprobe 4 8 16
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+import numpy as np
+
+from core.vectors import IVFIndex, VectorIndex
+
+
+def make_dataset(size: int, dim: int, clusters: int, rng):
+    """Кластеризованные нормированные векторы (похоже на эмбеддинги текстов)"""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size)
+    data = centers[labels] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def build_index(data, dtype: str) -> VectorIndex:
+    index = VectorIndex(data.shape[1], dtype, capacity=len(data))
+    for doc_idx, vector in enumerate(data):
+        index.add(doc_idx, vector)
+    return index
+
+
+def measure(searcher, queries, k: int):
+    started = time.perf_counter()
+    results = [[doc_idx for doc_idx, _ in searcher.search(query, k)] for query in queries]
+    return results, len(queries) / (time.perf_counter() - started)
+
+
+def recall(results, truth) -> float:
+    return float(np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        rng = np.random.default_rng(args.seed)
+        data = make_dataset(size, args.dim, max(10, size // 1000), rng)
+        queries = data[rng.choice(size, args.queries, replace=False)]
+        queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        exact = build_index(data, "float32")
+        truth, qps = measure(exact, queries, args.k)
+        print(f"{size:>9} vectors | float32 brute-force | recall@{args.k} 1.000 | {qps:9.1f} QPS")
+
+        quantized = build_index(data, "int8")
+        results, qps = measure(quantized, queries, args.k)
+        print(f"{size:>9} vectors | int8 brute-force    | recall@{args.k} {recall(results, truth):.3f} | {qps:9.1f} QPS")
+
+        started = time.perf_counter()
+        ivf = IVFIndex.train(exact)
+        train_time = time.perf_counter() - started
+        for nprobe in args.nprobe:
+            ivf.nprobe = nprobe
+            results, qps = measure(ivf, queries, args.k)
+            print(
+                f"{size:>9} vectors | IVF nlist={len(ivf.centroids):<4} nprobe={nprobe:<3}| "
+                f"recall@{args.k} {recall(results, truth):.3f} | {qps:9.1f} QPS "
+                f"(train {train_time:.1f}s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
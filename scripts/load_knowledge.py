@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 """
-Загрузка базы знаний в ChromaDB
+Загрузка базы знаний (инкрементальная индексация фрагментов документов)
 """
+import argparse
 import asyncio
 import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent.parent / "src"))
 
+from core.ingest import KnowledgeIngestor
 from core.knowledge import KnowledgeBase
 from utils.config import settings
 from utils.logger import setup_logger
@@ -15,45 +17,32 @@ from utils.logger import setup_logger
 logger = setup_logger("knowledge_loader")
 
 
-async def load_knowledge_base():
+async def load_knowledge_base(use_processes: bool = False):
     """Загрузка документов в базу знаний"""
-    kb = KnowledgeBase("lil_ken_ceo")
+    kb = KnowledgeBase.from_settings(settings.AGENT_NAME)
     await kb.initialize()
-    
-    knowledge_dir = settings.KNOWLEDGE_BASE_DIR
-    
-    # Загружаем все текстовые файлы
-    for file_path in knowledge_dir.rglob("*.txt"):
-        logger.info(f"Loading {file_path}")
-        
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        
-        metadata = {
-            "source": str(file_path.relative_to(knowledge_dir)),
-            "category": file_path.parent.name
-        }
-        
-        await kb.add_document(content, metadata)
-    
-    # Загружаем markdown файлы
-    for file_path in knowledge_dir.rglob("*.md"):
-        logger.info(f"Loading {file_path}")
-        
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        
-        metadata = {
-            "source": str(file_path.relative_to(knowledge_dir)),
-            "category": file_path.parent.name,
-            "format": "markdown"
-        }
-        
-        await kb.add_document(content, metadata)
-    
+
+    ingestor = KnowledgeIngestor(
+        kb,
+        settings.KNOWLEDGE_BASE_DIR,
+        settings.KNOWLEDGE_INDEX_DIR / f"{settings.AGENT_NAME}.manifest.json",
+        max_tokens=settings.KNOWLEDGE_CHUNK_TOKENS,
+        overlap=settings.KNOWLEDGE_CHUNK_OVERLAP,
+        max_workers=settings.KNOWLEDGE_INGEST_WORKERS,
+        use_processes=use_processes
+    )
+    await ingestor.sync()
+
     doc_count = await kb.get_doc_count()
-    logger.info(f"Loaded {doc_count} documents into knowledge base")
+    logger.info(f"Loaded {doc_count} chunks into knowledge base")
+    return kb
 
 
 if __name__ == "__main__":
-    asyncio.run(load_knowledge_base())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Загрузка базы знаний")
+    parser.add_argument(
+        "--processes", action="store_true",
+        help="разбирать файлы в пуле процессов вместо пула потоков"
+    )
+    args = parser.parse_args()
+    asyncio.run(load_knowledge_base(args.processes))
@@ -1,58 +1,95 @@
 """
 Упрощенный CEO агент
 """
+import asyncio
 import logging
 from datetime import datetime
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
-from anthropic import AsyncAnthropic
+from core.commands import COST_NONE, COST_REPORT, Command, CommandUsageError
+from core.context import ContextAssembler
+from core.knowledge import KnowledgeBase
+from core.llm_gateway import PRIORITY_BATCH, PRIORITY_INTERACTIVE, LLMGateway, get_gateway, track_usage
+from core.memory import Turn, create_memory_manager
+from core.response_cache import ResponseCache, create_response_cache
+from core.prompt_builder import CACHE_MIN_TOKENS, build_request
+from core.singleflight import SingleFlight
 from utils.config import settings
+from utils.tokens import estimate_tokens
+from .prompts import CEO_PROMPTS
 
 logger = logging.getLogger(__name__)
 
+MODEL = settings.ANTHROPIC_MODEL
+
+# Время жизни закэшированных ответов свободных вопросов (секунды);
+# для команд — в их описаниях (COMMANDS)
+CHAT_CACHE_TTL = 600
+
+# Бюджет токенов на фрагменты базы знаний в промпте команды
+KNOWLEDGE_BUDGET_TOKENS = 1500
+
+# Краткое содержание обновляется, когда вне окна истории накопилось столько реплик
+SUMMARY_EVERY_TURNS = 4
+SUMMARY_MAX_TOKENS = 300
+
 
 class LilKenCEO:
     """Упрощенный CEO Agent"""
     
-    def __init__(self):
+    def __init__(self, llm: Optional[LLMGateway] = None):
         self.name = "lil_ken_ceo"
-        self.anthropic = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
-        self.memory = {}  # Простая память в словаре
+        self.llm = llm or get_gateway()
+        self.memory = create_memory_manager(self.name)
+        self.knowledge = KnowledgeBase.from_settings(self.name)
+        self.response_cache = create_response_cache(response_cache_ttls())
+        self.inflight = SingleFlight()
+        self.context = ContextAssembler(settings.CONTEXT_BUDGET_TOKENS)
+        self._summary_tasks: Dict[int, asyncio.Task] = {}
         self.initialized = False
     
     async def initialize(self):
         """Инициализация агента"""
+        # Индекс базы знаний открывается через mmap, без перестроения
+        await self.knowledge.initialize()
+        await self.memory.initialize()
         self.initialized = True
         logger.info(f"✅ {self.name} agent initialized")
         return True
     
-    async def process_message(self, message: str, user_id: int) -> str:
-        """Обработка сообщения пользователя"""
+    async def process_message(
+        self,
+        message: str,
+        user_id: int,
+        on_text: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """Обработка сообщения пользователя
+        
+        В запрос идут краткое содержание старой части разговора и последние
+        реплики; краткое содержание обновляется в фоне после ответа.
+        """
         try:
-            # Простой запрос к Claude
-            response = await self.anthropic.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=1000,
-                messages=[{
-                    "role": "user",
-                    "content": f"""Ты опытный CEO и бизнес-консультант. Отвечай профессионально и полезно.
-                    
-Вопрос: {message}
-
-Дай краткий, но ценный совет как успешный руководитель."""
-                }]
-            )
+            summary, history = await self._conversation_context(user_id)
+            dynamic_system = []
+            if summary:
+                dynamic_system.append(f"Краткое содержание предыдущего разговора:\n{summary['text']}")
             
-            answer = response.content[0].text
+            # Роль и стиль чата — в кэшируемом system, краткое содержание — после
+            # него без пометки кэша, в сообщении только вопрос.
+            # Похожие вопросы отвечаются из кэша только вне контекста разговора.
+            answer = await self._get_ai_response(
+                message,
+                command="chat",
+                system=[CEO_PROMPTS["system"], CEO_PROMPTS["chat"]],
+                dynamic_system=dynamic_system,
+                history=[(turn.user_message, turn.bot_response) for turn in history],
+                similarity_text=message if not (summary or history) else None,
+                on_text=on_text
+            )
             
-            # Сохраняем в простую память
-            if user_id not in self.memory:
-                self.memory[user_id] = []
-            self.memory[user_id].append({
-                "message": message,
-                "response": answer,
-                "timestamp": datetime.now().isoformat()
-            })
+            await self.memory.save_conversation(user_id, message, answer)
+            if len(history) + 1 >= settings.CHAT_HISTORY_TURNS + SUMMARY_EVERY_TURNS:
+                self._schedule_summary(user_id)
             
             return answer
             
@@ -60,8 +97,134 @@ class LilKenCEO:
             logger.error(f"Error processing message: {e}")
             return "Извините, произошла ошибка. Попробуйте еще раз."
     
+    async def _conversation_context(self, user_id: int) -> Tuple[Optional[Dict[str, Any]], List[Turn]]:
+        """Краткое содержание и реплики разговора, еще не вошедшие в него"""
+        summary = await self.memory.get_summary(user_id)
+        history = await self.memory.get_conversation_history(
+            user_id, limit=settings.CHAT_HISTORY_TURNS + SUMMARY_EVERY_TURNS
+        )
+        if summary:
+            history = [turn for turn in history if turn.timestamp > summary["until"]]
+        return summary, history
+    
+    def _schedule_summary(self, user_id: int):
+        """Фоновое обновление краткого содержания (не больше одного на пользователя)"""
+        task = self._summary_tasks.get(user_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.create_task(self._update_summary(user_id))
+        self._summary_tasks[user_id] = task
+        task.add_done_callback(lambda _: self._summary_tasks.pop(user_id, None))
+    
+    async def _update_summary(self, user_id: int):
+        """Сжатие реплик старше окна истории в краткое содержание"""
+        # Задача унаследовала счетчик токенов сообщения, вызвавшего сжатие:
+        # свой счетчик, чтобы фоновый вызов не попадал в статистику команды
+        usage = track_usage()
+        try:
+            summary, history = await self._conversation_context(user_id)
+            old_turns = history[:-settings.CHAT_HISTORY_TURNS]
+            if not old_turns:
+                return
+            
+            dialogue = "\n\n".join(
+                f"Пользователь: {turn.user_message}\nCEO: {turn.bot_response}"
+                for turn in old_turns
+            )
+            previous = summary["text"] if summary else "нет"
+            prompt = CEO_PROMPTS["summary"].format(summary=previous, dialogue=dialogue)
+            request = build_request(MODEL, prompt, max_tokens=SUMMARY_MAX_TOKENS)
+            text = await self.llm.complete(request, priority=PRIORITY_BATCH)
+            await self.memory.set_summary(user_id, text, old_turns[-1].timestamp)
+            logger.info(
+                f"Conversation summary updated for {user_id}: {len(old_turns)} turns folded, "
+                f"{usage['input_tokens']}+{usage['output_tokens']} tokens"
+            )
+        except Exception as e:
+            logger.warning(f"Conversation summary failed for {user_id}: {e}")
+    
+    async def _get_ai_response(
+        self,
+        prompt: str,
+        command: str = "chat",
+        max_tokens: int = 1000,
+        similarity_text: Optional[str] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        passages: Sequence[str] = (),
+        history: Sequence[Tuple[str, str]] = (),
+        system: Optional[Sequence[str]] = None,
+        dynamic_system: Sequence[str] = ()
+    ) -> str:
+        """Запрос к Claude через кэш ответов (TTL зависит от типа команды)
+        
+        Системный промпт агента (или system), фрагменты базы знаний passages,
+        изменчивые инструкции dynamic_system, история и prompt укладываются
+        в бюджет токенов контекста. Системный промпт и фрагменты идут
+        кэшируемыми блоками system, dynamic_system — после них без пометки
+        кэша, prompt — последним сообщением пользователя.
+        Вызов идет через общий LLM шлюз (лимиты, повторы, приоритет: чат
+        раньше отчетов). Одновременные одинаковые запросы объединяются в один.
+        Если передан on_text, ответ запрашивается потоком и on_text получает
+        накопленный текст после каждого фрагмента (только у первого из
+        объединенных запросов, остальные получают итоговый ответ).
+        """
+        assembled = self.context.assemble(
+            prompt,
+            system=system if system is not None else (CEO_PROMPTS["system"],),
+            passages=passages,
+            history=history,
+            dynamic_system=dynamic_system
+        )
+        # Кэш промпта провайдера работает только с префикса в CACHE_MIN_TOKENS
+        prefix_tokens = sum(estimate_tokens(text) for text in assembled.system) + assembled.tokens["context"]
+        logger.info(
+            f"{command} prompt tokens: {assembled.tokens}, "
+            f"cacheable prefix: {'yes' if prefix_tokens >= CACHE_MIN_TOKENS else 'no'}"
+        )
+        request = build_request(
+            MODEL,
+            assembled.question,
+            system=assembled.system,
+            context=assembled.context,
+            history=assembled.history,
+            max_tokens=max_tokens,
+            dynamic_system=assembled.dynamic_system
+        )
+        
+        if self.response_cache:
+            cached = await self.response_cache.get(request, similarity_text)
+            if cached is not None:
+                logger.info(f"Response cache hit for {command}")
+                return cached
+        
+        priority = PRIORITY_INTERACTIVE if command == "chat" else PRIORITY_BATCH
+        
+        async def create() -> str:
+            answer = await self.llm.complete(request, priority=priority, on_text=on_text)
+            if self.response_cache:
+                await self.response_cache.set(command, request, answer, similarity_text)
+            return answer
+        
+        # Одинаковые запросы, пришедшие одновременно, ждут один вызов API
+        return await self.inflight.do(ResponseCache.make_key(request), create)
+    
+    async def _knowledge(self, command: str, query: str) -> List[str]:
+        """Фрагменты базы знаний для промпта команды (гибридный поиск в пределах бюджета)"""
+        try:
+            knowledge = await self.knowledge.hybrid_search(query, budget_tokens=KNOWLEDGE_BUDGET_TOKENS)
+        except Exception as e:
+            logger.warning(f"{command} retrieval failed: {e}")
+            return []
+        timings = ", ".join(f"{name} {ms:.1f}ms" for name, ms in knowledge["timings"].items())
+        logger.info(f"{command} retrieval: {timings}, {knowledge['tokens']} tokens")
+        return knowledge["documents"][0]
+    
+    def commands(self) -> List[Command]:
+        """Команды агента для реестра бота"""
+        return [command.bind(self) for command in COMMANDS]
+    
     # Простые методы для команд
-    async def generate_year_strategy(self) -> str:
+    async def generate_year_strategy(self, on_text: Optional[Callable[[str], None]] = None) -> str:
         """Генерация годовой стратегии"""
         prompt = """Создай краткую годовую стратегию для стартапа:
 - Ключевые цели на год
@@ -70,16 +233,14 @@ class LilKenCEO:
 - Потенциальные риски"""
         
         try:
-            response = await self.anthropic.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
+            passages = await self._knowledge("year_strategy", "годовая стратегия бизнес план")
+            return await self._get_ai_response(
+                prompt, command="year_strategy", passages=passages, on_text=on_text
             )
-            return response.content[0].text
         except Exception as e:
             return f"Ошибка: {e}"
     
-    async def analyze_market(self, country: str) -> str:
+    async def analyze_market(self, country: str, on_text: Optional[Callable[[str], None]] = None) -> str:
         """Анализ рынка"""
         prompt = f"""Проведи краткий анализ рынка {country}:
 - Размер рынка
@@ -88,16 +249,14 @@ class LilKenCEO:
 - Основные вызовы"""
         
         try:
-            response = await self.anthropic.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
+            passages = await self._knowledge("market_analysis", f"гемблинг рынок {country}")
+            return await self._get_ai_response(
+                prompt, command="market_analysis", passages=passages, on_text=on_text
             )
-            return response.content[0].text
         except Exception as e:
             return f"Ошибка: {e}"
     
-    async def competitor_analysis(self) -> str:
+    async def competitor_analysis(self, on_text: Optional[Callable[[str], None]] = None) -> str:
         """Анализ конкурентов"""
         prompt = """Создай шаблон для анализа конкурентов:
 - Методы поиска конкурентов
@@ -106,16 +265,14 @@ class LilKenCEO:
 - Выводы и рекомендации"""
         
         try:
-            response = await self.anthropic.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
+            passages = await self._knowledge("competitor_analysis", "конкуренты анализ гемблинг")
+            return await self._get_ai_response(
+                prompt, command="competitor_analysis", passages=passages, on_text=on_text
             )
-            return response.content[0].text
         except Exception as e:
             return f"Ошибка: {e}"
     
-    async def swot_analysis(self) -> str:
+    async def swot_analysis(self, on_text: Optional[Callable[[str], None]] = None) -> str:
         """SWOT анализ"""
         prompt = """Создай шаблон SWOT анализа для стартапа:
 - Strengths (Сильные стороны)
@@ -124,16 +281,14 @@ class LilKenCEO:
 - Threats (Угрозы)"""
         
         try:
-            response = await self.anthropic.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
+            passages = await self._knowledge("swot_analysis", "SWOT анализ сильные слабые стороны компании")
+            return await self._get_ai_response(
+                prompt, command="swot_analysis", passages=passages, on_text=on_text
             )
-            return response.content[0].text
         except Exception as e:
             return f"Ошибка: {e}"
     
-    async def risk_assessment(self) -> str:
+    async def risk_assessment(self, on_text: Optional[Callable[[str], None]] = None) -> str:
         """Оценка рисков"""
         prompt = """Создай краткую оценку основных бизнес-рисков:
 - Финансовые риски
@@ -143,12 +298,10 @@ class LilKenCEO:
 - Методы снижения рисков"""
         
         try:
-            response = await self.anthropic.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
+            passages = await self._knowledge("risk_assessment", "бизнес риски оценка снижение рисков")
+            return await self._get_ai_response(
+                prompt, command="risk_assessment", passages=passages, on_text=on_text
             )
-            return response.content[0].text
         except Exception as e:
             return f"Ошибка: {e}"
     
@@ -192,4 +345,102 @@ class LilKenCEO:
 🔮 **Планы на следующую неделю:**
 • Стратегические инициативы
 • Важные встречи
-• Критические задачи"""
\ No newline at end of file
+• Критические задачи"""
+
+
+def _market_args(update, context) -> Dict[str, Any]:
+    # С кнопки меню — страна по умолчанию
+    if update.callback_query:
+        return {"country": "Россия"}
+    if not context.args:
+        raise CommandUsageError("Укажите страну для анализа:\n/marketanalysis Бразилия")
+    return {"country": " ".join(context.args)}
+
+
+# Команды агента. Шаблонные отчеты стабильны и кэшируются дольше,
+# анализ рынка и конкурентов устаревает быстрее.
+COMMANDS = [
+    Command(
+        "yearstrategy", "Годовая стратегия",
+        generate=LilKenCEO.generate_year_strategy,
+        placeholder="🔄 Разрабатываю годовую стратегию...",
+        help="Годовая стратегия развития",
+        section="🎯 **Стратегия:**",
+        button="📊 Годовая стратегия",
+        welcome="🎯 Стратегия",
+        aliases=("strategy",),
+        cost=COST_REPORT,
+        cache_key="year_strategy",
+        cache_ttl=6 * 3600
+    ),
+    Command(
+        "marketanalysis", "Анализ рынка",
+        generate=LilKenCEO.analyze_market,
+        placeholder="🔍 Анализирую рынок {country}...",
+        parse_args=_market_args,
+        help="Анализ нового рынка",
+        section="📊 **Аналитика:**",
+        button="📈 Анализ рынка",
+        welcome="📈 Анализ рынка",
+        aliases=("market",),
+        cost=COST_REPORT,
+        cache_key="market_analysis",
+        cache_ttl=3600
+    ),
+    Command(
+        "competitorwatch", "Мониторинг конкурентов",
+        generate=LilKenCEO.competitor_analysis,
+        placeholder="👀 Собираю данные о конкурентах...",
+        section="📊 **Аналитика:**",
+        button="👥 Конкуренты",
+        cost=COST_REPORT,
+        cache_key="competitor_analysis",
+        cache_ttl=3600
+    ),
+    Command(
+        "swotanalysis", "SWOT анализ",
+        generate=LilKenCEO.swot_analysis,
+        placeholder="📊 Провожу SWOT анализ...",
+        help="SWOT анализ компании",
+        section="🎯 **Стратегия:**",
+        button="⚖️ SWOT анализ",
+        cost=COST_REPORT,
+        cache_key="swot_analysis",
+        cache_ttl=6 * 3600
+    ),
+    Command(
+        "riskassessment", "Оценка рисков",
+        generate=LilKenCEO.risk_assessment,
+        placeholder="⚠️ Оцениваю бизнес-риски...",
+        help="Оценка бизнес-рисков",
+        section="🎯 **Стратегия:**",
+        button="⚠️ Оценка рисков",
+        cost=COST_REPORT,
+        cache_key="risk_assessment",
+        cache_ttl=6 * 3600
+    ),
+    Command(
+        "dailyreport", "Дневной отчет",
+        generate=lambda agent, on_text: agent.daily_report(),
+        placeholder="📋 Формирую ежедневный отчет...",
+        help="Ежедневный отчет",
+        section="📈 **Отчеты:**",
+        button="📋 Ежедневный отчет",
+        cost=COST_NONE
+    ),
+    Command(
+        "weeklyreport", "Недельный отчет",
+        generate=lambda agent, on_text: agent.weekly_report(),
+        placeholder="📅 Формирую недельный отчет...",
+        section="📈 **Отчеты:**",
+        button="📅 Недельный отчет",
+        cost=COST_NONE
+    ),
+]
+
+
+def response_cache_ttls() -> Dict[str, float]:
+    """Время жизни кэша ответов по типам запросов: команды и свободные вопросы"""
+    ttls = {command.cache_key: command.cache_ttl for command in COMMANDS if command.cache_key}
+    ttls["chat"] = CHAT_CACHE_TTL
+    return ttls
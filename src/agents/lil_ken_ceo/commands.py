@@ -9,6 +9,9 @@ from utils.logger import setup_logger
 
 logger = setup_logger("ceo_commands")
 
+# Бюджет токенов на фрагменты базы знаний в одном промпте
+KNOWLEDGE_BUDGET_TOKENS = 1500
+
 
 class CEOCommands:
     """Команды CEO агента"""
@@ -16,28 +19,40 @@ class CEOCommands:
     def __init__(self, agent):
         self.agent = agent
     
+    @staticmethod
+    def _log_timings(command: str, knowledge: dict):
+        """Логирование времени этапов поиска по базе знаний"""
+        timings = ", ".join(f"{name} {ms:.1f}ms" for name, ms in knowledge["timings"].items())
+        logger.info(f"{command} retrieval: {timings}, {knowledge['tokens']} tokens")
+    
     async def year_strategy(self) -> str:
         """Генерация годовой стратегии"""
         prompt = CEO_PROMPTS["year_strategy"]
         
         # Добавляем актуальные данные из базы знаний
-        knowledge = await self.agent.knowledge.search("годовая стратегия бизнес план")
-        
-        full_prompt = f"{prompt}\n\nДополнительный контекст:\n{knowledge}"
+        knowledge = await self.agent.knowledge.hybrid_search(
+            "годовая стратегия бизнес план", budget_tokens=KNOWLEDGE_BUDGET_TOKENS
+        )
+        self._log_timings("year_strategy", knowledge)
         
-        response = await self.agent._get_ai_response(full_prompt)
+        response = await self.agent._get_ai_response(
+            prompt, command="year_strategy", passages=knowledge["documents"][0]
+        )
         return response
     
     async def market_analysis(self, country: str) -> str:
         """Анализ рынка страны"""
         prompt = CEO_PROMPTS["market_analysis"].format(country=country)
         
-        # Ищем информацию о стране
-        knowledge = await self.agent.knowledge.search(f"гемблинг рынок {country}")
+        # Ищем информацию о стране (BM25 + векторы, в пределах бюджета токенов)
+        knowledge = await self.agent.knowledge.hybrid_search(
+            f"гемблинг рынок {country}", budget_tokens=KNOWLEDGE_BUDGET_TOKENS
+        )
+        self._log_timings("market_analysis", knowledge)
         
-        full_prompt = f"{prompt}\n\nИнформация о рынке:\n{knowledge}"
-        
-        response = await self.agent._get_ai_response(full_prompt)
+        response = await self.agent._get_ai_response(
+            prompt, command="market_analysis", passages=knowledge["documents"][0]
+        )
         return response
     
     async def competitor_watch(self) -> str:
@@ -45,11 +60,14 @@ class CEOCommands:
         prompt = CEO_PROMPTS["competitor_watch"]
         
         # Получаем данные о конкурентах
-        knowledge = await self.agent.knowledge.search("конкуренты анализ гемблинг")
-        
-        full_prompt = f"{prompt}\n\nДанные о конкурентах:\n{knowledge}"
+        knowledge = await self.agent.knowledge.hybrid_search(
+            "конкуренты анализ гемблинг", budget_tokens=KNOWLEDGE_BUDGET_TOKENS
+        )
+        self._log_timings("competitor_watch", knowledge)
         
-        response = await self.agent._get_ai_response(full_prompt)
+        response = await self.agent._get_ai_response(
+            prompt, command="competitor_analysis", passages=knowledge["documents"][0]
+        )
         return response
     
     async def swot_analysis(self) -> str:
@@ -79,7 +97,7 @@ class CEOCommands:
 
 Сделай выводы и дай рекомендации по стратегии.
 """
-        response = await self.agent._get_ai_response(prompt)
+        response = await self.agent._get_ai_response(prompt, command="swot_analysis")
         return response
     
     async def risk_assessment(self) -> str:
@@ -118,7 +136,7 @@ class CEOCommands:
 - Меры митигации
 - Ответственный
 """
-        response = await self.agent._get_ai_response(prompt)
+        response = await self.agent._get_ai_response(prompt, command="risk_assessment")
         return response
     
     async def daily_report(self) -> str:
@@ -138,7 +156,7 @@ class CEOCommands:
 """
         full_prompt = f"{prompt}\n\n{metrics}"
         
-        response = await self.agent._get_ai_response(full_prompt)
+        response = await self.agent._get_ai_response(full_prompt, command="daily_report")
         return response
     
     async def weekly_report(self) -> str:
@@ -156,7 +174,7 @@ class CEOCommands:
 """
         full_prompt = f"{prompt}\n\n{week_data}"
         
-        response = await self.agent._get_ai_response(full_prompt)
+        response = await self.agent._get_ai_response(full_prompt, command="weekly_report")
         return response
     
     async def status(self) -> str:
@@ -32,6 +32,23 @@ CEO_PROMPTS = {
 - Используй эмодзи для визуализации
 - Структурируй ответы для удобства
 - Говори на русском языке
+""",
+
+    "chat": """Сейчас ты отвечаешь на вопрос пользователя в чате.
+Отвечай как опытный CEO и бизнес-консультант: профессионально и полезно,
+дай краткий, но ценный совет как успешный руководитель.
+""",
+
+    "summary": """Обнови краткое содержание разговора CEO с пользователем.
+
+Текущее краткое содержание:
+{summary}
+
+Новые реплики:
+{dialogue}
+
+Сохрани факты о пользователе и его бизнесе, принятые решения, цифры и
+открытые вопросы. Ответь только новым кратким содержанием, до 150 слов.
 """,
 
     "year_strategy": """Создай детальную годовую стратегию развития онлайн гемблинг платформы.
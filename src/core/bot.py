@@ -1,18 +1,30 @@
 """
 Простой Telegram бот
 """
+import asyncio
+import functools
 import logging
-from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
+import secrets
+import signal
+import time
+from typing import Any, Dict, List, Optional
+from telegram import Bot, Update
 from telegram.ext import (
     Application, 
-    CommandHandler, 
     MessageHandler, 
-    CallbackQueryHandler,
     filters,
     ContextTypes
 )
 
-from agents.lil_ken_ceo.agent import LilKenCEO
+from agents.lil_ken_ceo.agent import COMMANDS as CEO_COMMANDS, LilKenCEO
+from core.commands import COST_CHAT, COST_NONE, COST_REPORT, Command, CommandRegistry
+from core.llm_gateway import create_gateway, current_usage, track_usage
+from core.outbound import PRIORITY_BULK, PRIORITY_INTERACTIVE, OutboundDispatcher, OutboundMessage
+from core.persistence import MessageRecord, MessageWriter
+from core.scheduler import LANE_INTERACTIVE, LANE_REPORTS, SchedulerFullError, create_scheduler
+from core.sharding import ShardRouter
+from core.streaming import StreamingEditor
+from core.webhook import WebhookServer
 from utils.config import settings
 
 # Настройка логирования
@@ -22,39 +34,63 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-
 class CEOBot:
     """Класс Telegram бота с ИИ агентом"""
     
-    def __init__(self):
-        """Инициализация бота"""
-        self.app = Application.builder().token(settings.TELEGRAM_BOT_TOKEN).build()
-        self.ceo_agent = LilKenCEO()
+    def __init__(self, shares: int = 1):
+        """Инициализация бота
+        
+        shares — число процессов-обработчиков, между которыми делятся лимиты
+        аккаунта: LLM шлюз, очереди планировщика и общий лимит Telegram.
+        """
+        # Обновления обрабатываются параллельно, очередность задает планировщик
+        self.app = (
+            Application.builder()
+            .token(settings.TELEGRAM_BOT_TOKEN)
+            .concurrent_updates(settings.BOT_CONCURRENT_UPDATES)
+            .build()
+        )
+        self.ceo_agent = LilKenCEO(create_gateway(shares) if shares > 1 else None)
+        self.scheduler = create_scheduler(shares)
+        self.webhook = None
+        # Все сообщения и правки идут через очередь с учетом лимитов Telegram
+        self.outbound = OutboundDispatcher(
+            global_rate=settings.TELEGRAM_GLOBAL_RATE / shares,
+            chat_rate=settings.TELEGRAM_CHAT_RATE,
+            group_rate=settings.TELEGRAM_GROUP_RATE,
+            burst=settings.TELEGRAM_CHAT_BURST
+        )
+        
+        # Диалоги пишутся в PostgreSQL фоном, пачками, вне пути ответа
+        self.db = None
+        self.message_writer = None
+        if settings.DATABASE_ENABLED:
+            from core.database import Database
+            self.db = Database()
+            self.message_writer = MessageWriter(
+                self.db,
+                max_buffer=settings.DATABASE_WRITE_BUFFER,
+                batch_size=settings.DATABASE_WRITE_BATCH,
+                flush_interval=settings.DATABASE_FLUSH_INTERVAL
+            )
+        
+        # Команды, кнопки, меню и справка строятся из одного реестра
+        self.commands = create_registry(self)
         
         # Настраиваем обработчики
         self._setup_handlers()
     
     def _setup_handlers(self):
         """Настройка обработчиков команд"""
-        # Команды
-        self.app.add_handler(CommandHandler("start", self.cmd_start))
-        self.app.add_handler(CommandHandler("help", self.cmd_help))
-        self.app.add_handler(CommandHandler("menu", self.cmd_menu))
-        self.app.add_handler(CommandHandler("yearstrategy", self.cmd_year_strategy))
-        self.app.add_handler(CommandHandler("marketanalysis", self.cmd_market_analysis))
-        self.app.add_handler(CommandHandler("competitorwatch", self.cmd_competitor_watch))
-        self.app.add_handler(CommandHandler("swotanalysis", self.cmd_swot_analysis))
-        self.app.add_handler(CommandHandler("riskassessment", self.cmd_risk_assessment))
-        self.app.add_handler(CommandHandler("dailyreport", self.cmd_daily_report))
-        self.app.add_handler(CommandHandler("weeklyreport", self.cmd_weekly_report))
-        self.app.add_handler(CommandHandler("status", self.cmd_status))
-        
-        # Обработчик callback кнопок
-        self.app.add_handler(CallbackQueryHandler(self.handle_callback))
+        # Команды и callback кнопок
+        self.commands.install(self.app, self._run_command, self._send_message)
         
         # Обработка текстовых сообщений (должна быть последней!)
         self.app.add_handler(
-            MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message)
+            MessageHandler(
+                filters.TEXT & ~filters.COMMAND,
+                self.commands.instrumented("chat", self.handle_message)
+            )
         )
     
     async def cmd_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -72,202 +108,175 @@ class CEOBot:
 Используй /help или /menu для списка команд.
 """
         
-        # Создаем клавиатуру с основными командами
-        keyboard = [
-            [
-                InlineKeyboardButton("📊 Меню команд", callback_data="menu"),
-                InlineKeyboardButton("❓ Помощь", callback_data="help")
-            ],
-            [
-                InlineKeyboardButton("📈 Анализ рынка", callback_data="market"),
-                InlineKeyboardButton("🎯 Стратегия", callback_data="strategy")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Клавиатура с основными командами (кнопки welcome из реестра)
+        reply_markup = self.commands.keyboard(welcome=True)
         
-        await update.message.reply_text(welcome_text, reply_markup=reply_markup)
+        await self._send_message(update, welcome_text, reply_markup=reply_markup)
         logger.info(f"User {user.id} ({user.username}) started the bot")
     
     async def cmd_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда /menu - показать главное меню"""
-        keyboard = [
-            [
-                InlineKeyboardButton("📊 Годовая стратегия", callback_data="yearstrategy"),
-                InlineKeyboardButton("📈 Анализ рынка", callback_data="marketanalysis")
-            ],
-            [
-                InlineKeyboardButton("👥 Конкуренты", callback_data="competitorwatch"),
-                InlineKeyboardButton("⚖️ SWOT анализ", callback_data="swotanalysis")
-            ],
-            [
-                InlineKeyboardButton("⚠️ Оценка рисков", callback_data="riskassessment"),
-                InlineKeyboardButton("📋 Ежедневный отчет", callback_data="dailyreport")
-            ],
-            [
-                InlineKeyboardButton("📅 Недельный отчет", callback_data="weeklyreport"),
-                InlineKeyboardButton("⚙️ Статус", callback_data="status")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = self.commands.keyboard()
         
-        menu_text = """
-🎯 **Главное меню lil_ken_ceo**
-
-Выберите нужную функцию:
-
-📊 **Аналитика:**
-• Годовая стратегия
-• Анализ рынка
-• Оценка конкурентов
-
-⚖️ **Планирование:**
-• SWOT анализ
-• Оценка рисков
-• Отчеты
-
-Или просто напишите мне вопрос! 💬
-"""
+        menu_text = self.commands.menu_text(
+            "🎯 **Главное меню lil_ken_ceo**\n\nВыберите нужную функцию:",
+            "Или просто напишите мне вопрос! 💬"
+        )
         
         # Проверяем, это callback или обычная команда
         if update.callback_query:
-            await update.callback_query.edit_message_text(menu_text, reply_markup=reply_markup, parse_mode='Markdown')
-        else:
-            await update.message.reply_text(menu_text, reply_markup=reply_markup, parse_mode='Markdown')
-    
-    async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик нажатий на кнопки"""
-        query = update.callback_query
-        await query.answer()
-        
-        callback_data = query.data
-        
-        if callback_data == "menu":
-            # Для меню создаем фейковый update с message
-            fake_update = Update(
-                update_id=update.update_id,
-                message=query.message,
-                callback_query=query
+            await self.outbound.submit(
+                update.effective_chat.id,
+                lambda: update.callback_query.edit_message_text(menu_text, reply_markup=reply_markup, parse_mode='Markdown')
             )
-            await self.cmd_menu(fake_update, context)
-        elif callback_data == "help":
-            await self.cmd_help(update, context)
-        elif callback_data == "market" or callback_data == "marketanalysis":
-            await self.cmd_market_analysis(update, context)
-        elif callback_data == "strategy" or callback_data == "yearstrategy":
-            await self.cmd_year_strategy(update, context)
-        elif callback_data == "competitorwatch":
-            await self.cmd_competitor_watch(update, context)
-        elif callback_data == "swotanalysis":
-            await self.cmd_swot_analysis(update, context)
-        elif callback_data == "riskassessment":
-            await self.cmd_risk_assessment(update, context)
-        elif callback_data == "dailyreport":
-            await self.cmd_daily_report(update, context)
-        elif callback_data == "weeklyreport":
-            await self.cmd_weekly_report(update, context)
-        elif callback_data == "status":
-            await self.cmd_status(update, context)
+        else:
+            await self._send_message(update, menu_text, parse_mode='Markdown', reply_markup=reply_markup)
     
     async def cmd_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда /help"""
-        help_text = """
-📋 **Доступные команды:**
-
-🎯 **Стратегия:**
-/yearstrategy - Годовая стратегия развития
-/swotanalysis - SWOT анализ компании  
-/riskassessment - Оценка бизнес-рисков
-
-📊 **Аналитика:**
-/marketanalysis - Анализ нового рынка
-/competitorwatch - Мониторинг конкурентов
-
-📈 **Отчеты:**
-/dailyreport - Ежедневный отчет
-/weeklyreport - Недельный отчет
-
-⚙️ **Другое:**
-/menu - Главное меню с кнопками
-/status - Статус системы
-/help - Эта справка
-
-💬 **Или просто напишите вопрос!**
-Я отвечу как опытный CEO.
-"""
+        help_text = self.commands.help_text(
+            "📋 **Доступные команды:**",
+            "💬 **Или просто напишите вопрос!**\nЯ отвечу как опытный CEO."
+        )
         
         # Проверяем, это callback или обычная команда
         if update.callback_query:
-            await update.callback_query.edit_message_text(help_text, parse_mode='Markdown')
+            await self.outbound.submit(
+                update.effective_chat.id,
+                lambda: update.callback_query.edit_message_text(help_text, parse_mode='Markdown')
+            )
         else:
-            await update.message.reply_text(help_text, parse_mode='Markdown')
+            await self._send_message(update, help_text, parse_mode='Markdown')
     
-    async def _send_message(self, update: Update, text: str, parse_mode: str = None):
-        """Универсальная функция для отправки сообщений (работает с callback и обычными сообщениями)"""
+    def _reply(
+        self,
+        update: Update,
+        text: str,
+        parse_mode: str = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        **kwargs
+    ) -> OutboundMessage:
+        """Ответ через очередь исходящих сообщений без ожидания отправки"""
         if update.callback_query:
-            await update.callback_query.message.reply_text(text, parse_mode=parse_mode)
+            send = update.callback_query.message.reply_text
         else:
-            await update.message.reply_text(text, parse_mode=parse_mode)
+            send = update.message.reply_text
+        if kwargs:
+            send = functools.partial(send, **kwargs)
+        return self.outbound.reply(update.effective_chat.id, send, text, parse_mode, priority)
     
-    async def cmd_year_strategy(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Команда /yearstrategy"""
-        await self._send_message(update, "🔄 Разрабатываю годовую стратегию...")
-        
-        response = await self.ceo_agent.generate_year_strategy()
-        await self._send_message(update, response, parse_mode='Markdown')
+    async def _send_message(self, update: Update, text: str, parse_mode: str = None, **kwargs):
+        """Универсальная функция для отправки сообщений (работает с callback и обычными сообщениями)"""
+        return await self._reply(update, text, parse_mode, **kwargs).sent()
     
-    async def cmd_market_analysis(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Команда /marketanalysis"""
-        # Для callback запросов используем дефолтную страну
-        if update.callback_query:
-            country = "Россия"
-        else:
-            if not context.args:
-                await self._send_message(update, "Укажите страну для анализа:\n/marketanalysis Бразилия")
-                return
-            country = " ".join(context.args)
+    async def _respond(self, update: Update, placeholder: str, generate, lane: Optional[str] = LANE_REPORTS):
+        """Заглушка, затем ответ агента
         
-        await self._send_message(update, f"🔍 Анализирую рынок {country}...")
+        Генерация ждет слот в очереди планировщика lane (чат или отчеты);
+        lane=None — ответ без LLM, выполняется сразу, вне очередей.
+        В потоковом режиме заглушка редактируется по мере генерации ответа,
+        иначе заменяется ответом после полной генерации. Заглушка не ждет
+        отправки: если ответ готов раньше, уходит одно сообщение с ответом.
+        Сообщения чата отправляются с приоритетом перед отчетами.
+        generate(on_text) — метод агента, принимающий обработчик частичного текста.
+        """
+        priority = PRIORITY_BULK if lane == LANE_REPORTS else PRIORITY_INTERACTIVE
+        message = self._reply(update, placeholder, priority=priority)
+        editor = StreamingEditor(message, settings.STREAM_EDIT_INTERVAL)
+        on_text = editor.update if settings.STREAM_RESPONSES else None
+        # Токены считаются в счетчике команды (реестр), если он уже начат
+        usage = current_usage() or track_usage()
+        started = time.monotonic()
         
-        response = await self.ceo_agent.analyze_market(country)
-        await self._send_message(update, response, parse_mode='Markdown')
-    
-    async def cmd_competitor_watch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Команда /competitorwatch"""
-        await self._send_message(update, "👀 Собираю данные о конкурентах...")
+        try:
+            if lane is None:
+                response = await generate(on_text)
+            else:
+                response = await self.scheduler.run(
+                    lane,
+                    update.effective_user.id,
+                    lambda: generate(on_text)
+                )
+        except SchedulerFullError:
+            await message.edit_text("⏳ Слишком много запросов. Дождитесь ответа на предыдущие.")
+            return
         
-        response = await self.ceo_agent.competitor_analysis()
-        await self._send_message(update, response, parse_mode='Markdown')
-    
-    async def cmd_swot_analysis(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Команда /swotanalysis"""
-        await self._send_message(update, "📊 Провожу SWOT анализ...")
+        response_time = time.monotonic() - started
         
-        response = await self.ceo_agent.swot_analysis()
-        await self._send_message(update, response, parse_mode='Markdown')
-    
-    async def cmd_risk_assessment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Команда /riskassessment"""
-        await self._send_message(update, "⚠️ Оцениваю бизнес-риски...")
+        await editor.finish(response)
         
-        response = await self.ceo_agent.risk_assessment()
-        await self._send_message(update, response, parse_mode='Markdown')
+        self._record_exchange(update, response, usage, response_time)
     
-    async def cmd_daily_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Команда /dailyreport"""
-        await self._send_message(update, "📋 Формирую ежедневный отчет...")
-        
-        response = await self.ceo_agent.daily_report()
-        await self._send_message(update, response, parse_mode='Markdown')
+    def _record_exchange(self, update: Update, response: str, usage: dict, response_time: float):
+        """Постановка обмена репликами в очередь записи в БД (без ожидания)"""
+        if self.message_writer is None:
+            return
+        user = update.effective_user
+        if update.callback_query:
+            user_message = f"/{update.callback_query.data}"
+        else:
+            user_message = update.message.text
+        self.message_writer.record(MessageRecord(
+            telegram_id=user.id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            agent_name=self.ceo_agent.name,
+            user_message=user_message,
+            assistant_message=response,
+            tokens_used=usage["input_tokens"] + usage["output_tokens"],
+            response_time=response_time
+        ))
     
-    async def cmd_weekly_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Команда /weeklyreport"""
-        await self._send_message(update, "📅 Формирую недельный отчет...")
+    async def _run_command(self, update: Update, command: Command, args: Dict[str, Any]):
+        """Ответ агента на команду реестра по классу стоимости
         
-        response = await self.ceo_agent.weekly_report()
-        await self._send_message(update, response, parse_mode='Markdown')
+        Чат — в быстрой очереди, отчеты LLM — в очереди отчетов, ответы без
+        LLM (COST_NONE) — сразу, не дожидаясь тяжелых отчетов.
+        """
+        await self._respond(
+            update,
+            command.placeholder.format(**args),
+            lambda on_text: command.generate(on_text=on_text, **args),
+            lane=COMMAND_LANES[command.cost]
+        )
     
     async def cmd_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда /status"""
+        knowledge = self.ceo_agent.knowledge
+        cache = knowledge.get_cache_stats()
+        inflight = self.ceo_agent.inflight.stats()
+        llm = self.ceo_agent.llm.stats()
+        lanes = self.scheduler.stats()
+        memory = self.ceo_agent.memory.stats()
+        if memory["backend"] == "redis":
+            memory_status = f"Redis, локальный кэш {memory['cached']} записей ({memory['hit_rate']:.0%} попаданий)"
+        else:
+            memory_status = (
+                f"{memory['users']} пользователей, {memory['turns']} реплик, "
+                f"{memory['bytes'] / 1024 / 1024:.1f} МБ"
+            )
+        chat, reports = lanes[LANE_INTERACTIVE], lanes[LANE_REPORTS]
+        if self.message_writer:
+            writes = self.message_writer.stats()
+            database_status = (
+                f"✅ записано {writes['written']}, в очереди {writes['queued']}, "
+                f"отброшено {writes['dropped']}"
+            )
+        else:
+            database_status = "выключена"
+        outbound = self.outbound.stats()
+        commands = sorted(self.commands.stats().items(), key=lambda item: -item[1]["calls"])
+        commands_status = ", ".join(
+            f"/{name} {stats['calls']}× p95 {stats['latency_p95']:.1f}с "
+            f"{stats['input_tokens'] + stats['output_tokens']} токенов"
+            for name, stats in commands[:5]
+        ) or "нет вызовов"
+        if self.webhook:
+            webhook = self.webhook.stats()
+            updates_status = f"webhook, {webhook['queued']} в очереди, {webhook['overflow']} × 503"
+        else:
+            updates_status = settings.BOT_MODE
         status_text = f"""
 ⚙️ **Статус системы lil_ken_ceo**
 
@@ -277,9 +286,19 @@ class CEOBot:
 📝 **Логи:** {settings.LOG_LEVEL}
 
 🔑 **Конфигурация:**
-• Telegram Bot: ✅ Подключен
+• Telegram Bot: ✅ Подключен ({updates_status})
 • Anthropic API: ✅ Активен
-• База знаний: ✅ Работает
+• База знаний: ✅ {await knowledge.get_doc_count()} фрагментов
+• Кэш поиска: {cache['hits']} попаданий / {cache['misses']} промахов
+• Запросы к Claude: {inflight['calls']} вызовов, {inflight['coalesced']} объединено
+• LLM шлюз: {llm['active']} активно, {llm['queued']} в очереди, {llm['retries']} повторов, {llm['rate_limited']} × 429
+• Кэш промптов: {llm['cache_read_tokens']} токенов прочитано / {llm['cache_write_tokens']} записано
+• Очередь чата: {chat['active']} в работе, {chat['queued']} ждут, ожидание p95 {chat['wait_p95']:.1f}с
+• Очередь отчетов: {reports['active']} в работе, {reports['queued']} ждут, ожидание p95 {reports['wait_p95']:.1f}с
+• Память диалогов: {memory_status}
+• База данных: {database_status}
+• Исходящие: {outbound['sent']} отправлено, {outbound['queued']} в очереди, {outbound['coalesced']} объединено, {outbound['retries']} × 429
+• Команды: {commands_status}
 
 💡 **Готов к работе!**
 """
@@ -292,44 +311,235 @@ class CEOBot:
         
         logger.info(f"Message from {user_id}: {user_message}")
         
-        # Показываем "печатает..."
-        await update.message.chat.send_action("typing")
-        
-        # Обрабатываем через агента
-        response = await self.ceo_agent.process_message(user_message, user_id)
-        
-        # Отправляем ответ
-        await update.message.reply_text(response, parse_mode='Markdown')
+        # Свободные вопросы идут в быструю очередь чата, отдельно от отчетов
+        await self._respond(
+            update,
+            "💭 Думаю...",
+            lambda on_text: self.ceo_agent.process_message(user_message, user_id, on_text=on_text),
+            lane=LANE_INTERACTIVE
+        )
     
     async def setup_bot_commands(self):
         """Настройка команд в меню бота"""
-        commands = [
-            BotCommand("start", "Начать работу"),
-            BotCommand("help", "Помощь"),
-            BotCommand("yearstrategy", "Годовая стратегия"),
-            BotCommand("marketanalysis", "Анализ рынка"),
-            BotCommand("competitorwatch", "Мониторинг конкурентов"),
-            BotCommand("swotanalysis", "SWOT анализ"),
-            BotCommand("riskassessment", "Оценка рисков"),
-            BotCommand("dailyreport", "Дневной отчет"),
-            BotCommand("weeklyreport", "Недельный отчет"),
-            BotCommand("status", "Статус системы"),
-        ]
-        await self.app.bot.set_my_commands(commands)
+        await self.app.bot.set_my_commands(self.commands.bot_commands())
     
-    async def start(self):
-        """Запуск бота"""
-        # Настраиваем команды
-        await self.setup_bot_commands()
-        
+    async def startup(self):
+        """Инициализация агента, БД и приложения (без приема обновлений)"""
         # Инициализируем агента
         await self.ceo_agent.initialize()
         
-        # Логируем информацию о запуске с username из конфигурации
-        logger.info(f"🤖 Bot @{settings.TELEGRAM_BOT_USERNAME} started successfully!")
-        logger.info(f"📊 Agent: {settings.AGENT_NAME}")
-        logger.info(f"🌍 Language: {settings.AGENT_LANGUAGE}")
-        logger.info(f"📝 Log level: {settings.LOG_LEVEL}")
+        if self.db:
+            await self.db.connect()
+            self.message_writer.start()
         
-        # Запускаем polling
-        await self.app.run_polling(allowed_updates=Update.ALL_TYPES)
\ No newline at end of file
+        await self.app.initialize()
+        await self.app.start()
+        self.outbound.start()
+    
+    async def process(self, data: dict):
+        """Обработка обновления из JSON (webhook или процесс-обработчик)"""
+        await self.app.process_update(Update.de_json(data, self.app.bot))
+    
+    async def start(self):
+        """Запуск бота
+        
+        Жизненный цикл приложения ведется вручную: initialize/start, затем прием
+        обновлений (long polling или webhook) до SIGINT/SIGTERM, после чего
+        прием останавливается, начатые обновления дообрабатываются, а
+        накопленные сообщения записываются в БД.
+        """
+        allowed_updates = allowed_update_types()
+        
+        try:
+            await self.startup()
+            # Настраиваем команды
+            await self.setup_bot_commands()
+            
+            if settings.BOT_MODE == "webhook":
+                self.webhook = create_webhook_server(self.process, settings.BOT_CONCURRENT_UPDATES)
+                await self.webhook.start()
+                await register_webhook(self.app.bot)
+            elif settings.BOT_MODE == "polling":
+                await self.app.updater.start_polling(allowed_updates=allowed_updates)
+            else:
+                raise ValueError(f"Unknown bot mode: {settings.BOT_MODE}")
+            
+            # Логируем информацию о запуске с username из конфигурации
+            logger.info(f"🤖 Bot @{settings.TELEGRAM_BOT_USERNAME} started successfully!")
+            logger.info(f"📡 Mode: {settings.BOT_MODE}, updates: {', '.join(allowed_updates)}")
+            logger.info(f"📊 Agent: {settings.AGENT_NAME}")
+            logger.info(f"🌍 Language: {settings.AGENT_LANGUAGE}")
+            logger.info(f"📝 Log level: {settings.LOG_LEVEL}")
+            
+            await wait_for_stop_signal()
+        finally:
+            await self.shutdown()
+    
+    async def shutdown(self):
+        """Остановка приема обновлений, дообработка очереди и закрытие соединений"""
+        if self.app.updater and self.app.updater.running:
+            await self.app.updater.stop()
+        if self.webhook:
+            await self.webhook.stop()
+            logger.info(f"📡 Webhook stats: {self.webhook.stats()}")
+            self.webhook = None
+        if self.app.running:
+            await self.app.stop()
+        await self.outbound.stop()
+        await self.app.shutdown()
+        
+        if self.message_writer:
+            await self.message_writer.stop()
+            logger.info(f"💾 Message writer flushed: {self.message_writer.stats()}")
+        if self.db:
+            await self.db.close()
+
+
+# Очередь планировщика по классу стоимости команды (None — без очереди)
+COMMAND_LANES = {COST_NONE: None, COST_CHAT: LANE_INTERACTIVE, COST_REPORT: LANE_REPORTS}
+
+# Собственные команды бота (без LLM); команды агента — в его модуле
+BOT_COMMANDS = [
+    Command("start", "Начать работу", handler=CEOBot.cmd_start),
+    Command(
+        "menu", "Главное меню",
+        handler=CEOBot.cmd_menu,
+        help="Главное меню с кнопками",
+        section="⚙️ **Другое:**",
+        welcome="📊 Меню команд",
+        menu=False
+    ),
+    Command(
+        "status", "Статус системы",
+        handler=CEOBot.cmd_status,
+        section="⚙️ **Другое:**",
+        button="⚙️ Статус"
+    ),
+    Command(
+        "help", "Помощь",
+        handler=CEOBot.cmd_help,
+        help="Эта справка",
+        section="⚙️ **Другое:**",
+        welcome="❓ Помощь"
+    ),
+]
+
+
+def create_registry(bot: Optional[CEOBot] = None) -> CommandRegistry:
+    """Реестр команд бота и агента
+    
+    Без bot обработчики не привязаны — реестр годится для меню и справки
+    (например, в фронт-процессе run_sharded).
+    """
+    if bot:
+        start, *service = [command.bind(bot) for command in BOT_COMMANDS]
+        agent_commands = bot.ceo_agent.commands()
+    else:
+        start, *service = BOT_COMMANDS
+        agent_commands = CEO_COMMANDS
+    registry = CommandRegistry()
+    registry.extend([start, *agent_commands, *service])
+    return registry
+
+
+def allowed_update_types() -> List[str]:
+    return [kind.strip() for kind in settings.BOT_ALLOWED_UPDATES.split(",") if kind.strip()]
+
+
+_webhook_secret: Optional[str] = None
+
+
+def webhook_secret() -> str:
+    """Секрет webhook: WEBHOOK_SECRET_TOKEN или случайный на время работы процесса
+    
+    Случайный секрет передается в setWebhook, так что Telegram его знает,
+    а посторонние запросы на открытый порт отклоняются.
+    """
+    global _webhook_secret
+    if _webhook_secret is None:
+        _webhook_secret = settings.WEBHOOK_SECRET_TOKEN
+        if not _webhook_secret:
+            _webhook_secret = secrets.token_urlsafe(32)
+            logger.warning(
+                "WEBHOOK_SECRET_TOKEN is not set, using a random secret for this run "
+                "(set it to send test updates manually)"
+            )
+    return _webhook_secret
+
+
+def create_webhook_server(process, workers: int) -> WebhookServer:
+    """HTTP сервер webhook по настройкам"""
+    return WebhookServer(
+        process,
+        path=settings.WEBHOOK_PATH,
+        secret_token=webhook_secret(),
+        host=settings.WEBHOOK_HOST,
+        port=settings.WEBHOOK_PORT,
+        queue_size=settings.WEBHOOK_QUEUE_SIZE,
+        workers=workers,
+        allowed_updates=allowed_update_types()
+    )
+
+
+async def register_webhook(bot: Bot):
+    """setWebhook на WEBHOOK_URL (если адрес задан)"""
+    if settings.WEBHOOK_URL:
+        await bot.set_webhook(
+            settings.WEBHOOK_URL.rstrip("/") + settings.WEBHOOK_PATH,
+            allowed_updates=allowed_update_types(),
+            secret_token=webhook_secret(),
+            max_connections=settings.WEBHOOK_MAX_CONNECTIONS
+        )
+
+
+async def wait_for_stop_signal():
+    """Ожидание SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    await stop.wait()
+    logger.info("🛑 Stopping bot...")
+
+
+def create_worker_bot() -> CEOBot:
+    """Бот процесса-обработчика: лимиты аккаунта делятся между процессами"""
+    return CEOBot(shares=settings.BOT_WORKERS)
+
+
+async def run_sharded():
+    """Фронт-процесс: webhook принимает обновления, BOT_WORKERS процессов их обрабатывают
+    
+    Обновления распределяются по chat_id, поэтому порядок внутри чата
+    сохраняется, а память диалогов (даже в процессе) остается согласованной.
+    Кэши ответов и память, общие для процессов, настраиваются как обычно
+    (RESPONSE_CACHE_BACKEND, MEMORY_BACKEND=redis, PostgreSQL).
+    """
+    if settings.BOT_MODE != "webhook":
+        raise ValueError("BOT_WORKERS > 1 requires BOT_MODE=webhook")
+    
+    router = ShardRouter(
+        settings.BOT_WORKERS,
+        create_worker_bot,
+        queue_size=settings.WEBHOOK_QUEUE_SIZE,
+        concurrency=settings.BOT_CONCURRENT_UPDATES,
+        submit_timeout=settings.BOT_WORKER_SUBMIT_TIMEOUT
+    )
+    router.start()
+    # Один поток отправки сохраняет порядок обновлений при передаче в процессы
+    server = create_webhook_server(router.submit, workers=1)
+    try:
+        await router.wait_ready()
+        await server.start()
+        async with Bot(settings.TELEGRAM_BOT_TOKEN) as bot:
+            await bot.set_my_commands(create_registry().bot_commands())
+            await register_webhook(bot)
+        logger.info(f"🤖 Bot @{settings.TELEGRAM_BOT_USERNAME} started with {settings.BOT_WORKERS} workers")
+        await wait_for_stop_signal()
+    finally:
+        await server.stop()
+        await router.stop()
+        logger.info(f"🔀 Shard stats: {router.stats()}")
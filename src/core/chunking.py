@@ -0,0 +1,139 @@
+"""
+Разбиение документов базы знаний на фрагменты (чанки)
+"""
+import re
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from utils.tokens import estimate_word_tokens
+
+_WORD_RE = re.compile(r"\S+")
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+_SENTENCE_END = (".", "!", "?", ":", ";")
+
+
+@dataclass
+class Chunk:
+    """Фрагмент документа со смещениями в исходном тексте"""
+    text: str
+    start: int
+    end: int
+    section: str = ""
+    tokens: int = 0
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = 300,
+    overlap: int = 50,
+    offset: int = 0,
+    section: str = ""
+) -> List[Chunk]:
+    """Разбиение текста на окна по max_tokens токенов с перекрытием overlap
+
+    Граница окна по возможности переносится на конец абзаца или предложения
+    во второй половине окна.
+    """
+    words = [(m.start(), m.end(), estimate_word_tokens(m.group())) for m in _WORD_RE.finditer(text)]
+    chunks: List[Chunk] = []
+    start = 0
+
+    while start < len(words):
+        end, tokens = start, 0
+        while end < len(words) and (end == start or tokens + words[end][2] <= max_tokens):
+            tokens += words[end][2]
+            end += 1
+
+        if end < len(words):
+            end = _find_boundary(text, words, start, end)
+
+        chunk_start, chunk_end = words[start][0], words[end - 1][1]
+        chunks.append(Chunk(
+            text=text[chunk_start:chunk_end],
+            start=offset + chunk_start,
+            end=offset + chunk_end,
+            section=section,
+            tokens=sum(cost for _, _, cost in words[start:end])
+        ))
+
+        if end >= len(words):
+            break
+
+        # Следующее окно начинается с перекрытием, но всегда продвигается вперед
+        next_start, carried = end, 0
+        while next_start - 1 > start and carried + words[next_start - 1][2] <= overlap:
+            next_start -= 1
+            carried += words[next_start][2]
+        start = next_start
+
+    return chunks
+
+
+def _find_boundary(text: str, words: List[Tuple[int, int, int]], start: int, end: int) -> int:
+    """Поиск удобной границы окна: сначала абзац, затем предложение"""
+    lower = start + max(1, (end - start) // 2)
+    sentence_end = None
+    for i in range(end - 1, lower - 1, -1):
+        word_end = words[i][1]
+        gap = text[word_end:words[i + 1][0]]
+        next_char = text[words[i + 1][0]]
+        if "\n\n" in gap or ("\n" in gap and (next_char in "#-*" or next_char.isdigit())):
+            return i + 1
+        if sentence_end is None and text[word_end - 1] in _SENTENCE_END:
+            sentence_end = i + 1
+    return sentence_end or end
+
+
+def split_markdown_sections(text: str) -> List[Tuple[int, int, str]]:
+    """Разбиение markdown по заголовкам: [(start, end, "Заголовок > Подзаголовок"), ...]"""
+    sections: List[Tuple[int, int, str]] = []
+    headings: List[Tuple[int, str]] = []
+    position, title = 0, ""
+
+    for match in _HEADING_RE.finditer(text):
+        if match.start() > position and text[position:match.start()].strip():
+            sections.append((position, match.start(), title))
+        level = len(match.group(1))
+        headings = [(lvl, name) for lvl, name in headings if lvl < level]
+        headings.append((level, match.group(2).strip()))
+        position, title = match.start(), " > ".join(name for _, name in headings)
+
+    if text[position:].strip():
+        sections.append((position, len(text), title))
+    return sections
+
+
+def chunk_markdown(text: str, max_tokens: int = 300, overlap: int = 50) -> List[Chunk]:
+    """Разбиение markdown с учетом заголовков
+
+    Соседние небольшие разделы объединяются, пока помещаются в окно,
+    длинные разделы режутся на окна с перекрытием внутри раздела.
+    """
+    chunks: List[Chunk] = []
+    pending: List[Chunk] = []
+
+    def flush():
+        if pending:
+            first, last = pending[0], pending[-1]
+            chunks.append(Chunk(
+                text=text[first.start:last.end],
+                start=first.start,
+                end=last.end,
+                section=first.section,
+                tokens=sum(chunk.tokens for chunk in pending)
+            ))
+            pending.clear()
+
+    for start, end, section in split_markdown_sections(text):
+        parts = chunk_text(text[start:end], max_tokens, overlap, offset=start, section=section)
+        if len(parts) > 1:
+            flush()
+            chunks.extend(parts)
+            continue
+        part = parts[0]
+        if pending and sum(chunk.tokens for chunk in pending) + part.tokens > max_tokens:
+            flush()
+        pending.append(part)
+
+    flush()
+    return chunks
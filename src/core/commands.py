@@ -0,0 +1,232 @@
+"""
+Реестр команд бота: обработчики, кнопки, меню и справка из одного описания
+"""
+import functools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from telegram import BotCommand, InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import CallbackQueryHandler, CommandHandler
+
+from .llm_gateway import track_usage
+from utils.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+# Класс стоимости команды: без LLM, быстрый ответ в чате, тяжелый отчет
+COST_NONE = "none"
+COST_CHAT = "chat"
+COST_REPORT = "report"
+
+Handler = Callable[[Update, Any], Awaitable[None]]
+
+
+class CommandUsageError(Exception):
+    """Неверные аргументы команды; текст исключения отправляется пользователю"""
+
+
+@dataclass
+class Command:
+    """Описание команды
+
+    Команда задается либо handler(update, context), либо генерацией ответа
+    агентом: generate(**args, on_text=...) -> str с сообщением-заглушкой
+    placeholder (форматируется args). parse_args(update, context) -> args
+    разбирает аргументы или бросает CommandUsageError. button — кнопка в
+    меню (/menu), welcome — кнопка в приветствии (/start). cache_key и
+    cache_ttl — пространство и время жизни кэша ответов LLM для команды.
+    Описания объявляются с функциями класса и привязываются к объекту
+    через bind(): меню и справку можно построить без создания агента.
+    """
+    name: str
+    description: str
+    handler: Optional[Handler] = None
+    generate: Optional[Callable[..., Awaitable[str]]] = None
+    placeholder: str = ""
+    parse_args: Optional[Callable[[Update, Any], Dict[str, Any]]] = None
+    help: Optional[str] = None
+    section: Optional[str] = None
+    button: Optional[str] = None
+    welcome: Optional[str] = None
+    aliases: Tuple[str, ...] = ()
+    cost: str = COST_NONE
+    cache_key: Optional[str] = None
+    cache_ttl: Optional[float] = None
+    menu: bool = True
+
+    def bind(self, owner: Any) -> "Command":
+        """Копия с handler/generate, привязанными к owner (бот, агент)"""
+        return replace(
+            self,
+            handler=self.handler and functools.partial(self.handler, owner),
+            generate=self.generate and functools.partial(self.generate, owner)
+        )
+
+
+@dataclass
+class CommandStats:
+    """Вызовы, ошибки, длительность и токены LLM команды"""
+    calls: int = 0
+    errors: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=500))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "latency_p50": percentile(self.latencies, 0.5),
+            "latency_p95": percentile(self.latencies, 0.95)
+        }
+
+
+class CommandRegistry:
+    """Реестр команд
+
+    Порядок регистрации задает порядок в меню бота, в справке (по разделам)
+    и в клавиатуре меню. Нажатия кнопок находят команду по callback_data
+    (имя или алиас) одним поиском в словаре. Все вызовы — командой, кнопкой
+    или через instrumented() — учитываются в stats().
+    """
+
+    def __init__(self):
+        self._commands: Dict[str, Command] = {}
+        self._callbacks: Dict[str, Command] = {}
+        self._stats: Dict[str, CommandStats] = {}
+        self._handlers: Dict[str, Handler] = {}
+        self._respond: Optional[Callable[[Update, Command, Dict[str, Any]], Awaitable[None]]] = None
+        self._reply: Optional[Callable[[Update, str], Awaitable[Any]]] = None
+
+    def register(self, command: Command) -> Command:
+        if command.name in self._commands:
+            raise ValueError(f"Command already registered: {command.name}")
+        if (command.handler is None) == (command.generate is None):
+            raise ValueError(f"Command {command.name} needs exactly one of handler or generate")
+        self._commands[command.name] = command
+        for data in (command.name, *command.aliases):
+            self._callbacks[data] = command
+        return command
+
+    def extend(self, commands: List[Command]):
+        for command in commands:
+            self.register(command)
+
+    def __iter__(self) -> Iterator[Command]:
+        return iter(self._commands.values())
+
+    def get(self, name: str) -> Optional[Command]:
+        return self._commands.get(name)
+
+    def install(
+        self,
+        application,
+        respond: Callable[[Update, Command, Dict[str, Any]], Awaitable[None]],
+        reply: Callable[[Update, str], Awaitable[Any]]
+    ):
+        """Обработчики команд и кнопок в приложении
+
+        respond(update, command, args) отправляет ответ агента для команд с
+        generate (заглушка, очередь, потоковый вывод), reply(update, text) —
+        подсказку при неверных аргументах.
+        """
+        self._respond = respond
+        self._reply = reply
+        for command in self:
+            application.add_handler(CommandHandler(command.name, self.handler(command.name)))
+        application.add_handler(CallbackQueryHandler(self.handle_callback))
+
+    def handler(self, name: str) -> Handler:
+        """Обработчик команды с учетом вызовов"""
+        handler = self._handlers.get(name)
+        if handler is None:
+            command = self._commands[name]
+            handler = self._handlers[name] = self.instrumented(name, functools.partial(self._run, command))
+        return handler
+
+    def instrumented(self, name: str, handler: Handler) -> Handler:
+        """Обертка, считающая вызовы, ошибки, длительность и токены LLM"""
+        stats = self._stats.setdefault(name, CommandStats())
+
+        async def run(update: Update, context: Any):
+            usage = track_usage()
+            started = time.monotonic()
+            stats.calls += 1
+            try:
+                await handler(update, context)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.latencies.append(time.monotonic() - started)
+                stats.input_tokens += usage["input_tokens"]
+                stats.output_tokens += usage["output_tokens"]
+        return run
+
+    async def _run(self, command: Command, update: Update, context: Any):
+        if command.handler is not None:
+            await command.handler(update, context)
+            return
+
+        try:
+            args = command.parse_args(update, context) if command.parse_args else {}
+        except CommandUsageError as e:
+            await self._reply(update, str(e))
+            return
+        await self._respond(update, command, args)
+
+    async def handle_callback(self, update: Update, context: Any):
+        """Нажатие кнопки: команда по callback_data"""
+        query = update.callback_query
+        await query.answer()
+        command = self._callbacks.get(query.data)
+        if command is None:
+            logger.warning(f"Unknown callback: {query.data}")
+            return
+        await self.handler(command.name)(update, context)
+
+    def bot_commands(self) -> List[BotCommand]:
+        """Команды для меню бота (set_my_commands)"""
+        return [BotCommand(command.name, command.description) for command in self if command.menu]
+
+    def _sections(self, line: Callable[[Command], Optional[str]], header: str, footer: str) -> str:
+        """Текст по разделам в порядке регистрации: строки line(command), кроме None"""
+        sections: Dict[str, List[str]] = {}
+        for command in self:
+            text = line(command) if command.section else None
+            if text is not None:
+                sections.setdefault(command.section, []).append(text)
+        parts = [header] if header else []
+        parts += [f"{section}\n" + "\n".join(lines) for section, lines in sections.items()]
+        if footer:
+            parts.append(footer)
+        return "\n\n".join(parts)
+
+    def help_text(self, header: str = "", footer: str = "") -> str:
+        """Справка: команды по разделам в порядке регистрации"""
+        return self._sections(
+            lambda command: f"/{command.name} - {command.help or command.description}", header, footer
+        )
+
+    def menu_text(self, header: str = "", footer: str = "") -> str:
+        """Текст меню: команды с кнопками по разделам"""
+        return self._sections(
+            lambda command: f"• {command.description}" if command.button else None, header, footer
+        )
+
+    def keyboard(self, columns: int = 2, welcome: bool = False) -> InlineKeyboardMarkup:
+        """Клавиатура меню (кнопки button) или приветствия (кнопки welcome)"""
+        buttons = []
+        for command in self:
+            label = command.welcome if welcome else command.button
+            if label:
+                buttons.append(InlineKeyboardButton(label, callback_data=command.name))
+        return InlineKeyboardMarkup([buttons[i:i + columns] for i in range(0, len(buttons), columns)])
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stats.as_dict() for name, stats in self._stats.items() if stats.calls}
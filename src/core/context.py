@@ -0,0 +1,112 @@
+"""
+Сборка контекста промпта в пределах бюджета токенов
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .hybrid import fit_to_budget, truncate_to_tokens
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_HEADER = "Контекст из базы знаний:"
+
+
+@dataclass
+class AssembledContext:
+    """Части промпта после укладки в бюджет"""
+    system: List[str]
+    question: str
+    history: List[Tuple[str, str]] = field(default_factory=list)
+    context: Optional[str] = None
+    dynamic_system: List[str] = field(default_factory=list)
+    tokens: Dict[str, int] = field(default_factory=dict)
+
+
+class ContextAssembler:
+    """Укладка системного промпта, истории, фрагментов базы знаний и вопроса в бюджет
+
+    Системный промпт и вопрос обязательны (вопрос обрезается, только если не
+    помещается сам по себе). Оставшийся бюджет делится между историей и
+    фрагментами: история берется с последних реплик целыми парами и
+    занимает не больше history_share бюджета, если фрагментам он нужен;
+    фрагменты берутся по порядку ранжирования, не поместившиеся пропускаются.
+    """
+
+    def __init__(self, budget_tokens: int = 4000, history_share: float = 0.4):
+        self.budget_tokens = budget_tokens
+        self.history_share = history_share
+
+    def assemble(
+        self,
+        question: str,
+        system: Sequence[str] = (),
+        passages: Sequence[str] = (),
+        history: Sequence[Tuple[str, str]] = (),
+        dynamic_system: Sequence[str] = ()
+    ) -> AssembledContext:
+        system = [text for text in system if text]
+        dynamic_system = [text for text in dynamic_system if text]
+        system_tokens = sum(estimate_tokens(text) for text in [*system, *dynamic_system])
+        remaining = self.budget_tokens - system_tokens
+        if remaining <= 0:
+            logger.warning(f"System prompt ({system_tokens} tokens) exceeds context budget")
+            remaining = 0
+
+        question_tokens = estimate_tokens(question)
+        if question_tokens > remaining:
+            question = truncate_to_tokens(question, remaining)
+            question_tokens = estimate_tokens(question)
+        remaining -= question_tokens
+
+        # Сначала история получает свою долю, затем фрагменты — остаток,
+        # а неиспользованный фрагментами бюджет снова доступен истории
+        history_budget = int(remaining * self.history_share) if passages else remaining
+        selected_history, history_tokens = self._fit_history(history, history_budget)
+        context, context_tokens = self._fit_passages(passages, remaining - history_tokens)
+        if passages and history:
+            selected_history, history_tokens = self._fit_history(history, remaining - context_tokens)
+
+        return AssembledContext(
+            system=system,
+            question=question,
+            history=selected_history,
+            context=context,
+            dynamic_system=dynamic_system,
+            tokens={
+                "system": system_tokens,
+                "history": history_tokens,
+                "context": context_tokens,
+                "question": question_tokens,
+                "total": system_tokens + history_tokens + context_tokens + question_tokens
+            }
+        )
+
+    @staticmethod
+    def _fit_history(
+        history: Sequence[Tuple[str, str]],
+        budget: int
+    ) -> Tuple[List[Tuple[str, str]], int]:
+        """Последние пары (вопрос, ответ), целиком помещающиеся в бюджет"""
+        selected: List[Tuple[str, str]] = []
+        used = 0
+        for message, response in reversed(history):
+            tokens = estimate_tokens(message) + estimate_tokens(response)
+            if used + tokens > budget:
+                break
+            selected.append((message, response))
+            used += tokens
+        selected.reverse()
+        return selected, used
+
+    @staticmethod
+    def _fit_passages(passages: Sequence[str], budget: int) -> Tuple[Optional[str], int]:
+        """Блок фрагментов базы знаний в пределах бюджета (с заголовком)"""
+        if not passages:
+            return None, 0
+        header_tokens = estimate_tokens(CONTEXT_HEADER)
+        _, selected, used = fit_to_budget(list(passages), budget - header_tokens)
+        if not selected:
+            return None, 0
+        return "\n\n".join([CONTEXT_HEADER] + selected), used + header_tokens
@@ -2,21 +2,30 @@
 Работа с PostgreSQL
 """
 import asyncpg
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from collections import defaultdict
+from datetime import date
 import json
 
 from utils.config import settings
 from utils.logger import setup_logger
+from .cache import TTLCache
+from .migrations import PARTITION_MONTHS_AHEAD, ensure_partitions, migrate, month_start
+from .persistence import MessageRecord
 
 logger = setup_logger("database")
 
+PARTITIONED_TABLES = ("messages", "reports")
+
 
 class Database:
     """Менеджер базы данных"""
     
     def __init__(self):
         self.pool = None
+        # telegram_id -> (id пользователя, профиль)
+        self._users = TTLCache(settings.DATABASE_USER_CACHE_SIZE)
+        self._partitions_month: Optional[date] = None
     
     async def connect(self):
         """Создание пула соединений"""
@@ -26,61 +35,24 @@ class Database:
             max_size=20
         )
         
-        # Создаем таблицы если их нет
-        await self._create_tables()
+        # Схема приводится к последней версии миграций, партиции — на месяцы вперед
+        async with self.pool.acquire() as conn:
+            applied = await migrate(conn)
+            if applied:
+                logger.info(f"Schema migrated to version {applied[-1]}")
+        await self.ensure_partitions()
     
-    async def _create_tables(self):
-        """Создание необходимых таблиц"""
+    async def ensure_partitions(self):
+        """Месячные партиции messages и reports на PARTITION_MONTHS_AHEAD месяцев вперед"""
+        today = date.today()
         async with self.pool.acquire() as conn:
-            # Таблица пользователей
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    telegram_id BIGINT UNIQUE NOT NULL,
-                    username VARCHAR(255),
-                    first_name VARCHAR(255),
-                    last_name VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    updated_at TIMESTAMP DEFAULT NOW()
-                )
-            """)
-            
-            # Таблица сообщений
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER REFERENCES users(id),
-                    agent_name VARCHAR(50),
-                    user_message TEXT,
-                    assistant_message TEXT,
-                    tokens_used INTEGER,
-                    response_time FLOAT,
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            """)
-            
-            # Таблица отчетов
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS reports (
-                    id SERIAL PRIMARY KEY,
-                    agent_name VARCHAR(50),
-                    report_type VARCHAR(50),
-                    content TEXT,
-                    metadata JSONB,
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            """)
-            
-            # Индексы
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_messages_user_agent 
-                ON messages(user_id, agent_name)
-            """)
-            
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_reports_agent_type 
-                ON reports(agent_name, report_type)
-            """)
+            for table in PARTITIONED_TABLES:
+                try:
+                    await ensure_partitions(conn, table, today, month_start(today, PARTITION_MONTHS_AHEAD))
+                except Exception as e:
+                    # Без новой партиции строки идут в {table}_default — запись не останавливаем
+                    logger.error(f"Partitions of {table} not created, rows go to {table}_default: {e}")
+        self._partitions_month = month_start(today)
     
     async def get_or_create_user(
         self, 
@@ -89,52 +61,122 @@ class Database:
         first_name: Optional[str] = None,
         last_name: Optional[str] = None
     ) -> int:
-        """Получение или создание пользователя"""
-        async with self.pool.acquire() as conn:
-            # Пробуем найти пользователя
-            user = await conn.fetchrow(
-                "SELECT id FROM users WHERE telegram_id = $1",
-                telegram_id
-            )
-            
-            if user:
-                # Обновляем информацию
-                await conn.execute("""
-                    UPDATE users 
-                    SET username = $2, 
-                        first_name = $3, 
-                        last_name = $4,
-                        updated_at = NOW()
-                    WHERE telegram_id = $1
-                """, telegram_id, username, first_name, last_name)
-                return user['id']
+        """Получение или создание пользователя (см. get_or_create_users)"""
+        users = await self.get_or_create_users({telegram_id: (username, first_name, last_name)})
+        return users[telegram_id]
+    
+    async def get_or_create_users(self, profiles: Dict[int, Tuple[Optional[str], ...]]) -> Dict[int, int]:
+        """id пользователей по telegram_id -> (username, first_name, last_name)
+        
+        Один запрос (upsert по unnest) на всех пользователей вместо SELECT +
+        UPDATE/INSERT на каждого; профиль перезаписывается, только если имя
+        изменилось. Известные пользователи с тем же профилем берутся из LRU
+        кэша без обращения к БД. Строку, вставленную параллельной
+        транзакцией, upsert не видит (снимок READ COMMITTED взят до ее
+        фиксации) — такие пользователи дочитываются отдельным SELECT.
+        """
+        user_ids: Dict[int, int] = {}
+        missing: Dict[int, Tuple[Optional[str], ...]] = {}
+        for telegram_id, profile in profiles.items():
+            cached = self._users.get(telegram_id)
+            if cached is not None and cached[1] == profile:
+                user_ids[telegram_id] = cached[0]
             else:
-                # Создаем нового пользователя
-                user_id = await conn.fetchval("""
+                missing[telegram_id] = profile
+        if not missing:
+            return user_ids
+        
+        telegram_ids = list(missing)
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                WITH batch AS (
+                    SELECT * FROM unnest($1::bigint[], $2::varchar[], $3::varchar[], $4::varchar[])
+                        AS b(telegram_id, username, first_name, last_name)
+                ),
+                upsert AS (
                     INSERT INTO users (telegram_id, username, first_name, last_name)
-                    VALUES ($1, $2, $3, $4)
-                    RETURNING id
-                """, telegram_id, username, first_name, last_name)
-                return user_id
+                    SELECT telegram_id, username, first_name, last_name FROM batch
+                    ON CONFLICT (telegram_id) DO UPDATE
+                    SET username = EXCLUDED.username,
+                        first_name = EXCLUDED.first_name,
+                        last_name = EXCLUDED.last_name,
+                        updated_at = NOW()
+                    WHERE (users.username, users.first_name, users.last_name)
+                        IS DISTINCT FROM (EXCLUDED.username, EXCLUDED.first_name, EXCLUDED.last_name)
+                    RETURNING telegram_id, id
+                )
+                SELECT telegram_id, id FROM upsert
+                UNION ALL
+                SELECT telegram_id, id FROM users
+                WHERE telegram_id = ANY($1::bigint[])
+                    AND telegram_id NOT IN (SELECT telegram_id FROM upsert)
+            """,
+                telegram_ids,
+                [missing[telegram_id][0] for telegram_id in telegram_ids],
+                [missing[telegram_id][1] for telegram_id in telegram_ids],
+                [missing[telegram_id][2] for telegram_id in telegram_ids]
+            )
+            found = {row["telegram_id"]: row["id"] for row in rows}
+            unseen = [telegram_id for telegram_id in telegram_ids if telegram_id not in found]
+            if unseen:
+                rows = await conn.fetch(
+                    "SELECT telegram_id, id FROM users WHERE telegram_id = ANY($1::bigint[])", unseen
+                )
+                found.update((row["telegram_id"], row["id"]) for row in rows)
+        
+        for telegram_id, user_id in found.items():
+            self._users.set(telegram_id, (user_id, missing[telegram_id]))
+        user_ids.update(found)
+        return user_ids
     
-    async def save_message(
-        self,
-        user_id: int,
-        agent_name: str,
-        user_message: str,
-        assistant_message: str,
-        tokens_used: int = 0,
-        response_time: float = 0
-    ):
-        """Сохранение сообщения"""
+    async def save_messages(self, records: List[MessageRecord]):
+        """Сохранение пачки сообщений одним COPY
+        
+        В той же транзакции пополняется сводка user_stats (одна строка на
+        пользователя из пачки), поэтому статистика не требует агрегации.
+        """
+        if self._partitions_month != month_start(date.today()):
+            await self.ensure_partitions()
+        
+        user_ids = await self.get_or_create_users({
+            record.telegram_id: (record.username, record.first_name, record.last_name)
+            for record in records
+        })
+        
+        rows = []
+        totals: Dict[int, List[float]] = defaultdict(lambda: [0, 0.0])
+        for record in records:
+            user_id = user_ids[record.telegram_id]
+            rows.append((user_id, record.agent_name, record.user_message,
+                         record.assistant_message, record.tokens_used, record.response_time))
+            totals[user_id][0] += 1
+            totals[user_id][1] += record.response_time or 0.0
+        
         async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO messages 
-                (user_id, agent_name, user_message, assistant_message, 
-                 tokens_used, response_time)
-                VALUES ($1, $2, $3, $4, $5, $6)
-            """, user_id, agent_name, user_message, assistant_message, 
-                tokens_used, response_time)
+            async with conn.transaction():
+                await conn.copy_records_to_table(
+                    "messages",
+                    records=rows,
+                    columns=["user_id", "agent_name", "user_message", "assistant_message",
+                             "tokens_used", "response_time"]
+                )
+                # NOW() — время начала транзакции, то же, что created_at у строк COPY
+                await conn.execute("""
+                    INSERT INTO user_stats AS s
+                        (user_id, total_messages, first_message, last_message, total_response_time)
+                    SELECT user_id, count, NOW(), NOW(), response_time
+                    FROM unnest($1::int[], $2::bigint[], $3::float8[])
+                        AS batch(user_id, count, response_time)
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET total_messages = s.total_messages + EXCLUDED.total_messages,
+                        first_message = LEAST(s.first_message, EXCLUDED.first_message),
+                        last_message = GREATEST(s.last_message, EXCLUDED.last_message),
+                        total_response_time = s.total_response_time + EXCLUDED.total_response_time
+                """,
+                    list(totals),
+                    [total[0] for total in totals.values()],
+                    [total[1] for total in totals.values()]
+                )
     
     async def save_report(
         self,
@@ -151,20 +193,27 @@ class Database:
             """, agent_name, report_type, content, json.dumps(metadata))
     
     async def get_user_stats(self, telegram_id: int) -> Dict[str, Any]:
-        """Получение статистики пользователя"""
+        """Получение статистики пользователя (поиск по ключу в сводке user_stats)"""
         async with self.pool.acquire() as conn:
             stats = await conn.fetchrow("""
                 SELECT 
-                    COUNT(*) as total_messages,
-                    MIN(created_at) as first_message,
-                    MAX(created_at) as last_message,
-                    AVG(response_time) as avg_response_time
-                FROM messages m
-                JOIN users u ON m.user_id = u.id
+                    s.total_messages,
+                    s.first_message,
+                    s.last_message,
+                    s.total_response_time / NULLIF(s.total_messages, 0) as avg_response_time
+                FROM users u
+                JOIN user_stats s ON s.user_id = u.id
                 WHERE u.telegram_id = $1
             """, telegram_id)
             
-            return dict(stats) if stats else {}
+            if stats is None:
+                return {
+                    "total_messages": 0,
+                    "first_message": None,
+                    "last_message": None,
+                    "avg_response_time": None
+                }
+            return dict(stats)
     
     async def close(self):
         """Закрытие пула соединений"""
@@ -0,0 +1,119 @@
+"""
+Гибридный поиск: слияние ранжирований, реранкинг, дедупликация и бюджет токенов
+"""
+import re
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+from .search import tokenize
+from utils.tokens import count_tokens, estimate_tokens
+
+_WORD_RE = re.compile(r"\w+")
+
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[Sequence[int]],
+    k: int = RRF_K
+) -> List[Tuple[int, float]]:
+    """Reciprocal rank fusion: score(d) = Σ 1 / (k + rank), результат по убыванию"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_idx in enumerate(ranking, start=1):
+            scores[doc_idx] = scores.get(doc_idx, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def term_coverage(query: str, text: str) -> float:
+    """Доля различных терминов запроса, встречающихся в тексте"""
+    query_terms = set(tokenize(query))
+    if not query_terms:
+        return 0.0
+    return len(query_terms & set(tokenize(text))) / len(query_terms)
+
+
+def rerank_by_coverage(
+    query: str,
+    candidates: List[Tuple[int, float, str]],
+    weight: float = 0.5
+) -> List[Tuple[int, float]]:
+    """Реранкинг кандидатов (doc_idx, fused_score, text) с учетом покрытия запроса
+
+    Слияние рангов не видит, сколько терминов запроса найдено в фрагменте;
+    покрытие добавляется к нормированному fused score.
+    """
+    if not candidates:
+        return []
+    top_score = candidates[0][1] or 1.0
+    reranked = [
+        (doc_idx, score / top_score + weight * term_coverage(query, text))
+        for doc_idx, score, text in candidates
+    ]
+    return sorted(reranked, key=lambda item: item[1], reverse=True)
+
+
+def shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    """Множество словесных n-грамм текста"""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def dedupe_near_duplicates(
+    candidates: List[Tuple[int, str]],
+    threshold: float = 0.8
+) -> List[int]:
+    """Отбрасывание почти дубликатов (Жаккар по шинглам ≥ threshold), порядок сохраняется"""
+    kept: List[int] = []
+    kept_shingles: List[Set[Tuple[str, ...]]] = []
+    for doc_idx, text in candidates:
+        current = shingles(text)
+        duplicate = any(
+            current and other and len(current & other) / len(current | other) >= threshold
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(doc_idx)
+            kept_shingles.append(current)
+    return kept
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Обрезка текста по границе слова, чтобы оценка токенов уложилась в бюджет"""
+    if estimate_tokens(text) <= budget:
+        return text
+    # Один токен резервируется под многоточие
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= budget - 1:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text.rfind(" ", 0, low)
+    return text[:cut if cut > 0 else low].rstrip() + "…"
+
+
+def fit_to_budget(texts: List[str], budget_tokens: int) -> Tuple[List[int], List[str], int]:
+    """Отбор фрагментов по порядку, пока они помещаются в бюджет токенов
+
+    Не поместившиеся фрагменты пропускаются (следующие могут быть короче);
+    если не поместился даже первый, он обрезается. Возвращает позиции
+    выбранных фрагментов, их тексты и суммарную оценку токенов.
+    """
+    positions: List[int] = []
+    selected: List[str] = []
+    used = 0
+    for position, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if used + tokens <= budget_tokens:
+            positions.append(position)
+            selected.append(text)
+            used += tokens
+        elif not selected and budget_tokens > 0:
+            text = truncate_to_tokens(text, budget_tokens)
+            positions.append(position)
+            selected.append(text)
+            used += estimate_tokens(text)
+    return positions, selected, used
@@ -0,0 +1,220 @@
+"""
+Хранение индекса базы знаний на диске (один файл, загрузка через mmap)
+
+Формат файла (little-endian):
+    заголовок   magic, версия, число документов, число терминов, суммарная длина
+                и смещения секций
+    термины     отсортированная по байтам таблица (смещение, длина, смещение
+                постингов, df) — поиск термина двоичным поиском прямо в mmap
+    постинги    пары uint32 (doc_idx, tf)
+    длины       uint32 длина каждого документа в токенах
+    документы   таблица (смещение, длина id, длина текста, длина метаданных)
+    данные      id, текст и JSON метаданных документов подряд
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+MAGIC = b"LKIX"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sIIIQ6Q")
+_TERM = struct.Struct("<QIQI")
+_DOC = struct.Struct("<QIII")
+_PAIR = struct.Struct("<II")
+_UINT = struct.Struct("<I")
+
+_NATIVE_LITTLE = sys.byteorder == "little"
+
+
+class IndexFormatError(Exception):
+    """Файл индекса поврежден или имеет неизвестный формат"""
+
+
+def write_segment(
+    path: Path,
+    documents: Sequence[Tuple[str, str, Dict[str, Any]]],
+    lengths: Sequence[int],
+    postings: Dict[str, List[Tuple[int, int]]]
+):
+    """Атомарная запись индекса: documents — [(id, content, metadata)], постинги по doc_idx"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    terms = sorted((term.encode("utf-8"), pairs) for term, pairs in postings.items())
+    term_blob = b"".join(term for term, _ in terms)
+
+    term_table = bytearray()
+    postings_blob = bytearray()
+    term_offset = 0
+    for term, pairs in terms:
+        term_table += _TERM.pack(term_offset, len(term), len(postings_blob), len(pairs))
+        term_offset += len(term)
+        for doc_idx, tf in sorted(pairs):
+            postings_blob += _PAIR.pack(doc_idx, tf)
+
+    doc_table = bytearray()
+    data_blob = bytearray()
+    for doc_id, content, metadata in documents:
+        raw_id = doc_id.encode("utf-8")
+        raw_content = content.encode("utf-8")
+        raw_meta = json.dumps(metadata, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        doc_table += _DOC.pack(len(data_blob), len(raw_id), len(raw_content), len(raw_meta))
+        data_blob += raw_id + raw_content + raw_meta
+
+    lengths_blob = b"".join(_UINT.pack(length) for length in lengths)
+
+    sections = [term_table, term_blob, postings_blob, lengths_blob, doc_table, data_blob]
+    offsets = []
+    position = _HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(
+            MAGIC, VERSION, len(documents), len(terms), sum(lengths), *offsets
+        ))
+        for section in sections:
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class IndexSegment:
+    """Индекс, отображенный в память только для чтения
+
+    Открытие не читает файл целиком: страницы подгружаются ОС по мере
+    обращения и разделяются между процессами, открывшими тот же файл.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            # Пустой файл нельзя отобразить в память (mmap бросает ValueError)
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                raise IndexFormatError(f"{self.path}: file is too short")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.doc_count, self.term_count, self.total_length,
+         self._terms_at, self._term_blob_at, self._postings_at,
+         self._lengths_at, self._docs_at, self._data_at) = _HEADER.unpack_from(self._mmap)
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise IndexFormatError(f"{self.path}: unsupported index format")
+        if not self._layout_valid():
+            self.close()
+            raise IndexFormatError(f"{self.path}: sections do not match the file size (truncated?)")
+
+        view = memoryview(self._mmap)
+        self._view = view
+        self._lengths = self._uint_array(self._lengths_at, self.doc_count)
+
+    def _layout_valid(self) -> bool:
+        """Секции идут по порядку, таблицы помещаются в свои секции, а последние
+        постинги и данные документов заканчиваются ровно там, где их секции"""
+        size = len(self._mmap)
+        bounds = [
+            _HEADER.size, self._terms_at, self._term_blob_at, self._postings_at,
+            self._lengths_at, self._docs_at, self._data_at, size
+        ]
+        if any(low > high for low, high in zip(bounds, bounds[1:])):
+            return False
+        if (
+            self._terms_at + self.term_count * _TERM.size > self._term_blob_at
+            or self._lengths_at + 4 * self.doc_count > self._docs_at
+            or self._docs_at + self.doc_count * _DOC.size > self._data_at
+        ):
+            return False
+
+        postings_end = self._postings_at
+        if self.term_count:
+            _, _, postings_offset, df = _TERM.unpack_from(
+                self._mmap, self._terms_at + (self.term_count - 1) * _TERM.size
+            )
+            postings_end += postings_offset + df * _PAIR.size
+        data_end = self._data_at
+        if self.doc_count:
+            offset, id_length, content_length, meta_length = _DOC.unpack_from(
+                self._mmap, self._docs_at + (self.doc_count - 1) * _DOC.size
+            )
+            data_end += offset + id_length + content_length + meta_length
+        return postings_end == self._lengths_at and data_end == size
+
+    def _uint_array(self, offset: int, count: int) -> Sequence[int]:
+        if _NATIVE_LITTLE:
+            return self._view[offset:offset + 4 * count].cast("I")
+        return [value for (value,) in _UINT.iter_unpack(self._view[offset:offset + 4 * count])]
+
+    def _term_at(self, i: int) -> Tuple[bytes, int, int]:
+        term_offset, term_length, postings_offset, df = _TERM.unpack_from(
+            self._mmap, self._terms_at + i * _TERM.size
+        )
+        start = self._term_blob_at + term_offset
+        return self._mmap[start:start + term_length], postings_offset, df
+
+    def _pairs(self, postings_offset: int, df: int) -> List[Tuple[int, int]]:
+        values = self._uint_array(self._postings_at + postings_offset, 2 * df)
+        return list(zip(values[::2], values[1::2]))
+
+    def postings(self, term: str) -> List[Tuple[int, int]]:
+        """Постинги термина [(doc_idx, tf), ...] (двоичный поиск по таблице терминов)"""
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            current, postings_offset, df = self._term_at(middle)
+            if current == key:
+                return self._pairs(postings_offset, df)
+            if current < key:
+                low = middle + 1
+            else:
+                high = middle
+        return []
+
+    def iter_postings(self) -> Iterator[Tuple[str, List[Tuple[int, int]]]]:
+        """Перебор всех терминов с постингами (для перестроения индекса)"""
+        for i in range(self.term_count):
+            term, postings_offset, df = self._term_at(i)
+            yield term.decode("utf-8"), self._pairs(postings_offset, df)
+
+    def doc_length(self, doc_idx: int) -> int:
+        return self._lengths[doc_idx]
+
+    def _doc_entry(self, doc_idx: int) -> Tuple[int, int, int, int]:
+        offset, id_length, content_length, meta_length = _DOC.unpack_from(
+            self._mmap, self._docs_at + doc_idx * _DOC.size
+        )
+        return self._data_at + offset, id_length, content_length, meta_length
+
+    def doc_id(self, doc_idx: int) -> str:
+        start, id_length, _, _ = self._doc_entry(doc_idx)
+        return self._mmap[start:start + id_length].decode("utf-8")
+
+    def document(self, doc_idx: int) -> Dict[str, Any]:
+        """Документ в формате базы знаний: {"id", "content", "metadata"}"""
+        start, id_length, content_length, meta_length = self._doc_entry(doc_idx)
+        content_at = start + id_length
+        meta_at = content_at + content_length
+        return {
+            "id": self._mmap[start:content_at].decode("utf-8"),
+            "content": self._mmap[content_at:meta_at].decode("utf-8"),
+            "metadata": json.loads(self._mmap[meta_at:meta_at + meta_length])
+        }
+
+    def close(self):
+        """Закрытие отображения (ссылки на постинги после этого недействительны)"""
+        view = getattr(self, "_view", None)
+        lengths = getattr(self, "_lengths", None)
+        if isinstance(lengths, memoryview):
+            lengths.release()
+        if view is not None:
+            view.release()
+        self._mmap.close()
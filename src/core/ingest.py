@@ -0,0 +1,202 @@
+"""
+Инкрементальная загрузка файлов в базу знаний
+"""
+import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .chunking import chunk_markdown
+from .knowledge import KnowledgeBase
+from utils.logger import setup_logger
+
+logger = setup_logger("knowledge_ingest")
+
+KNOWLEDGE_SUFFIXES = (".txt", ".md")
+
+
+def scan_directory(root: Path) -> Dict[str, Tuple[int, int]]:
+    """Обход каталога за один проход: {source: (mtime_ns, size)}"""
+    files: Dict[str, Tuple[int, int]] = {}
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(KNOWLEDGE_SUFFIXES):
+                    stat = entry.stat()
+                    source = Path(os.path.relpath(entry.path, root)).as_posix()
+                    files[source] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def parse_file(root: str, source: str, max_tokens: int, overlap: int) -> Dict[str, Any]:
+    """Чтение, хеширование и разбиение файла (выполняется в пуле)"""
+    with open(os.path.join(root, source), "rb") as f:
+        raw = f.read()
+    content = raw.decode("utf-8", errors="replace")
+    return {
+        "source": source,
+        "sha256": hashlib.sha256(raw).hexdigest(),
+        "chunks": [
+            (chunk.text, chunk.start, chunk.end, chunk.section)
+            for chunk in chunk_markdown(content, max_tokens, overlap)
+        ]
+    }
+
+
+class KnowledgeIngestor:
+    """Синхронизация каталога базы знаний с индексом
+
+    Манифест хранит для каждого файла mtime, размер, sha256 и число чанков
+    и записывается после сохранения индекса базы знаний на диск.
+    Файлы с неизменными mtime и размером не читаются вовсе, изменившиеся
+    читаются и режутся в пуле потоков/процессов, а переиндексируются только
+    те, у которых поменялся хеш содержимого.
+    """
+
+    def __init__(
+        self,
+        kb: KnowledgeBase,
+        root: Path,
+        manifest_path: Path,
+        max_tokens: int = 300,
+        overlap: int = 50,
+        max_workers: Optional[int] = None,
+        use_processes: bool = False
+    ):
+        self.kb = kb
+        self.root = Path(root)
+        self.manifest_path = Path(manifest_path)
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Manifest {self.manifest_path} is unreadable, full rebuild: {e}")
+            return {}
+
+    def _save_manifest(self, manifest: Dict[str, Dict[str, Any]]):
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.manifest_path)
+
+    def _executor(self) -> Executor:
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingest")
+
+    async def sync(self) -> Dict[str, int]:
+        """Синхронизация: индексируются только новые, измененные и удаленные файлы"""
+        loop = asyncio.get_running_loop()
+        manifest = await loop.run_in_executor(None, self._load_manifest)
+
+        # Манифест описывает содержимое индекса; если индекс пуст — строим заново
+        if manifest and not await self.kb.get_doc_count():
+            manifest = {}
+
+        files = await loop.run_in_executor(None, scan_directory, self.root)
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0, "chunks": 0}
+
+        candidates = []
+        for source, (mtime_ns, size) in files.items():
+            entry = manifest.get(source)
+            if entry and entry["mtime_ns"] == mtime_ns and entry["size"] == size:
+                stats["unchanged"] += 1
+            else:
+                candidates.append(source)
+
+        if candidates:
+            with self._executor() as executor:
+                futures = [self._parse(executor, source) for source in candidates]
+                for future in asyncio.as_completed(futures):
+                    source, parsed = await future
+                    if parsed is None:
+                        # Запись манифеста (если есть) остается: файл перечитается при следующей синхронизации
+                        stats["failed"] += 1
+                        continue
+                    mtime_ns, size = files[source]
+                    entry = manifest.get(source)
+
+                    if entry and entry["sha256"] == parsed["sha256"]:
+                        # Файл «тронут», но содержимое то же — обновляем только stat
+                        entry.update(mtime_ns=mtime_ns, size=size)
+                        stats["unchanged"] += 1
+                        continue
+
+                    if entry:
+                        await self._remove_chunks(source, entry["chunks"])
+                        stats["updated"] += 1
+                    else:
+                        stats["added"] += 1
+
+                    await self._add_chunks(source, parsed["chunks"])
+                    stats["chunks"] += len(parsed["chunks"])
+                    manifest[source] = {
+                        "mtime_ns": mtime_ns,
+                        "size": size,
+                        "sha256": parsed["sha256"],
+                        "chunks": len(parsed["chunks"])
+                    }
+
+        for source in [source for source in manifest if source not in files]:
+            await self._remove_chunks(source, manifest.pop(source)["chunks"])
+            stats["removed"] += 1
+
+        # Индекс сохраняется раньше манифеста, чтобы манифест не описывал
+        # изменения, которых нет в файле индекса
+        if self.kb.index_path and (stats["added"] or stats["updated"] or stats["removed"]):
+            await self.kb.save()
+
+        await loop.run_in_executor(None, self._save_manifest, manifest)
+        logger.info(
+            f"Knowledge sync: +{stats['added']} ~{stats['updated']} -{stats['removed']} "
+            f"={stats['unchanged']} !{stats['failed']} files, {stats['chunks']} chunks indexed"
+        )
+        return stats
+
+    async def _parse(self, executor: Executor, source: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Разбор файла в пуле; None вместо результата, если файл не прочитался"""
+        loop = asyncio.get_running_loop()
+        try:
+            return source, await loop.run_in_executor(
+                executor, parse_file, str(self.root), source, self.max_tokens, self.overlap
+            )
+        except Exception as e:
+            # Файл мог быть удален или стать недоступным после обхода каталога
+            logger.error(f"Knowledge file {source} skipped: {e}")
+            return source, None
+
+    async def _add_chunks(self, source: str, chunks: List[Tuple[str, int, int, str]]):
+        metadata = {
+            "source": source,
+            "category": Path(source).parent.name
+        }
+        if source.endswith(".md"):
+            metadata["format"] = "markdown"
+
+        for i, (text, start, end, section) in enumerate(chunks):
+            await self.kb.add_document(text, f"{source}#{i}", {
+                **metadata,
+                "chunk": i,
+                "start": start,
+                "end": end,
+                "section": section
+            })
+
+    async def _remove_chunks(self, source: str, count: int):
+        for i in range(count):
+            await self.kb.remove_document(f"{source}#{i}")
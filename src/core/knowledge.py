@@ -1,25 +1,169 @@
 """
-Упрощенная база знаний (только в памяти)
+База знаний агента с полнотекстовым поиском (BM25)
 """
+import asyncio
+import heapq
 import logging
+import time
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from pathlib import Path
+from typing import AbstractSet, Dict, Any, Iterator, List, Optional, Set, Tuple
+
+from .hybrid import dedupe_near_duplicates, fit_to_budget, reciprocal_rank_fusion, rerank_by_coverage
+from .cache import TTLCache
+from .index_store import IndexFormatError, IndexSegment, write_segment
+from .search import BM25Index, bm25_top_k, tokenize
+from .vectors import IVFIndex, VectorIndex, create_embedder
+from utils.config import settings
 
 logger = logging.getLogger(__name__)
 
 
 class KnowledgeBase:
-    """Упрощенная база знаний агента (только в памяти)"""
+    """База знаний агента (инвертированный индекс BM25)
+
+    Индекс состоит из двух слоев: сохраненного на диск сегмента, который
+    открывается через mmap, и изменений в памяти поверх него. Документы
+    сегмента имеют номера 0..N-1, документы в памяти — начиная с N.
+
+    Если передан эмбеддер, рядом с индексом ведутся векторы документов для
+    семантического поиска; для больших сегментов строится ANN-индекс IVF.
+    """
     
-    def __init__(self, agent_name: str):
+    def __init__(
+        self,
+        agent_name: str,
+        index_path: Optional[Path] = None,
+        embedder=None,
+        vector_dtype: str = "float32",
+        ann_min_docs: int = 50_000,
+        ann_nprobe: int = 8,
+        cache_size: int = 1024,
+        cache_ttl: Optional[float] = None
+    ):
         self.agent_name = agent_name
-        self.memory_storage: List[Dict[str, Any]] = []  # Хранение в памяти
+        self.index_path = Path(index_path) if index_path else None
+        self.embedder = embedder
+        self.vector_dtype = vector_dtype
+        self.ann_min_docs = ann_min_docs
+        self.ann_nprobe = ann_nprobe
+        # Документы, добавленные в памяти; позиция + N — внутренний номер документа,
+        # удаленные документы заменяются на None
+        self.memory_storage: List[Optional[Dict[str, Any]]] = []
+        self._index = BM25Index()
+        self._segment: Optional[IndexSegment] = None
+        self._deleted: Set[int] = set()
+        self._deleted_length = 0
+        self._id_map: Optional[Dict[str, int]] = {}
+        self._vectors = VectorIndex(embedder.dim, vector_dtype) if embedder else None
+        self._segment_vectors: Optional[VectorIndex] = None
+        self._ann: Optional[IVFIndex] = None
+        # Кэш результатов поиска; любое изменение индекса увеличивает поколение,
+        # и записи прошлых поколений больше не находятся
+        self.generation = 0
+        self._cache = TTLCache(cache_size, cache_ttl)
         logger.info(f"✅ In-memory knowledge base initialized for {agent_name}")
+
+    @classmethod
+    def from_settings(cls, agent_name: str) -> "KnowledgeBase":
+        """База знаний агента с путем индекса и режимом поиска из настроек"""
+        return cls(
+            agent_name,
+            settings.KNOWLEDGE_INDEX_DIR / f"{agent_name}.idx",
+            embedder=create_embedder(settings.KNOWLEDGE_EMBEDDER),
+            vector_dtype=settings.KNOWLEDGE_VECTOR_DTYPE,
+            ann_min_docs=settings.KNOWLEDGE_ANN_MIN_DOCS,
+            ann_nprobe=settings.KNOWLEDGE_ANN_NPROBE,
+            cache_size=settings.KNOWLEDGE_CACHE_SIZE,
+            cache_ttl=settings.KNOWLEDGE_CACHE_TTL or None
+        )
     
     async def initialize(self):
-        """Инициализация базы знаний"""
+        """Инициализация базы знаний (загрузка сохраненного индекса, если он есть)"""
+        if self.index_path and self.index_path.exists():
+            started = time.perf_counter()
+            try:
+                self._open(self.index_path)
+            except (IndexFormatError, ValueError, OSError) as e:
+                # Поврежденный индекс не должен останавливать бота: начинаем с пустой
+                # базы, следующее сохранение перезапишет файл
+                logger.error(f"Knowledge index {self.index_path} is unreadable, starting empty: {e}")
+                self._reset()
+            else:
+                logger.info(
+                    f"Knowledge base for {self.agent_name} loaded from {self.index_path}: "
+                    f"{await self.get_doc_count()} documents in "
+                    f"{(time.perf_counter() - started) * 1000:.1f}ms"
+                )
         logger.info(f"Knowledge base for {self.agent_name} ready")
         return True
+
+    def _open(self, path: Path):
+        segment = IndexSegment(path)
+        if self._segment:
+            self._segment.close()
+        self._segment = segment
+        self._deleted = set()
+        self._deleted_length = 0
+        self.memory_storage = []
+        self._index = BM25Index()
+        # Соответствие id -> номер строится лениво, при первом изменении
+        self._id_map = None
+        self._bump_generation()
+        if self.embedder:
+            self._open_vectors(path)
+
+    def _reset(self):
+        """Пустая база без сегмента на диске"""
+        if self._segment:
+            self._segment.close()
+        self._segment = None
+        self._deleted = set()
+        self._deleted_length = 0
+        self.memory_storage = []
+        self._index = BM25Index()
+        self._id_map = {}
+        self._vectors = VectorIndex(self.embedder.dim, self.vector_dtype) if self.embedder else None
+        self._segment_vectors = None
+        self._ann = None
+        self._bump_generation()
+
+    def _open_vectors(self, path: Path):
+        self._vectors = VectorIndex(self.embedder.dim, self.vector_dtype)
+        self._segment_vectors = VectorIndex.load(path)
+        self._ann = None
+
+        segment_vectors = self._segment_vectors
+        if (
+            segment_vectors is None
+            or segment_vectors.size != self._segment.doc_count
+            or segment_vectors.dim != self.embedder.dim
+        ):
+            # Векторы отсутствуют или от другого эмбеддера: пересчитываем в память
+            logger.warning(f"Vectors for {path} are missing or stale, re-embedding segment")
+            self._segment_vectors = None
+            for doc_idx in range(self._segment.doc_count):
+                self._vectors.add(doc_idx, self._embed(self._segment.document(doc_idx)["content"]))
+            return
+
+        self._ann = IVFIndex.load(path, segment_vectors, self.ann_nprobe)
+
+    def _embed(self, text: str):
+        return self.embedder.embed([text])[0]
+
+    @property
+    def _base(self) -> int:
+        return self._segment.doc_count if self._segment else 0
+
+    @property
+    def _ids(self) -> Dict[str, int]:
+        if self._id_map is None:
+            self._id_map = {
+                self._segment.doc_id(doc_idx): doc_idx
+                for doc_idx in range(self._segment.doc_count)
+                if doc_idx not in self._deleted
+            }
+        return self._id_map
     
     async def add_document(
         self,
@@ -27,7 +171,7 @@ class KnowledgeBase:
         doc_id: str,
         metadata: Optional[Dict[str, Any]] = None
     ) -> str:
-        """Добавление документа в базу знаний"""
+        """Добавление документа в базу знаний (документ с тем же id заменяется)"""
         if metadata is None:
             metadata = {}
         
@@ -38,42 +182,309 @@ class KnowledgeBase:
             "doc_id": doc_id
         })
         
-        # Сохраняем в памяти
+        if doc_id in self._ids:
+            self._remove(doc_id)
+
+        # Сохраняем в памяти и индексируем
+        doc_idx = self._base + len(self.memory_storage)
         self.memory_storage.append({
             "id": doc_id,
             "content": content,
             "metadata": metadata
         })
+        self._ids[doc_id] = doc_idx
+        self._index.add(doc_idx, tokenize(content))
+        if self.embedder:
+            self._vectors.add(doc_idx, self._embed(content))
+        self._bump_generation()
         
-        logger.info(f"Document {doc_id} added to memory storage")
+        logger.debug(f"Document {doc_id} added to memory storage")
         return doc_id
     
+    async def remove_document(self, doc_id: str) -> bool:
+        """Удаление документа из базы знаний"""
+        if doc_id not in self._ids:
+            return False
+        self._remove(doc_id)
+        logger.debug(f"Document {doc_id} removed from memory storage")
+        return True
+
+    def _remove(self, doc_id: str):
+        self._bump_generation()
+        doc_idx = self._ids.pop(doc_id)
+        if self._vectors is not None:
+            self._vectors.remove(doc_idx)
+        if doc_idx < self._base:
+            self._deleted.add(doc_idx)
+            self._deleted_length += self._segment.doc_length(doc_idx)
+            return
+        position = doc_idx - self._base
+        doc = self.memory_storage[position]
+        self._index.remove(doc_idx, tokenize(doc["content"]))
+        self.memory_storage[position] = None
+
+    def _bump_generation(self):
+        self.generation += 1
+        # Записи прошлых поколений недостижимы — освобождаем память сразу
+        if len(self._cache):
+            self._cache.clear()
+
+    def _cache_key(self, kind: str, query: str, *params) -> tuple:
+        # Регистр и лишние пробелы не влияют на результат поиска
+        return (kind, self.generation, " ".join(query.lower().split()), *params)
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Счетчики кэша результатов поиска"""
+        return {**self._cache.stats(), "generation": self.generation}
+
+    def _get_doc(self, doc_idx: int) -> Dict[str, Any]:
+        if doc_idx < self._base:
+            return self._segment.document(doc_idx)
+        return self.memory_storage[doc_idx - self._base]
+
+    def _doc_length(self, doc_idx: int) -> int:
+        if doc_idx < self._base:
+            return self._segment.doc_length(doc_idx)
+        return self._index.doc_lengths[doc_idx]
+
+    def _live_docs(self) -> Iterator[int]:
+        for doc_idx in range(self._base):
+            if doc_idx not in self._deleted:
+                yield doc_idx
+        yield from self._index.doc_lengths
+    
     async def search(
         self,
         query: str,
         n_results: int = 5
     ) -> Dict[str, Any]:
-        """Простой поиск в памяти"""
-        matching_docs = []
-        query_lower = query.lower()
-        
-        for doc in self.memory_storage:
-            if query_lower in doc["content"].lower():
-                matching_docs.append(doc)
-        
-        # Ограничиваем количество результатов
-        matching_docs = matching_docs[:n_results]
-        
+        """Поиск по инвертированному индексу с ранжированием BM25
+
+        Результаты кэшируются; возвращаемый словарь общий для всех
+        обращений с тем же запросом, изменять его нельзя.
+        """
+        key = self._cache_key("search", query, n_results)
+        result = self._cache.get(key)
+        if result is None:
+            result = self._format(self._lexical_hits(query, n_results))
+            self._cache.set(key, result)
+        return result
+
+    def _lexical_hits(self, query: str, n_results: int) -> List[Tuple[int, float]]:
+        postings_lists = []
+        for term in set(tokenize(query)):
+            pairs = self._segment.postings(term) if self._segment else []
+            if self._deleted:
+                pairs = [pair for pair in pairs if pair[0] not in self._deleted]
+            memory_postings = self._index.postings.get(term)
+            if memory_postings:
+                pairs = pairs + list(memory_postings.items())
+            postings_lists.append(pairs)
+
+        total_length = self._index.total_length
+        if self._segment:
+            total_length += self._segment.total_length - self._deleted_length
+
+        return bm25_top_k(
+            postings_lists, self._doc_length, self._doc_count(), total_length,
+            n_results, self._index.k1, self._index.b
+        )
+
+    async def semantic_search(
+        self,
+        query: str,
+        n_results: int = 5
+    ) -> Dict[str, Any]:
+        """Семантический поиск по косинусной близости эмбеддингов"""
+        if not self.embedder:
+            raise RuntimeError(f"Vector search is disabled for {self.agent_name}")
+
+        key = self._cache_key("semantic", query, n_results)
+        result = self._cache.get(key)
+        if result is None:
+            result = self._format(self._semantic_hits(query, n_results))
+            self._cache.set(key, result)
+        return result
+
+    def _semantic_hits(
+        self,
+        query: str,
+        n_results: int,
+        vectors: Optional[VectorIndex] = None,
+        deleted: Optional[AbstractSet[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """Поиск по векторам; vectors и deleted — представление и снимок для поиска в другом потоке"""
+        vectors = vectors if vectors is not None else self._vectors
+        deleted = deleted if deleted is not None else self._deleted
+        query_vector = self._embed(query)
+        hits = vectors.search(query_vector, n_results)
+        if self._segment_vectors is not None:
+            searcher = self._ann or self._segment_vectors
+            hits += searcher.search(query_vector, n_results, exclude=deleted)
+        return heapq.nlargest(n_results, hits, key=lambda hit: hit[1])
+
+    async def hybrid_search(
+        self,
+        query: str,
+        budget_tokens: int = 1500,
+        n_candidates: int = 20
+    ) -> Dict[str, Any]:
+        """Гибридный поиск: BM25 и векторы параллельно, RRF, реранкинг, дедупликация, бюджет
+
+        Векторный поиск (NumPy отпускает GIL) выполняется в пуле потоков, пока
+        BM25 считается в цикле событий. В результат добавляются "timings" —
+        длительность каждого этапа в миллисекундах — и "tokens". При попадании
+        в кэш этапы не выполняются, и в "timings" есть только "cache".
+        """
+        started = time.perf_counter()
+        key = self._cache_key("hybrid", query, budget_tokens, n_candidates)
+        cached = self._cache.get(key)
+        if cached is not None:
+            elapsed = (time.perf_counter() - started) * 1000
+            return {**cached, "timings": {"cache": elapsed, "total": elapsed}}
+
+        result = await self._hybrid_search(query, budget_tokens, n_candidates)
+        # Пока шел векторный поиск, индекс мог измениться — такой результат не кэшируем
+        if key[1] == self.generation:
+            self._cache.set(key, result)
+        return result
+
+    async def _hybrid_search(self, query: str, budget_tokens: int, n_candidates: int) -> Dict[str, Any]:
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+
+        semantic_future = None
+        if self.embedder:
+            # Пока поток ищет, add/remove_document могут менять индекс в цикле событий:
+            # поток получает представление векторов в памяти (без копирования)
+            # и снимок удаленных документов
+            semantic_future = loop.run_in_executor(
+                None, self._timed, timings, "semantic", self._semantic_hits, query, n_candidates,
+                self._vectors.view(), frozenset(self._deleted)
+            )
+        lexical = self._timed(timings, "lexical", self._lexical_hits, query, n_candidates)
+        semantic = await semantic_future if semantic_future else []
+
+        stage = time.perf_counter()
+        fused = reciprocal_rank_fusion([
+            [doc_idx for doc_idx, _ in lexical],
+            [doc_idx for doc_idx, _ in semantic]
+        ])
+        docs = {doc_idx: self._get_doc(doc_idx) for doc_idx, _ in fused}
+        # Документы, удаленные во время векторного поиска, пропускаем
+        fused = [
+            (doc_idx, score) for doc_idx, score in fused
+            if docs[doc_idx] is not None and doc_idx not in self._deleted
+        ]
+        timings["fusion"] = (time.perf_counter() - stage) * 1000
+
+        stage = time.perf_counter()
+        reranked = rerank_by_coverage(
+            query, [(doc_idx, score, docs[doc_idx]["content"]) for doc_idx, score in fused]
+        )
+        timings["rerank"] = (time.perf_counter() - stage) * 1000
+
+        stage = time.perf_counter()
+        kept = dedupe_near_duplicates([(doc_idx, docs[doc_idx]["content"]) for doc_idx, _ in reranked])
+        timings["dedup"] = (time.perf_counter() - stage) * 1000
+
+        stage = time.perf_counter()
+        scores = dict(reranked)
+        positions, texts, used_tokens = fit_to_budget(
+            [docs[doc_idx]["content"] for doc_idx in kept], budget_tokens
+        )
+        selected = [kept[position] for position in positions]
+        timings["budget"] = (time.perf_counter() - stage) * 1000
+        timings["total"] = (time.perf_counter() - started) * 1000
+
+        logger.debug(
+            f"Hybrid search '{query}': " + ", ".join(f"{name} {ms:.2f}ms" for name, ms in timings.items())
+        )
+        result = self._format([(doc_idx, scores[doc_idx]) for doc_idx in selected])
+        # Единственный фрагмент мог быть обрезан под бюджет
+        result["documents"] = [texts]
+        result["timings"] = timings
+        result["tokens"] = used_tokens
+        return result
+
+    @staticmethod
+    def _timed(timings: Dict[str, float], name: str, function, *args):
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            timings[name] = (time.perf_counter() - started) * 1000
+
+    def _format(self, hits) -> Dict[str, Any]:
+        hits = [(doc_idx, score) for doc_idx, score in hits if self._get_doc(doc_idx) is not None]
+        docs = [self._get_doc(doc_idx) for doc_idx, _ in hits]
+
         # Форматируем результат
-        if matching_docs:
-            return {
-                "documents": [[doc["content"] for doc in matching_docs]],
-                "metadatas": [[doc["metadata"] for doc in matching_docs]],
-                "ids": [[doc["id"] for doc in matching_docs]]
-            }
-        
-        return {"documents": [[]]}
+        return {
+            "documents": [[doc["content"] for doc in docs]],
+            "metadatas": [[doc["metadata"] for doc in docs]],
+            "ids": [[doc["id"] for doc in docs]],
+            "scores": [[score for _, score in hits]]
+        }
+
+    async def save(self, path: Optional[Path] = None) -> Path:
+        """Сохранение индекса на диск и переключение на сохраненный файл
+
+        Сегмент и изменения в памяти сливаются в новый файл с плотной
+        нумерацией документов; удаленные документы при этом вычищаются.
+        """
+        path = Path(path) if path else self.index_path
+        if path is None:
+            raise ValueError("Index path is not configured")
+
+        started = time.perf_counter()
+        documents, lengths, remap = [], [], {}
+        for doc_idx in self._live_docs():
+            remap[doc_idx] = len(documents)
+            doc = self._get_doc(doc_idx)
+            documents.append((doc["id"], doc["content"], doc["metadata"]))
+            lengths.append(self._doc_length(doc_idx))
+
+        postings: Dict[str, List] = {}
+        if self._segment:
+            for term, pairs in self._segment.iter_postings():
+                live = [(remap[doc_idx], tf) for doc_idx, tf in pairs if doc_idx in remap]
+                if live:
+                    postings[term] = live
+        for term, memory_postings in self._index.postings.items():
+            postings.setdefault(term, []).extend(
+                (remap[doc_idx], tf) for doc_idx, tf in memory_postings.items()
+            )
+
+        write_segment(path, documents, lengths, postings)
+        if self.embedder:
+            self._save_vectors(path, remap)
+        self.index_path = path
+        self._open(path)
+        logger.info(
+            f"Knowledge base for {self.agent_name} saved to {path}: {len(documents)} documents "
+            f"in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+        return path
+
+    def _save_vectors(self, path: Path, remap: Dict[int, int]):
+        vectors = VectorIndex(self.embedder.dim, self.vector_dtype, capacity=max(1, len(remap)))
+        for doc_idx, new_idx in remap.items():
+            source = self._vectors
+            if doc_idx not in source:
+                source = self._segment_vectors
+            vectors.append_from(source, doc_idx, new_idx)
+        vectors.save(path)
+
+        if vectors.size >= self.ann_min_docs:
+            IVFIndex.train(vectors, nprobe=self.ann_nprobe).save(path)
+        else:
+            IVFIndex.remove_files(path)
+
+    def _doc_count(self) -> int:
+        return self._base - len(self._deleted) + self._index.doc_count
     
     async def get_doc_count(self) -> int:
         """Получение количества документов"""
-        return len(self.memory_storage)
\ No newline at end of file
+        return self._doc_count()
@@ -0,0 +1,387 @@
+"""
+Шлюз к LLM API: общий HTTP клиент, лимиты запросов и токенов, повторы, приоритеты
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import anthropic
+import httpx
+from anthropic import AsyncAnthropic
+
+from utils.config import settings
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Меньшее значение — выше приоритет
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# Время на запрос целиком (очередь, лимиты, повторы), секунды
+DEFAULT_DEADLINES = {
+    PRIORITY_INTERACTIVE: 60.0,
+    PRIORITY_BATCH: 180.0,
+}
+
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+_tracked_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("llm_tracked_usage", default=None)
+
+
+def track_usage() -> Dict[str, int]:
+    """Счетчик токенов вызовов LLM из текущей задачи и порожденных ею задач"""
+    usage = {"input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0}
+    _tracked_usage.set(usage)
+    return usage
+
+
+def current_usage() -> Optional[Dict[str, int]]:
+    """Счетчик, начатый track_usage() выше по стеку вызовов, если есть"""
+    return _tracked_usage.get()
+
+
+class LLMGatewayError(Exception):
+    """Запрос не выполнен шлюзом"""
+
+
+class LLMQueueFullError(LLMGatewayError):
+    """Очередь запросов переполнена"""
+
+
+class LLMDeadlineExceeded(LLMGatewayError):
+    """Запрос не уложился в отведенное время"""
+
+
+class TokenBucket:
+    """Token bucket: rate единиц в минуту, запас до capacity"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Сколько секунд ждать, пока в корзине наберется amount (не больше емкости)"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else 0.0
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ModelLimiter:
+    """Лимиты одной модели: запросы в минуту и токены в минуту"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    async def acquire(self, tokens: int) -> float:
+        """Ожидание свободного места в обеих корзинах; возвращает время ожидания"""
+        waited = 0.0
+        while True:
+            delay = max(self.requests.delay(1), self.tokens.delay(tokens))
+            if delay <= 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+
+class PrioritySlots:
+    """Ограничение числа одновременных запросов с очередью по приоритету
+
+    Ожидающие упорядочены по (приоритет, порядок поступления); очередь
+    ограничена max_queue, сверх нее запрос сразу отклоняется.
+    """
+
+    def __init__(self, max_active: int, max_queue: int):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int):
+        if self.active < self.max_active and not self.queued:
+            self.active += 1
+            return
+        if self.queued >= self.max_queue:
+            raise LLMQueueFullError(f"LLM queue is full ({self.max_queue})")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот мог быть выдан одновременно с отменой — возвращаем его
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class LLMGateway:
+    """Единая точка вызова Claude для всех агентов
+
+    Один AsyncAnthropic поверх общего httpx клиента с пулом соединений,
+    лимиты RPM/TPM на каждую модель, повторы с экспоненциальной задержкой
+    и случайным разбросом, общий дедлайн на запрос и приоритетная очередь
+    (интерактивный чат обслуживается раньше отчетов).
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        rpm: int = 50,
+        tpm: int = 40000,
+        max_concurrency: int = 8,
+        max_queue: int = 100,
+        max_retries: int = 4,
+        timeout: float = 60.0,
+        limits: Optional[Dict[str, Tuple[int, int]]] = None,
+        client: Optional[AsyncAnthropic] = None
+    ):
+        if client is None:
+            self.http = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_concurrency * 2,
+                    max_keepalive_connections=max_concurrency,
+                    keepalive_expiry=60.0
+                ),
+                timeout=httpx.Timeout(timeout, connect=10.0)
+            )
+            # Повторы выполняет шлюз, чтобы учитывать лимиты и дедлайн
+            client = AsyncAnthropic(api_key=api_key, http_client=self.http, max_retries=0)
+        else:
+            self.http = None
+        self.client = client
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self._limits = dict(limits or {})
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self.slots = PrioritySlots(max_concurrency, max_queue)
+
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+
+    def _limiter(self, model: str) -> ModelLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            rpm, tpm = self._limits.get(model, (self.rpm, self.tpm))
+            limiter = self._limiters[model] = ModelLimiter(rpm, tpm)
+        return limiter
+
+    @staticmethod
+    def estimate_request_tokens(request: Dict[str, Any]) -> int:
+        """Оценка токенов запроса: текст system и сообщений плюс max_tokens"""
+        texts = []
+        for item in [request.get("system")] + [m.get("content") for m in request.get("messages", [])]:
+            if isinstance(item, str):
+                texts.append(item)
+            elif isinstance(item, list):
+                texts.extend(block.get("text", "") for block in item if isinstance(block, dict))
+        return sum(estimate_tokens(text) for text in texts) + request.get("max_tokens", 0)
+
+    async def complete(
+        self,
+        request: Dict[str, Any],
+        priority: int = PRIORITY_INTERACTIVE,
+        deadline: Optional[float] = None,
+        on_text: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """Текст ответа модели на запрос messages API
+
+        on_text включает потоковый режим: обработчик получает накопленный
+        текст после каждого фрагмента. deadline — секунды на весь запрос.
+        """
+        if deadline is None:
+            deadline = DEFAULT_DEADLINES.get(priority, DEFAULT_DEADLINES[PRIORITY_BATCH])
+        try:
+            return await asyncio.wait_for(self._complete(request, priority, on_text), deadline)
+        except asyncio.TimeoutError as e:
+            self.errors += 1
+            raise LLMDeadlineExceeded(f"LLM request exceeded deadline of {deadline:g}s") from e
+
+    async def _complete(
+        self,
+        request: Dict[str, Any],
+        priority: int,
+        on_text: Optional[Callable[[str], None]]
+    ) -> str:
+        try:
+            await self.slots.acquire(priority)
+        except LLMQueueFullError:
+            self.rejected += 1
+            raise
+        try:
+            limiter = self._limiter(request["model"])
+            estimated = self.estimate_request_tokens(request)
+            for attempt in range(self.max_retries + 1):
+                self.throttled_seconds += await limiter.acquire(estimated)
+                self.requests += 1
+                try:
+                    text, usage = await self._call(request, on_text)
+                except (anthropic.APIConnectionError, anthropic.APIStatusError) as e:
+                    # Неудачная попытка не расходует токены
+                    limiter.tokens.refund(estimated)
+                    if not self._retryable(e) or attempt == self.max_retries:
+                        self.errors += 1
+                        raise
+                    self.retries += 1
+                    delay = self._backoff(attempt, e)
+                    logger.warning(f"LLM request failed ({e.__class__.__name__}), retry in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                used = self._record_usage(request["model"], usage)
+                if used < estimated:
+                    limiter.tokens.refund(estimated - used)
+                return text
+        finally:
+            self.slots.release()
+
+    async def _call(
+        self,
+        request: Dict[str, Any],
+        on_text: Optional[Callable[[str], None]]
+    ) -> Tuple[str, Any]:
+        if on_text is None:
+            response = await self.client.messages.create(**request)
+            text = response.content[0].text
+        else:
+            text = ""
+            async with self.client.messages.stream(**request) as stream:
+                async for chunk in stream.text_stream:
+                    text += chunk
+                    on_text(text)
+                response = await stream.get_final_message()
+        return text, response.usage
+
+    def _record_usage(self, model: str, usage) -> int:
+        """Учет токенов вызова; возвращает токены, расходующие лимит TPM
+
+        Чтение из кэша промпта дешевле и в лимит не засчитывается.
+        """
+        cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+        self.input_tokens += usage.input_tokens
+        self.output_tokens += usage.output_tokens
+        self.cache_read_tokens += cache_read
+        self.cache_write_tokens += cache_write
+        tracked = _tracked_usage.get()
+        if tracked is not None:
+            tracked["input_tokens"] += usage.input_tokens
+            tracked["output_tokens"] += usage.output_tokens
+            tracked["cache_read_tokens"] += cache_read
+            tracked["cache_write_tokens"] += cache_write
+        logger.info(
+            f"LLM usage {model}: input {usage.input_tokens}, cache read {cache_read}, "
+            f"cache write {cache_write}, output {usage.output_tokens}"
+        )
+        return usage.input_tokens + cache_write + usage.output_tokens
+
+    def _retryable(self, error: Exception) -> bool:
+        if isinstance(error, anthropic.APIConnectionError):
+            return True
+        status = error.status_code
+        if status == 429:
+            self.rate_limited += 1
+        return status in (408, 409, 429) or status >= 500
+
+    @staticmethod
+    def _backoff(attempt: int, error: Exception) -> float:
+        """Задержка перед повтором: retry-after от API или full jitter"""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "rejected": self.rejected,
+            "throttled_seconds": round(self.throttled_seconds, 1),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "active": self.slots.active,
+            "queued": self.slots.queued
+        }
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.aclose()
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def create_gateway(shares: int = 1) -> LLMGateway:
+    """Шлюз по настройкам; лимиты аккаунта делятся на shares процессов"""
+    return LLMGateway(
+        settings.ANTHROPIC_API_KEY,
+        rpm=max(1, settings.LLM_RPM // shares),
+        tpm=max(1, settings.LLM_TPM // shares),
+        max_concurrency=max(1, settings.LLM_MAX_CONCURRENCY // shares),
+        max_queue=settings.LLM_QUEUE_SIZE,
+        max_retries=settings.LLM_MAX_RETRIES,
+        timeout=settings.LLM_TIMEOUT
+    )
+
+
+def get_gateway() -> LLMGateway:
+    """Общий шлюз процесса (создается по настройкам при первом обращении)"""
+    global _gateway
+    if _gateway is None:
+        _gateway = create_gateway()
+    return _gateway
@@ -1,20 +1,71 @@
 """
 Простая память в оперативной памяти
 """
+import json
 import logging
-from typing import Dict, Any, Optional
-from datetime import datetime
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from .cache import TTLCache
+from utils.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Накладные расходы на реплику помимо строк: объект со __slots__, float и ячейка deque
+_TURN_OVERHEAD = 48 + 24 + 8
+
+
+class Turn:
+    """Реплика разговора: вопрос, ответ и время (unix timestamp)"""
+    __slots__ = ("timestamp", "user_message", "bot_response")
+    
+    def __init__(self, timestamp: float, user_message: str, bot_response: str):
+        self.timestamp = timestamp
+        self.user_message = user_message
+        self.bot_response = bot_response
+    
+    @property
+    def size(self) -> int:
+        """Примерный объем в памяти, байт"""
+        return sys.getsizeof(self.user_message) + sys.getsizeof(self.bot_response) + _TURN_OVERHEAD
+
+
+class Conversation:
+    """Разговор пользователя: кольцевой буфер реплик и краткое содержание"""
+    __slots__ = ("turns", "summary", "summary_until", "size")
+    
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)
+        self.summary: Optional[str] = None
+        self.summary_until = 0.0
+        self.size = 0
+
 
 class MemoryManager:
-    """Простой менеджер памяти в оперативной памяти"""
+    """Простой менеджер памяти в оперативной памяти
+    
+    Разговоры хранятся в кольцевых буферах на max_turns реплик. Пользователи
+    упорядочены по последней активности: при превышении max_bytes (или
+    max_users) вытесняются разговоры тех, кто дольше всего не писал.
+    """
     
-    def __init__(self, agent_name: str):
+    def __init__(
+        self,
+        agent_name: str,
+        max_turns: int = 50,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_users: Optional[int] = None
+    ):
         self.agent_name = agent_name
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.max_users = max_users
         self.memory: Dict[str, Any] = {}
-        self.conversations: Dict[int, list] = {}
+        self.conversations: "OrderedDict[int, Conversation]" = OrderedDict()
+        self.total_bytes = 0
+        self.evictions = 0
         logger.info(f"✅ Memory manager initialized for {agent_name}")
     
     async def initialize(self):
@@ -22,26 +73,72 @@ class MemoryManager:
         logger.info(f"Memory manager for {self.agent_name} ready")
         return True
     
+    def _conversation(self, user_id: int, create: bool = False) -> Optional[Conversation]:
+        conversation = self.conversations.get(user_id)
+        if conversation is not None:
+            self.conversations.move_to_end(user_id)
+        elif create:
+            conversation = self.conversations[user_id] = Conversation(self.max_turns)
+        return conversation
+    
     async def save_conversation(self, user_id: int, message: str, response: str):
         """Сохранение разговора"""
-        if user_id not in self.conversations:
-            self.conversations[user_id] = []
+        conversation = self._conversation(user_id, create=True)
+        turn = Turn(time.time(), message, response)
         
-        self.conversations[user_id].append({
-            "timestamp": datetime.now().isoformat(),
-            "user_message": message,
-            "bot_response": response
-        })
+        # Самая старая реплика выпадает из заполненного буфера
+        if len(conversation.turns) == conversation.turns.maxlen:
+            freed = conversation.turns[0].size
+            conversation.size -= freed
+            self.total_bytes -= freed
+        conversation.turns.append(turn)
+        conversation.size += turn.size
+        self.total_bytes += turn.size
         
-        # Ограничиваем историю последними 50 сообщениями
-        if len(self.conversations[user_id]) > 50:
-            self.conversations[user_id] = self.conversations[user_id][-50:]
+        self._evict(keep=user_id)
+    
+    def _evict(self, keep: int):
+        """Вытеснение давно неактивных пользователей сверх лимитов"""
+        while len(self.conversations) > 1 and (
+            self.total_bytes > self.max_bytes
+            or (self.max_users is not None and len(self.conversations) > self.max_users)
+        ):
+            user_id, conversation = self.conversations.popitem(last=False)
+            if user_id == keep:
+                self.conversations[user_id] = conversation
+                break
+            self.total_bytes -= conversation.size
+            self.evictions += 1
     
-    async def get_conversation_history(self, user_id: int, limit: int = 10) -> list:
+    async def get_conversation_history(self, user_id: int, limit: int = 10) -> List[Turn]:
         """Получение истории разговора"""
-        if user_id not in self.conversations:
+        conversation = self._conversation(user_id)
+        if conversation is None:
             return []
-        return self.conversations[user_id][-limit:]
+        turns = conversation.turns
+        start = max(0, len(turns) - limit)
+        return [turns[i] for i in range(start, len(turns))]
+    
+    async def get_summary(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Краткое содержание старой части разговора: {"text", "until"}
+        
+        until — timestamp последней реплики, вошедшей в краткое содержание.
+        """
+        conversation = self.conversations.get(user_id)
+        if conversation is None or conversation.summary is None:
+            return None
+        return {"text": conversation.summary, "until": conversation.summary_until}
+    
+    async def set_summary(self, user_id: int, text: str, until: float):
+        """Сохранение краткого содержания разговора"""
+        conversation = self.conversations.get(user_id)
+        if conversation is None:
+            return
+        delta = sys.getsizeof(text) - (sys.getsizeof(conversation.summary) if conversation.summary else 0)
+        conversation.summary = text
+        conversation.summary_until = until
+        conversation.size += delta
+        self.total_bytes += delta
     
     async def set(self, key: str, value: Any):
         """Сохранение значения"""
@@ -58,5 +155,167 @@ class MemoryManager:
     
     async def clear_user_data(self, user_id: int):
         """Очистка данных пользователя"""
-        if user_id in self.conversations:
-            del self.conversations[user_id]
\ No newline at end of file
+        conversation = self.conversations.pop(user_id, None)
+        if conversation is not None:
+            self.total_bytes -= conversation.size
+    
+    def stats(self) -> Dict[str, Any]:
+        """Использование памяти разговорами"""
+        return {
+            "backend": "memory",
+            "users": len(self.conversations),
+            "turns": sum(len(conversation.turns) for conversation in self.conversations.values()),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions
+        }
+
+
+class RedisMemoryManager:
+    """Менеджер памяти в Redis: общий для нескольких экземпляров бота
+    
+    API совпадает с MemoryManager. Реплики хранятся в списке (новые слева),
+    запись — одним конвейером LPUSH + LTRIM + EXPIRE, поэтому список ограничен
+    max_turns, а данные неактивных пользователей истекают через ttl секунд.
+    Локальный кэш чтения (cache_ttl > 0) не знает о записях других
+    экземпляров, поэтому включается только для одного экземпляра бота
+    (или когда чат всегда обрабатывает один процесс); свои записи сразу
+    применяются и к кэшу.
+    """
+    
+    def __init__(
+        self,
+        agent_name: str,
+        url: str = "redis://localhost:6379",
+        max_turns: int = 50,
+        ttl: int = 30 * 24 * 3600,
+        cache_size: int = 10000,
+        cache_ttl: float = 0.0,
+        client=None
+    ):
+        if client is None:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError as e:
+                raise RuntimeError("Redis memory backend requires redis: pip install redis") from e
+            client = aioredis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.agent_name = agent_name
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.prefix = f"memory:{agent_name}:"
+        self._cache = TTLCache(cache_size, cache_ttl) if cache_ttl > 0 else None
+        logger.info(f"✅ Redis memory manager initialized for {agent_name}")
+    
+    def _key(self, kind: str, name: Any) -> str:
+        return f"{self.prefix}{kind}:{name}"
+    
+    async def initialize(self):
+        """Проверка соединения с Redis"""
+        await self.redis.ping()
+        logger.info(f"Redis memory manager for {self.agent_name} ready")
+        return True
+    
+    async def save_conversation(self, user_id: int, message: str, response: str):
+        """Сохранение разговора"""
+        turn = Turn(time.time(), message, response)
+        key = self._key("turns", user_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.lpush(key, json.dumps([turn.timestamp, message, response], ensure_ascii=False))
+            pipe.ltrim(key, 0, self.max_turns - 1)
+            pipe.expire(key, self.ttl)
+            pipe.expire(self._key("summary", user_id), self.ttl)
+            await pipe.execute()
+        
+        cached = self._cache.get(("turns", user_id)) if self._cache is not None else None
+        if cached is not None:
+            cached.append(turn)
+    
+    async def get_conversation_history(self, user_id: int, limit: int = 10) -> List[Turn]:
+        """Получение истории разговора"""
+        turns = self._cache.get(("turns", user_id)) if self._cache is not None else None
+        if turns is None:
+            raw = await self.redis.lrange(self._key("turns", user_id), 0, self.max_turns - 1)
+            turns = deque(
+                (Turn(*json.loads(item)) for item in reversed(raw)),
+                maxlen=self.max_turns
+            )
+            if self._cache is not None:
+                self._cache.set(("turns", user_id), turns)
+        start = max(0, len(turns) - limit)
+        return [turns[i] for i in range(start, len(turns))]
+    
+    async def get_summary(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Краткое содержание старой части разговора: {"text", "until"}"""
+        summary = self._cache.get(("summary", user_id)) if self._cache is not None else None
+        if summary is None:
+            raw = await self.redis.hgetall(self._key("summary", user_id))
+            summary = {"text": raw["text"], "until": float(raw["until"])} if raw else {}
+            if self._cache is not None:
+                self._cache.set(("summary", user_id), summary)
+        return summary or None
+    
+    async def set_summary(self, user_id: int, text: str, until: float):
+        """Сохранение краткого содержания разговора"""
+        key = self._key("summary", user_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={"text": text, "until": repr(until)})
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+        if self._cache is not None:
+            self._cache.set(("summary", user_id), {"text": text, "until": until})
+    
+    async def set(self, key: str, value: Any):
+        """Сохранение значения"""
+        await self.redis.set(self._key("kv", key), json.dumps(value, ensure_ascii=False), ex=self.ttl)
+    
+    async def get(self, key: str) -> Optional[Any]:
+        """Получение значения"""
+        value = await self.redis.get(self._key("kv", key))
+        return json.loads(value) if value is not None else None
+    
+    async def delete(self, key: str):
+        """Удаление значения"""
+        await self.redis.delete(self._key("kv", key))
+    
+    async def clear_user_data(self, user_id: int):
+        """Очистка данных пользователя"""
+        await self.redis.delete(self._key("turns", user_id), self._key("summary", user_id))
+        if self._cache is not None:
+            self._cache.delete(("turns", user_id))
+            self._cache.delete(("summary", user_id))
+    
+    def stats(self) -> Dict[str, Any]:
+        """Локальный кэш чтения (данные разговоров хранятся в Redis)"""
+        if self._cache is None:
+            return {"backend": "redis", "cached": 0, "hits": 0, "misses": 0, "hit_rate": 0.0}
+        cache = self._cache.stats()
+        return {
+            "backend": "redis",
+            "cached": cache["size"],
+            "hits": cache["hits"],
+            "misses": cache["misses"],
+            "hit_rate": cache["hit_rate"]
+        }
+    
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_memory_manager(agent_name: str):
+    """Менеджер памяти по настройкам: в процессе (memory) или в Redis (redis)"""
+    if settings.MEMORY_BACKEND == "redis":
+        return RedisMemoryManager(
+            agent_name,
+            url=settings.REDIS_URL,
+            max_turns=settings.MEMORY_MAX_TURNS,
+            ttl=settings.MEMORY_TTL_DAYS * 24 * 3600,
+            cache_ttl=settings.MEMORY_REDIS_CACHE_TTL
+        )
+    if settings.MEMORY_BACKEND != "memory":
+        raise ValueError(f"Unknown memory backend: {settings.MEMORY_BACKEND}")
+    return MemoryManager(
+        agent_name,
+        max_turns=settings.MEMORY_MAX_TURNS,
+        max_bytes=settings.MEMORY_MAX_MB * 1024 * 1024
+    )
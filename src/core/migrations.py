@@ -0,0 +1,234 @@
+"""
+Версионные миграции схемы PostgreSQL
+"""
+from datetime import date
+from typing import Awaitable, Callable, List, Tuple
+
+from utils.logger import setup_logger
+
+logger = setup_logger("migrations")
+
+# Ключ advisory lock: миграции нескольких экземпляров бота не пересекаются
+MIGRATION_LOCK_ID = 7_302_114
+
+# Месячные партиции создаются заранее на столько месяцев вперед
+PARTITION_MONTHS_AHEAD = 2
+
+
+def month_start(day: date, shift: int = 0) -> date:
+    """Первое число месяца day, сдвинутого на shift месяцев"""
+    index = day.year * 12 + day.month - 1 + shift
+    return date(index // 12, index % 12 + 1, 1)
+
+
+async def ensure_partitions(conn, table: str, start: date, end: date):
+    """Месячные партиции table для всех месяцев с start по end включительно
+
+    Строки месяца без партиции попадают в {table}_default, и CREATE TABLE
+    ... PARTITION OF для этого месяца завершился бы ошибкой. Поэтому
+    партиция создается отдельной таблицей, строки ее месяца переносятся из
+    default, затем она подключается (ATTACH PARTITION). На время переноса
+    запись в default блокируется; создание партиций разными процессами
+    упорядочено advisory lock миграций.
+    """
+    month = month_start(start)
+    while month <= end:
+        name = f"{table}_y{month.year}m{month.month:02d}"
+        if await conn.fetchval("SELECT to_regclass($1)", name) is None:
+            await _create_partition(conn, table, name, month, month_start(month, 1))
+        month = month_start(month, 1)
+
+
+async def _create_partition(conn, table: str, name: str, month: date, following: date):
+    """Партиция name за [month, following) со строками этого месяца из default"""
+    default = f"{table}_default"
+    async with conn.transaction():
+        # Несколько процессов могут создавать партицию одновременно (смена месяца):
+        # создает один, остальные после блокировки видят готовую партицию
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_ID)
+        if await conn.fetchval("SELECT to_regclass($1)", name) is not None:
+            return
+        await conn.execute(f"LOCK TABLE {default} IN SHARE ROW EXCLUSIVE MODE")
+        await conn.execute(f"""
+            CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        """)
+        moved = await conn.execute(f"""
+            WITH moved AS (
+                DELETE FROM {default}
+                WHERE created_at >= '{month.isoformat()}' AND created_at < '{following.isoformat()}'
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """)
+        await conn.execute(f"""
+            ALTER TABLE {table} ATTACH PARTITION {name}
+            FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')
+        """)
+    if moved != "INSERT 0 0":
+        logger.warning(f"{name}: rows moved from {default} ({moved})")
+
+
+async def _baseline(conn):
+    """Исходная схема (таблицы, которые раньше создавались при каждом подключении)"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            telegram_id BIGINT UNIQUE NOT NULL,
+            username VARCHAR(255),
+            first_name VARCHAR(255),
+            last_name VARCHAR(255),
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id),
+            agent_name VARCHAR(50),
+            user_message TEXT,
+            assistant_message TEXT,
+            tokens_used INTEGER,
+            response_time FLOAT,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS reports (
+            id SERIAL PRIMARY KEY,
+            agent_name VARCHAR(50),
+            report_type VARCHAR(50),
+            content TEXT,
+            metadata JSONB,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_user_agent
+        ON messages(user_id, agent_name)
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reports_agent_type
+        ON reports(agent_name, report_type)
+    """)
+
+
+async def _repartition(conn, table: str, columns: str, indexes: List[str]):
+    """Перенос таблицы в секционированную по created_at с месячными партициями
+
+    Старая таблица переименовывается, данные копируются в партиции
+    (охватывающие весь диапазон дат), последовательность id продолжается.
+    """
+    legacy = f"{table}_legacy"
+    await conn.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    await conn.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey")
+    await conn.execute(f"""
+        CREATE TABLE {table} (
+            id BIGSERIAL,
+            {columns},
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    await conn.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    for index in indexes:
+        await conn.execute(index)
+
+    today = date.today()
+    first = await conn.fetchval(f"SELECT MIN(created_at) FROM {legacy}")
+    start = first.date() if first else today
+    await ensure_partitions(conn, table, start, month_start(today, PARTITION_MONTHS_AHEAD))
+
+    copied = await conn.execute(f"""
+        INSERT INTO {table}
+        SELECT id, {', '.join(_column_names(columns))}, COALESCE(created_at, NOW())
+        FROM {legacy}
+    """)
+    await conn.execute(f"""
+        SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false)
+        FROM {table}
+    """)
+    await conn.execute(f"DROP TABLE {legacy}")
+    logger.info(f"{table} partitioned by month ({copied})")
+
+
+def _column_names(columns: str) -> List[str]:
+    return [line.strip().split()[0] for line in columns.split(",") if line.strip()]
+
+
+_MESSAGE_COLUMNS = """
+    user_id INTEGER REFERENCES users(id),
+    agent_name VARCHAR(50),
+    user_message TEXT,
+    assistant_message TEXT,
+    tokens_used INTEGER,
+    response_time FLOAT
+"""
+
+_REPORT_COLUMNS = """
+    agent_name VARCHAR(50),
+    report_type VARCHAR(50),
+    content TEXT,
+    metadata JSONB
+"""
+
+
+async def _partition_messages(conn):
+    """messages и reports по месяцам; индекс (user_id, created_at) вместо (user_id, agent_name)"""
+    await _repartition(conn, "messages", _MESSAGE_COLUMNS, [
+        "CREATE INDEX idx_messages_user_created ON messages (user_id, created_at)",
+    ])
+    await _repartition(conn, "reports", _REPORT_COLUMNS, [
+        "CREATE INDEX idx_reports_agent_type_created ON reports (agent_name, report_type, created_at)",
+    ])
+
+
+async def _user_stats(conn):
+    """Сводная статистика по пользователю, пополняемая при каждой записи сообщений"""
+    await conn.execute("""
+        CREATE TABLE user_stats (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id),
+            total_messages BIGINT NOT NULL DEFAULT 0,
+            first_message TIMESTAMP,
+            last_message TIMESTAMP,
+            total_response_time DOUBLE PRECISION NOT NULL DEFAULT 0
+        )
+    """)
+    await conn.execute("""
+        INSERT INTO user_stats (user_id, total_messages, first_message, last_message, total_response_time)
+        SELECT user_id, COUNT(*), MIN(created_at), MAX(created_at), COALESCE(SUM(response_time), 0)
+        FROM messages
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+    """)
+
+
+# (версия, название, применение); новые миграции добавляются только в конец
+MIGRATIONS: List[Tuple[int, str, Callable[..., Awaitable[None]]]] = [
+    (1, "baseline", _baseline),
+    (2, "partition_messages_reports", _partition_messages),
+    (3, "user_stats_rollup", _user_stats),
+]
+
+
+async def migrate(conn) -> List[int]:
+    """Применение недостающих миграций в одной транзакции; возвращает их версии"""
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_ID)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+        applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+
+        pending = [migration for migration in MIGRATIONS if migration[0] not in applied]
+        for version, name, apply in pending:
+            await apply(conn)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name
+            )
+            logger.info(f"Applied migration {version:03d} {name}")
+        return [version for version, _, _ in pending]
@@ -0,0 +1,332 @@
+"""
+Очередь исходящих сообщений Telegram с ограничением частоты (flood control)
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from telegram import Message
+from telegram.error import RetryAfter
+
+from .llm_gateway import TokenBucket
+from .streaming import _seconds
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: ответы в чате раньше отчетов и служебных сообщений
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+
+class _Operation:
+    """Вызов Bot API в очереди чата"""
+    __slots__ = ("call", "priority", "key", "future", "attempts")
+
+    def __init__(self, call: Callable[[], Awaitable[Any]], priority: int, key: Any):
+        self.call = call
+        self.priority = priority
+        self.key = key
+        self.future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        self.attempts = 0
+
+
+class OutboundDispatcher:
+    """Отправка сообщений в пределах лимитов Telegram
+
+    Каждый вызов (отправка, правка) ставится в очередь своего чата и
+    выполняется, когда есть токены в общей корзине (global_rate в секунду)
+    и в корзине чата (chat_rate в секунду, group_rate в минуту для групп,
+    запас burst). Вызовы одного чата выполняются строго по очереди, между
+    чатами первым идет более высокий приоритет. RetryAfter приостанавливает
+    чат на указанное время и повторяет вызов (до max_retries раз). Правки
+    с одинаковым key, еще не отправленные, объединяются — уходит последняя.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        group_rate: float = 20.0,
+        burst: float = 3.0,
+        max_retries: int = 3,
+        max_chats: int = 10000
+    ):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._global = TokenBucket(global_rate * 60, capacity=global_rate)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._paused: Dict[int, float] = {}
+        self._queues: Dict[int, Deque[_Operation]] = {}
+        self._busy: Set[int] = set()
+        self._ready: List[tuple] = []
+        self._order = itertools.count()
+        self._tasks: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def start(self):
+        if self._runner is None:
+            self._stopping = False
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 30.0):
+        """Отправка всего накопленного (не дольше timeout секунд) и остановка"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._runner is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._runner), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Outbound queue not drained, {self.queued} calls left")
+                self._runner.cancel()
+            self._runner = None
+
+    @property
+    def queued(self) -> int:
+        return sum(len(operations) for operations in self._queues.values())
+
+    def enqueue(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_INTERACTIVE,
+        key: Any = None
+    ) -> "asyncio.Future[Any]":
+        """Постановка вызова в очередь чата; результат — future ответа API"""
+        operations = self._queues.get(chat_id)
+        if operations is None:
+            operations = self._queues[chat_id] = deque()
+        if key is not None:
+            for operation in operations:
+                if operation.key == key:
+                    operation.call = call
+                    operation.priority = min(operation.priority, priority)
+                    self.coalesced += 1
+                    return operation.future
+
+        operation = _Operation(call, priority, key)
+        operations.append(operation)
+        if len(operations) == 1 and chat_id not in self._busy:
+            self._schedule(chat_id)
+        self.max_depth = max(self.max_depth, self.queued)
+        self._wakeup.set()
+        return operation.future
+
+    async def submit(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_INTERACTIVE,
+        key: Any = None
+    ) -> Any:
+        """Вызов через очередь с ожиданием результата"""
+        return await self.enqueue(chat_id, call, priority, key)
+
+    def reply(
+        self,
+        chat_id: int,
+        send: Callable[..., Awaitable[Message]],
+        text: str,
+        parse_mode: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE
+    ) -> "OutboundMessage":
+        """Сообщение через очередь без ожидания отправки (см. OutboundMessage)"""
+        return OutboundMessage(self, chat_id, send, text, parse_mode, priority)
+
+    def _schedule(self, chat_id: int):
+        head = self._queues[chat_id][0]
+        heapq.heappush(self._ready, (head.priority, next(self._order), chat_id))
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_chats:
+                self._prune()
+            # Отрицательный id — группа или канал, у них лимит в минуту
+            rate = self.group_rate if chat_id < 0 else self.chat_rate * 60
+            bucket = self._buckets[chat_id] = TokenBucket(rate, capacity=self.burst)
+        return bucket
+
+    def _prune(self):
+        """Удаление корзин простаивающих чатов (полные корзины без очереди)"""
+        for chat_id, bucket in list(self._buckets.items()):
+            if chat_id not in self._queues and bucket.delay(bucket.capacity) == 0:
+                del self._buckets[chat_id]
+                self._paused.pop(chat_id, None)
+
+    def _chat_delay(self, chat_id: int) -> float:
+        paused = self._paused.get(chat_id, 0.0) - time.monotonic()
+        return max(paused, self._bucket(chat_id).delay(1))
+
+    def _pick(self):
+        """Чат с наивысшим приоритетом, которому можно отправлять сейчас
+
+        Возвращает (chat_id, None) или (None, сколько ждать до ближайшего).
+        """
+        deferred = []
+        chosen = None
+        wait: Optional[float] = None
+        while self._ready:
+            entry = heapq.heappop(self._ready)
+            delay = self._chat_delay(entry[2])
+            if delay <= 0:
+                chosen = entry[2]
+                break
+            deferred.append(entry)
+            wait = delay if wait is None else min(wait, delay)
+        for entry in deferred:
+            heapq.heappush(self._ready, entry)
+        return chosen, wait
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if self._stopping and not self._queues:
+                break
+
+            delay = self._global.delay(1)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            chat_id, wait = self._pick()
+            if chat_id is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._global.take(1)
+            self._bucket(chat_id).take(1)
+            operation = self._queues[chat_id].popleft()
+            self._busy.add(chat_id)
+            task = asyncio.create_task(self._execute(chat_id, operation))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _execute(self, chat_id: int, operation: _Operation):
+        try:
+            result = await operation.call()
+        except RetryAfter as e:
+            operation.attempts += 1
+            if operation.attempts <= self.max_retries:
+                # Чат на паузе, вызов возвращается в начало его очереди
+                self.retries += 1
+                self._paused[chat_id] = time.monotonic() + _seconds(e.retry_after)
+                self._queues[chat_id].appendleft(operation)
+                logger.warning(f"Flood control for chat {chat_id}: retry in {_seconds(e.retry_after):g}s")
+            else:
+                self.failed += 1
+                if not operation.future.done():
+                    operation.future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            if not operation.future.done():
+                operation.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not operation.future.done():
+                operation.future.set_result(result)
+        finally:
+            self._busy.discard(chat_id)
+            if self._queues[chat_id]:
+                self._schedule(chat_id)
+            else:
+                del self._queues[chat_id]
+            self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "max_depth": self.max_depth,
+            "in_flight": len(self._busy),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "failed": self.failed
+        }
+
+
+class OutboundMessage:
+    """Сообщение, отправляемое через очередь
+
+    Поддерживает edit_text/reply_text как telegram.Message (для
+    StreamingEditor). Пока отправка ждет в очереди, правка просто заменяет
+    текст — заглушка и быстрый ответ уходят одним sendMessage; после
+    отправки правки идут через очередь и объединяются между собой.
+    """
+
+    def __init__(
+        self,
+        dispatcher: OutboundDispatcher,
+        chat_id: int,
+        send: Callable[..., Awaitable[Message]],
+        text: str,
+        parse_mode: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE
+    ):
+        self.dispatcher = dispatcher
+        self.chat_id = chat_id
+        self.priority = priority
+        self.message: Optional[Message] = None
+        self._send = send
+        self._text = text
+        self._parse_mode = parse_mode
+        self._started = False
+        self._sent = dispatcher.enqueue(chat_id, self._deliver, priority)
+        # Ошибку отправки получит следующая правка; без ожидающих она не логируется как потерянная
+        self._sent.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+    async def _deliver(self) -> Message:
+        self._started = True
+        self.message = await self._send(self._text, parse_mode=self._parse_mode)
+        return self.message
+
+    async def sent(self) -> Message:
+        """Ожидание отправки"""
+        return await self._sent
+
+    async def edit_text(self, text: str, parse_mode: Optional[str] = None):
+        if not self._started:
+            self._text, self._parse_mode = text, parse_mode
+            self.dispatcher.coalesced += 1
+            return await self._sent
+        return await self.dispatcher.submit(
+            self.chat_id,
+            lambda: self._edit(text, parse_mode),
+            self.priority,
+            key=("edit", id(self))
+        )
+
+    async def _edit(self, text: str, parse_mode: Optional[str]):
+        if self.message is None:
+            # Первая отправка не удалась (например, ошибка разметки) — отправляем заново
+            self._text, self._parse_mode = text, parse_mode
+            return await self._deliver()
+        return await self.message.edit_text(text, parse_mode=parse_mode)
+
+    async def reply_text(self, text: str, parse_mode: Optional[str] = None) -> Message:
+        async def send():
+            if self.message is None:
+                return await self._send(text, parse_mode=parse_mode)
+            return await self.message.reply_text(text, parse_mode=parse_mode)
+        return await self.dispatcher.submit(self.chat_id, send, self.priority)
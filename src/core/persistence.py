@@ -0,0 +1,133 @@
+"""
+Фоновая запись диалогов в базу данных (write-behind)
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MessageRecord(NamedTuple):
+    """Обмен репликами для сохранения в таблицу messages"""
+    telegram_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    agent_name: str
+    user_message: str
+    assistant_message: str
+    tokens_used: int
+    response_time: float
+
+
+class MessageWriter:
+    """Очередь записи сообщений в БД пачками
+
+    record() не ждет базу: запись кладется в ограниченный буфер, фоновая
+    задача сбрасывает его пачками (COPY) по размеру пачки или по интервалу.
+    Если буфер полон, новые записи отбрасываются и учитываются в метриках;
+    при остановке буфер сбрасывается полностью.
+    """
+
+    def __init__(
+        self,
+        db,
+        max_buffer: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0
+    ):
+        self.db = db
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: Deque[MessageRecord] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+
+    def record(self, record: MessageRecord) -> bool:
+        """Постановка записи в очередь; False, если буфер переполнен"""
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return False
+        self._buffer.append(record)
+        self.recorded += 1
+        self.max_depth = max(self.max_depth, len(self._buffer))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка с записью всего накопленного"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        while self._buffer:
+            if not await self._flush():
+                break
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._buffer and not self._stopping:
+                if not await self._flush() or len(self._buffer) < self.batch_size:
+                    break
+
+    async def _flush(self) -> bool:
+        batch: List[MessageRecord] = []
+        while self._buffer and len(batch) < self.batch_size:
+            batch.append(self._buffer.popleft())
+        if not batch:
+            return True
+
+        started = time.perf_counter()
+        try:
+            await self.db.save_messages(batch)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to write {len(batch)} messages: {e}")
+            # Пачка возвращается в начало очереди, если для нее есть место
+            free = self.max_buffer - len(self._buffer)
+            if free < len(batch):
+                self.dropped += len(batch) - free
+                batch = batch[:free]
+            self._buffer.extendleft(reversed(batch))
+            return False
+
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        self.written += len(batch)
+        self.batches += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._buffer),
+            "max_depth": self.max_depth,
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "errors": self.errors,
+            "last_flush_ms": self.last_flush_ms
+        }
@@ -0,0 +1,63 @@
+"""
+Сборка запросов к Claude с кэшируемыми префиксами (prompt caching)
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Провайдер кэширует префикс запроса до блока с этой пометкой (TTL около 5 минут)
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Более короткий префикс провайдер не кэширует (пометка не действует)
+CACHE_MIN_TOKENS = 1024
+
+
+def text_block(text: str, cache: bool = False) -> Dict[str, Any]:
+    block: Dict[str, Any] = {"type": "text", "text": text}
+    if cache:
+        block["cache_control"] = CACHE_CONTROL
+    return block
+
+
+def build_request(
+    model: str,
+    user: str,
+    system: Sequence[str] = (),
+    context: Optional[str] = None,
+    history: Sequence[Tuple[str, str]] = (),
+    max_tokens: int = 1000,
+    dynamic_system: Sequence[str] = ()
+) -> Dict[str, Any]:
+    """Запрос messages API: стабильные части в начале, изменяемые в конце
+
+    system — постоянные инструкции (роль, стиль); конец этого префикса
+    помечается для кэширования. context — найденные фрагменты базы знаний,
+    отдельный кэшируемый блок: одинаковый контекст повторяется у команд
+    с одним и тем же поиском. dynamic_system — изменчивые инструкции
+    (например, краткое содержание разговора пользователя): идут после
+    кэшируемых блоков без пометки, чтобы не менять их ключ кэша.
+    history — предыдущие пары (вопрос, ответ) перед последним сообщением
+    user — заданием или вопросом пользователя.
+
+    Короткий системный промпт сам по себе не кэшируется (CACHE_MIN_TOKENS),
+    но вместе с фрагментами образует кэшируемый префикс команды.
+    """
+    blocks: List[Dict[str, Any]] = [text_block(text) for text in system if text]
+    if blocks:
+        blocks[-1]["cache_control"] = CACHE_CONTROL
+    if context:
+        blocks.append(text_block(context, cache=True))
+    blocks.extend(text_block(text) for text in dynamic_system if text)
+
+    messages: List[Dict[str, Any]] = []
+    for message, response in history:
+        messages.append({"role": "user", "content": message})
+        messages.append({"role": "assistant", "content": response})
+    messages.append({"role": "user", "content": user})
+
+    request: Dict[str, Any] = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "messages": messages
+    }
+    if blocks:
+        request["system"] = blocks
+    return request
@@ -0,0 +1,323 @@
+"""
+Преобразование Markdown ответов модели в HTML Telegram и разбиение на сообщения
+"""
+import re
+from html import escape
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+# Максимальная длина текста сообщения Telegram (в единицах UTF-16)
+MESSAGE_LIMIT = 4096
+
+PARSE_MODE = "HTML"
+
+_LINK_SCHEMES = ("http://", "https://", "tg://", "mailto:")
+_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$")
+_BULLET = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+_QUOTE = re.compile(r"^\s{0,3}>\s?(.*)$")
+_RULE = re.compile(r"^\s{0,3}([-*_])(\s*\1){2,}\s*$")
+_FENCE = re.compile(r"^\s*```\s*([\w+#-]*)")
+
+# Маркер Markdown -> тег HTML; длинные маркеры проверяются раньше коротких
+_MARKERS = (("**", "b"), ("__", "b"), ("~~", "s"), ("*", "i"), ("_", "i"))
+
+
+class Chunk(NamedTuple):
+    """Часть ответа для одного сообщения: HTML и исходный текст (на случай ошибки разметки)
+
+    Исходный текст может оказаться длиннее лимита (разметка Markdown
+    бывает длиннее тегов) — для отправки его делит split_text.
+    """
+    html: str
+    text: str
+
+
+def telegram_length(text: str) -> int:
+    """Длина так, как ее считает Telegram (UTF-16)"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _cut_units(text: str, limit: int) -> List[str]:
+    """Разрезание строки на куски не длиннее limit единиц UTF-16 (суррогатные пары не рвутся)"""
+    pieces: List[str] = []
+    start = size = 0
+    for position, char in enumerate(text):
+        units = 2 if ord(char) > 0xFFFF else 1
+        if size + units > limit:
+            pieces.append(text[start:position])
+            start, size = position, 0
+        size += units
+    pieces.append(text[start:])
+    return pieces
+
+
+def _split_line(line: str, limit: int) -> List[str]:
+    if telegram_length(line) <= limit:
+        return [line]
+    pieces: List[str] = []
+    current = ""
+    for word in line.split(" "):
+        candidate = f"{current} {word}" if current else word
+        if telegram_length(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        *whole, current = _cut_units(word, limit)
+        pieces.extend(whole)
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Простой текст -> сообщения не длиннее limit (UTF-16): по строкам, длинные строки — по словам"""
+    parts: List[str] = []
+    lines: List[str] = []
+    size = 0
+    for line in text.split("\n"):
+        for piece in _split_line(line, limit):
+            piece_size = telegram_length(piece)
+            if lines and size + 1 + piece_size > limit:
+                parts.append("\n".join(lines))
+                lines, size = [], 0
+            size += piece_size + (1 if lines else 0)
+            lines.append(piece)
+    if lines:
+        parts.append("\n".join(lines))
+    # Пустое сообщение Telegram не примет
+    return [part for part in parts if part.strip()]
+
+
+def render_inline(text: str) -> str:
+    """Строка Markdown -> HTML: жирный, курсив, зачеркнутый, `код`, [ссылки](url)
+
+    Теги всегда правильно вложены: незакрытые маркеры остаются текстом.
+    """
+    out: List[str] = []
+    # Открытые маркеры: (маркер, индекс в out)
+    stack: List[Tuple[str, int]] = []
+    i = 0
+    length = len(text)
+    while i < length:
+        char = text[i]
+
+        if char == "\\" and i + 1 < length and not text[i + 1].isalnum():
+            out.append(escape(text[i + 1], quote=False))
+            i += 2
+            continue
+
+        if char == "`":
+            end = text.find("`", i + 1)
+            if end != -1:
+                out.append(f"<code>{escape(text[i + 1:end], quote=False)}</code>")
+                i = end + 1
+                continue
+
+        if char == "[":
+            link = _parse_link(text, i)
+            if link is not None:
+                label, url, i = link
+                out.append(f'<a href="{escape(url)}">{render_inline(label)}</a>')
+                continue
+
+        marker = next((m for m, _ in _MARKERS if text.startswith(m, i)), None)
+        if marker is not None:
+            before = text[i - 1] if i else " "
+            after = text[i + len(marker)] if i + len(marker) < length else " "
+            open_index = next((k for k in range(len(stack) - 1, -1, -1) if stack[k][0] == marker), None)
+            # Подчеркивание внутри слова (snake_case) — не разметка
+            underscore = marker[0] == "_"
+            if open_index is not None and not before.isspace() and not (underscore and after.isalnum()):
+                tag = dict(_MARKERS)[marker]
+                out[stack[open_index][1]] = f"<{tag}>"
+                out.append(f"</{tag}>")
+                # Маркеры, открытые внутри и не закрытые, остаются текстом
+                del stack[open_index:]
+                i += len(marker)
+                continue
+            if not after.isspace() and not (underscore and before.isalnum()):
+                stack.append((marker, len(out)))
+                out.append(escape(marker, quote=False))
+                i += len(marker)
+                continue
+
+        out.append(escape(char, quote=False))
+        i += 1
+    return "".join(out)
+
+
+def _parse_link(text: str, start: int) -> Optional[Tuple[str, str, int]]:
+    """[подпись](url) с позиции start: (подпись, url, позиция после ссылки)"""
+    close = text.find("](", start + 1)
+    if close == -1 or "\n" in text[start:close]:
+        return None
+    end = text.find(")", close + 2)
+    if end == -1:
+        return None
+    url = text[close + 2:end].strip()
+    if not url.startswith(_LINK_SCHEMES) or " " in url:
+        return None
+    return text[start + 1:close], url, end + 1
+
+
+def _render_code(lines: List[str], language: str) -> str:
+    code = escape("\n".join(lines), quote=False)
+    if language:
+        return f'<pre><code class="language-{escape(language)}">{code}</code></pre>'
+    return f"<pre>{code}</pre>"
+
+
+def _render_paragraph(lines: List[str]) -> str:
+    rendered: List[str] = []
+    quote: List[str] = []
+    for line in lines:
+        match = _QUOTE.match(line)
+        if match:
+            quote.append(render_inline(match.group(1)))
+            continue
+        if quote:
+            rendered.append(f"<blockquote>{chr(10).join(quote)}</blockquote>")
+            quote = []
+        if _RULE.match(line):
+            rendered.append("――――――")
+        elif _HEADING.match(line):
+            rendered.append(f"<b>{render_inline(_HEADING.match(line).group(1))}</b>")
+        elif _BULLET.match(line):
+            indent, item = _BULLET.match(line).groups()
+            rendered.append(f"{indent}• {render_inline(item)}")
+        else:
+            rendered.append(render_inline(line))
+    if quote:
+        rendered.append(f"<blockquote>{chr(10).join(quote)}</blockquote>")
+    return "\n".join(rendered)
+
+
+class _Block(NamedTuple):
+    lines: List[str]
+    language: Optional[str]  # None — абзац, строка — блок кода
+
+    @property
+    def text(self) -> str:
+        if self.language is None:
+            return "\n".join(self.lines)
+        return "\n".join([f"```{self.language}", *self.lines, "```"])
+
+    def render(self) -> str:
+        if self.language is None:
+            return _render_paragraph(self.lines)
+        return _render_code(self.lines, self.language)
+
+
+def _blocks(text: str) -> List[_Block]:
+    """Абзацы (по пустым строкам) и блоки кода ``` (незакрытый — до конца текста)"""
+    blocks: List[_Block] = []
+    paragraph: List[str] = []
+    lines = text.replace("\r\n", "\n").split("\n")
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        fence = _FENCE.match(line)
+        if fence:
+            if paragraph:
+                blocks.append(_Block(paragraph, None))
+                paragraph = []
+            code: List[str] = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith("```"):
+                code.append(lines[i])
+                i += 1
+            blocks.append(_Block(code, fence.group(1)))
+        elif line.strip():
+            paragraph.append(line)
+        elif paragraph:
+            blocks.append(_Block(paragraph, None))
+            paragraph = []
+        i += 1
+    if paragraph:
+        blocks.append(_Block(paragraph, None))
+    return blocks
+
+
+def markdown_to_html(text: str) -> str:
+    """Markdown ответа модели -> HTML для parse_mode="HTML" (без ограничения длины)"""
+    return "\n\n".join(block.render() for block in _blocks(text))
+
+
+def _fits(lines: List[str], language: Optional[str], room: int) -> bool:
+    return telegram_length(_Block(lines, language).render()) <= room
+
+
+def _split_block(block: _Block, room: int) -> Optional[Tuple[_Block, _Block]]:
+    """Блок -> (начало, остаток): самое длинное начало, отрисовка которого
+    помещается в room, с разрезом по строке или слову (код — только по строке,
+    если строка влезает целиком); None, если не помещается ни одного символа"""
+    text = "\n".join(block.lines)
+    separators = "\n" if block.language is not None else "\n "
+    # Отрисовка не короче исходника больше чем вдвое: длиннее 2 * room не проверяем
+    low, high = 0, min(len(text), 2 * room)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _fits(text[:middle].split("\n"), block.language, room):
+            low = middle
+        else:
+            high = middle - 1
+    while low > 0:
+        # Разрез по последнему разделителю в помещающемся начале; без разделителя — посреди слова
+        cut = max(text.rfind(separator, 0, low + 1) for separator in separators)
+        if cut <= 0:
+            cut = low
+        head = text[:cut]
+        if head.strip() and _fits(head.split("\n"), block.language, room):
+            tail = text[cut:]
+            tail = tail[1:] if tail[:1] == "\n" else tail
+            if block.language is None:
+                tail = tail.lstrip()
+            return _Block(head.split("\n"), block.language), _Block(tail.split("\n"), block.language)
+        low = cut - 1
+    return None
+
+
+def render_chunks(text: str, limit: int = MESSAGE_LIMIT) -> Iterator[Chunk]:
+    """Части ответа для отдельных сообщений, каждая не длиннее limit
+
+    Делит по абзацам и блокам кода, целиком помещая в сообщение столько
+    блоков, сколько влезает; блок длиннее сообщения дополняет текущее
+    сообщение началом (разрез по строке или слову) и продолжается в
+    следующем, блок кода — несколькими блоками кода. Сущности не
+    разрываются: каждый блок отрисовывается отдельно. Генератор: следующая
+    часть форматируется, пока предыдущая отправляется.
+    """
+    html: List[str] = []
+    source: List[str] = []
+    size = 0
+    pending = list(reversed(_blocks(text)))
+    while pending:
+        block = pending.pop()
+        if not "".join(block.lines).strip():
+            continue
+        rendered = block.render()
+        rendered_size = telegram_length(rendered)
+        room = limit - size - (2 if html else 0)
+        if rendered_size <= room:
+            html.append(rendered)
+            source.append(block.text)
+            size += rendered_size + (2 if size else 0)
+            continue
+
+        parts = _split_block(block, room) if rendered_size > limit else None
+        if parts is not None:
+            # Начало длинного блока дополняет сообщение, остаток начинает следующее
+            head, rest = parts
+            html.append(head.render())
+            source.append(head.text)
+            pending.append(rest)
+        elif html:
+            # Блок, помещающийся в сообщение целиком, переносится в следующее
+            pending.append(block)
+        else:
+            html.append(rendered)
+            source.append(block.text)
+        yield Chunk("\n\n".join(html), "\n\n".join(source))
+        html, source, size = [], [], 0
+    if html:
+        yield Chunk("\n\n".join(html), "\n\n".join(source))
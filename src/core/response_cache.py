@@ -0,0 +1,301 @@
+"""
+Кэш ответов LLM с TTL по типам команд и сменными хранилищами
+"""
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from .cache import TTLCache
+from utils.config import settings
+from utils.logger import setup_logger
+
+logger = setup_logger("response_cache")
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_question(text: str) -> str:
+    """Вопрос без регистра, пунктуации и лишних пробелов; все слова (и "не") сохраняются"""
+    return " ".join(_WORD_RE.findall(text.lower().replace("ё", "е")))
+
+
+class MemoryCacheBackend:
+    """Хранилище в памяти процесса (LRU + TTL)"""
+
+    def __init__(self, maxsize: int = 1000):
+        self._cache = TTLCache(maxsize)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        self._cache.set(key, value, ttl)
+
+    async def close(self):
+        self._cache.clear()
+
+
+class SQLiteCacheBackend:
+    """Хранилище в локальном файле SQLite (переживает перезапуск бота)
+
+    Запросы выполняются в отдельном потоке, при превышении maxsize
+    вытесняются записи, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, path: Path, maxsize: int = 1000):
+        self.path = Path(path)
+        self.maxsize = maxsize
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)"
+        )
+        self._lock = asyncio.Lock()
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def _set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, value, now + ttl, now)
+        )
+        self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        self._conn.execute("""
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.maxsize,))
+
+    async def get(self, key: str) -> Optional[str]:
+        async with self._lock:
+            return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        async with self._lock:
+            await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def close(self):
+        self._conn.close()
+
+
+class RedisCacheBackend:
+    """Хранилище в Redis (общий кэш для нескольких экземпляров бота)
+
+    Значения живут с TTL (SET EX), время обращения ведется в отсортированном
+    множестве, по которому вытесняются самые старые ключи сверх maxsize.
+    """
+
+    def __init__(self, url: str, maxsize: int = 1000, prefix: str = "llm_cache:", client=None):
+        if client is None:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError as e:
+                raise RuntimeError("Redis response cache requires redis: pip install redis") from e
+            client = aioredis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.maxsize = maxsize
+        self.prefix = prefix
+        self._lru_key = f"{prefix}__lru__"
+
+    async def get(self, key: str) -> Optional[str]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self.prefix + key)
+            pipe.zadd(self._lru_key, {key: time.time()}, xx=True)
+            value, _ = await pipe.execute()
+        return value
+
+    async def set(self, key: str, value: str, ttl: float):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(self.prefix + key, value, ex=max(1, int(ttl)))
+            pipe.zadd(self._lru_key, {key: time.time()})
+            pipe.zcard(self._lru_key)
+            *_, size = await pipe.execute()
+
+        if size > self.maxsize:
+            stale = await self.redis.zrange(self._lru_key, 0, size - self.maxsize - 1)
+            if stale:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.delete(*(self.prefix + stale_key for stale_key in stale))
+                    pipe.zrem(self._lru_key, *stale)
+                    await pipe.execute()
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+class ResponseCache:
+    """Кэш ответов LLM перед вызовом API
+
+    Точный ключ — sha256 от модели, сообщений и параметров запроса.
+    Свободные вопросы (similarity_text) совпадают и после нормализации
+    (регистр, пунктуация, пробелы). С моделью эмбеддингов (embedder) можно
+    включить семантическое совпадение: вопросы сравниваются по косинусной
+    близости с недавними вопросами той же модели, и при близости не ниже
+    порога возвращается их ответ. Эмбеддер должен различать отрицания —
+    хеширующий (без стоп-слов) для этого не подходит.
+    """
+
+    def __init__(
+        self,
+        backend,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl: float = 600,
+        embedder=None,
+        similarity_threshold: float = 0.92,
+        semantic_size: int = 1000
+    ):
+        self.backend = backend
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.semantic_size = semantic_size
+        self._semantic: Deque[Tuple[str, Any, str]] = deque(maxlen=semantic_size)
+        self._normalized: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(request: Dict[str, Any]) -> str:
+        """Ключ запроса: sha256 от канонического JSON (модель, сообщения, параметры)"""
+        payload = json.dumps(request, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def ttl_for(self, command: str) -> float:
+        return self.ttls.get(command, self.default_ttl)
+
+    async def get(
+        self,
+        request: Dict[str, Any],
+        similarity_text: Optional[str] = None
+    ) -> Optional[str]:
+        """Ответ из кэша по точному ключу или по похожему вопросу"""
+        value = await self.backend.get(self.make_key(request))
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if similarity_text:
+            model = request.get("model", "")
+            key = self._normalized.get((model, normalize_question(similarity_text)))
+            if key is None and self.embedder:
+                key = self._similar_key(model, similarity_text)
+            if key:
+                value = await self.backend.get(key)
+                if value is not None:
+                    self.semantic_hits += 1
+                    return value
+
+        self.misses += 1
+        return None
+
+    async def set(
+        self,
+        command: str,
+        request: Dict[str, Any],
+        response: str,
+        similarity_text: Optional[str] = None
+    ):
+        """Сохранение ответа с TTL типа команды"""
+        ttl = self.ttl_for(command)
+        if ttl <= 0:
+            return
+        key = self.make_key(request)
+        await self.backend.set(key, response, ttl)
+        if similarity_text:
+            model = request.get("model", "")
+            self._normalized[(model, normalize_question(similarity_text))] = key
+            if len(self._normalized) > self.semantic_size:
+                self._normalized.popitem(last=False)
+            if self.embedder:
+                vector = self.embedder.embed([similarity_text])[0]
+                self._semantic.append((model, vector, key))
+
+    def _similar_key(self, model: str, text: str) -> Optional[str]:
+        if not self._semantic:
+            return None
+        vector = self.embedder.embed([text])[0]
+        best_key, best_score = None, self.similarity_threshold
+        for entry_model, entry_vector, key in self._semantic:
+            if entry_model != model:
+                continue
+            score = float(entry_vector @ vector)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.semantic_hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / requests if requests else 0.0
+        }
+
+    async def close(self):
+        await self.backend.close()
+
+
+def create_response_cache(ttls: Optional[Dict[str, float]] = None) -> Optional[ResponseCache]:
+    """Кэш ответов по настройкам; None, если кэш выключен"""
+    backend_name = settings.RESPONSE_CACHE_BACKEND
+    if not backend_name:
+        return None
+
+    if backend_name == "memory":
+        backend = MemoryCacheBackend(settings.RESPONSE_CACHE_SIZE)
+    elif backend_name == "sqlite":
+        backend = SQLiteCacheBackend(
+            settings.DATA_DIR / "cache" / "responses.sqlite3", settings.RESPONSE_CACHE_SIZE
+        )
+    elif backend_name == "redis":
+        backend = RedisCacheBackend(settings.REDIS_URL, settings.RESPONSE_CACHE_SIZE)
+    else:
+        raise ValueError(f"Unknown response cache backend: {backend_name}")
+
+    embedder = None
+    if settings.RESPONSE_CACHE_EMBEDDER:
+        from .vectors import HashingEmbedder, create_embedder
+        embedder = create_embedder(settings.RESPONSE_CACHE_EMBEDDER)
+        if isinstance(embedder, HashingEmbedder):
+            # Без стоп-слов "как (не) поднять выручку" дают один вектор — только точное совпадение
+            logger.warning("Hashing embedder ignores negations, similar questions are matched exactly")
+            embedder = None
+
+    logger.info(f"✅ LLM response cache: {backend_name}")
+    return ResponseCache(
+        backend,
+        ttls=ttls,
+        default_ttl=settings.RESPONSE_CACHE_TTL,
+        embedder=embedder,
+        similarity_threshold=settings.RESPONSE_CACHE_SIMILARITY
+    )
@@ -0,0 +1,172 @@
+"""
+Планировщик запросов бота: отдельные очереди для чата и отчетов, справедливость по пользователям
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, TypeVar
+
+from utils.config import settings
+from utils.stats import percentile
+
+T = TypeVar("T")
+
+LANE_INTERACTIVE = "interactive"
+LANE_REPORTS = "reports"
+
+
+class SchedulerFullError(Exception):
+    """У пользователя или в очереди нет места для нового запроса"""
+
+
+class Lane:
+    """Очередь с ограниченным параллелизмом и круговой выдачей слотов по пользователям
+
+    Каждый пользователь ждет в своей очереди; освободившийся слот получает
+    следующий по кругу пользователь, поэтому один активный пользователь не
+    может занять очередь целиком. user_concurrency ограничивает число
+    одновременно выполняемых запросов одного пользователя, user_queue — число
+    его ожидающих запросов.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        user_concurrency: int = 1,
+        user_queue: int = 3,
+        max_queue: int = 200
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.user_concurrency = user_concurrency
+        self.user_queue = user_queue
+        self.max_queue = max_queue
+        self.active = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.waits: Deque[float] = deque(maxlen=500)
+        self._active_by_user: Dict[int, int] = {}
+        self._waiting: Dict[int, Deque[asyncio.Future]] = {}
+        self._turns: Deque[int] = deque()
+
+    async def acquire(self, user_id: int):
+        """Ожидание слота; SchedulerFullError, если очередь пользователя или общая заполнена"""
+        waiting = self._waiting.get(user_id)
+        if (
+            (len(waiting) if waiting else 0) >= self.user_queue
+            or self.queued >= self.max_queue
+        ):
+            self.rejected += 1
+            raise SchedulerFullError(f"{self.name} queue is full")
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        if waiting is None:
+            waiting = self._waiting[user_id] = deque()
+            self._turns.append(user_id)
+        waiting.append(future)
+        self.queued += 1
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(user_id)
+            else:
+                future.cancel()
+                self._forget(user_id, future)
+            raise
+        self.waits.append(time.monotonic() - started)
+
+    def release(self, user_id: int):
+        self.active -= 1
+        self.completed += 1
+        remaining = self._active_by_user[user_id] - 1
+        if remaining:
+            self._active_by_user[user_id] = remaining
+        else:
+            del self._active_by_user[user_id]
+        self._dispatch()
+
+    def _forget(self, user_id: int, future: asyncio.Future):
+        waiting = self._waiting.get(user_id)
+        if waiting and future in waiting:
+            waiting.remove(future)
+            self.queued -= 1
+            if not waiting:
+                del self._waiting[user_id]
+                self._turns.remove(user_id)
+
+    def _dispatch(self):
+        """Выдача свободных слотов пользователям по кругу"""
+        skipped = 0
+        while self.active < self.concurrency and skipped < len(self._turns):
+            user_id = self._turns[0]
+            self._turns.rotate(-1)
+            if self._active_by_user.get(user_id, 0) >= self.user_concurrency:
+                skipped += 1
+                continue
+
+            waiting = self._waiting[user_id]
+            future = waiting.popleft()
+            self.queued -= 1
+            if not waiting:
+                del self._waiting[user_id]
+                self._turns.remove(user_id)
+            self.active += 1
+            self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + 1
+            future.set_result(None)
+            skipped = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_p50": percentile(self.waits, 0.5),
+            "wait_p95": percentile(self.waits, 0.95)
+        }
+
+
+class Scheduler:
+    """Выполнение запросов пользователей в очередях (lanes)"""
+
+    def __init__(self, lanes: Dict[str, Lane]):
+        self.lanes = lanes
+
+    async def run(self, lane: str, user_id: int, func: Callable[[], Awaitable[T]]) -> T:
+        """Выполнение func() после получения слота в очереди lane"""
+        queue = self.lanes[lane]
+        await queue.acquire(user_id)
+        try:
+            return await func()
+        finally:
+            queue.release(user_id)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+
+def create_scheduler(shares: int = 1) -> Scheduler:
+    """Планировщик по настройкам: быстрый чат и ограниченная очередь отчетов
+
+    Параллельность очередей делится на shares процессов.
+    """
+    return Scheduler({
+        LANE_INTERACTIVE: Lane(
+            LANE_INTERACTIVE,
+            max(1, settings.SCHEDULER_INTERACTIVE_CONCURRENCY // shares),
+            user_concurrency=1,
+            user_queue=settings.SCHEDULER_USER_QUEUE
+        ),
+        LANE_REPORTS: Lane(
+            LANE_REPORTS,
+            max(1, settings.SCHEDULER_REPORT_CONCURRENCY // shares),
+            user_concurrency=1,
+            user_queue=settings.SCHEDULER_USER_QUEUE
+        ),
+    })
@@ -0,0 +1,154 @@
+"""
+Полнотекстовый поиск: токенизация и BM25 инвертированный индекс
+"""
+import heapq
+import math
+import re
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+_TOKEN_RE = re.compile(r"[0-9a-zа-яё]+")
+
+# Частые слова, которые не несут смысла для поиска
+STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по
+только ее мне было вот от меня еще нет о из ему теперь когда даже ну вдруг ли если
+уже или ни быть был него до вас нибудь опять уж вам ведь там потом себя ничего ей
+может они тут где есть надо ней для мы тебя их чем была сам чтоб без будто чего раз
+тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом
+один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец
+два об другой хоть после над больше тот через эти нас про всего них какая много
+разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой
+им более всегда конечно всю между это также
+the a an and or of to in on for is are was were be by with at as it this that from
+""".split())
+
+# Окончания русских слов, от длинных к коротким (облегченный стеммер)
+_RU_ENDINGS = tuple(sorted("""
+ейшими ейшего ейшему ейшая ейшее ейшей ейший ейших ейшую
+ующими ующего ующему ующая ующее ующей ующий ующих ующую
+ости остью остей остям остями остях
+ением ениями ениях ения ение ений ению
+ами ями ого его ому ему ыми ими ией иям иях ов ев ей ой ий ый ая яя ое ее ые ие
+ии ую юю ом ем ам ям ах ях ых их ию ия ье ья ью
+ать ять ить еть ует уют ают яют ишь ешь ит ет ут ют ат ят ла ло ли ть
+а я о е ы и у ю ь й
+""".split(), key=len, reverse=True))
+
+_MIN_STEM = 3
+
+
+@lru_cache(maxsize=200_000)
+def stem(word: str) -> str:
+    """Отсечение окончания русского слова (английские слова не меняются)"""
+    if not ("а" <= word[0] <= "я"):
+        return word
+    for ending in _RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбиение текста на нормализованные токены (с учетом русского языка)"""
+    text = text.lower().replace("ё", "е")
+    return [stem(token) for token in _TOKEN_RE.findall(text) if token not in STOP_WORDS]
+
+
+def bm25_top_k(
+    postings_lists: Iterable[Sequence[Tuple[int, int]]],
+    doc_length: Callable[[int], int],
+    n_docs: int,
+    total_length: int,
+    n_results: int = 5,
+    k1: float = 1.5,
+    b: float = 0.75
+) -> List[Tuple[int, float]]:
+    """Ранжирование BM25 по постингам терминов запроса: [(doc_idx, score), ...]
+
+    postings_lists — по одному списку пар (doc_idx, tf) на каждый термин запроса.
+    """
+    if not n_docs or n_results <= 0:
+        return []
+
+    avg_length = max(total_length / n_docs, 1.0)
+    norm = k1 * (1 - b)
+    scale = k1 * b / avg_length
+    scores: Dict[int, float] = {}
+
+    for postings in postings_lists:
+        df = len(postings)
+        if not df:
+            continue
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        for doc_idx, tf in postings:
+            score = idf * tf * (k1 + 1) / (tf + norm + scale * doc_length(doc_idx))
+            scores[doc_idx] = scores.get(doc_idx, 0.0) + score
+
+    return heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+
+
+class BM25Index:
+    """Инвертированный индекс с ранжированием BM25
+
+    Постинги хранятся как term -> {doc_idx: tf}, поэтому стоимость запроса
+    зависит от длины постингов терминов запроса, а не от размера корпуса.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_lengths: Dict[int, int] = {}
+        self.total_length = 0
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, doc_idx: int, tokens: Iterable[str]):
+        """Индексация документа по списку токенов"""
+        if doc_idx in self.doc_lengths:
+            self.remove(doc_idx)
+
+        frequencies: Dict[str, int] = {}
+        length = 0
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+            length += 1
+
+        for term, tf in frequencies.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+            postings[doc_idx] = tf
+
+        self.doc_lengths[doc_idx] = length
+        self.total_length += length
+
+    def remove(self, doc_idx: int, tokens: Iterable[str] = ()):
+        """Удаление документа из индекса
+
+        Если токены документа известны, затрагиваются только их постинги,
+        иначе просматривается весь словарь.
+        """
+        length = self.doc_lengths.pop(doc_idx, None)
+        if length is None:
+            return
+        self.total_length -= length
+
+        terms = set(tokens) or list(self.postings)
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings and postings.pop(doc_idx, None) is not None and not postings:
+                del self.postings[term]
+
+    def search(self, query_tokens: Iterable[str], n_results: int = 5) -> List[Tuple[int, float]]:
+        """Поиск top-k документов по BM25, результат: [(doc_idx, score), ...]"""
+        postings_lists = [
+            list(self.postings[term].items()) for term in set(query_tokens) if term in self.postings
+        ]
+        return bm25_top_k(
+            postings_lists, self.doc_lengths.__getitem__, self.doc_count, self.total_length,
+            n_results, self.k1, self.b
+        )
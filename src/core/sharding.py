@@ -0,0 +1,265 @@
+"""
+Обработка обновлений в нескольких процессах с шардированием по чату
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд ожидания места в очереди процесса писать предупреждение
+BLOCKED_WARNING_SECONDS = 1.0
+
+# Виды обновлений, в которых чат указан в поле chat
+_CHAT_UPDATES = ("message", "edited_message", "channel_post", "edited_channel_post")
+
+
+class ShardUnavailableError(Exception):
+    """Процесс чата не принимает обновления дольше submit_timeout"""
+
+
+def update_chat_id(update: Dict[str, Any]) -> int:
+    """Чат обновления (JSON Telegram); для обновлений без чата — пользователь или update_id"""
+    for kind in _CHAT_UPDATES:
+        if kind in update:
+            return update[kind]["chat"]["id"]
+    query = update.get("callback_query")
+    if query is not None:
+        message = query.get("message")
+        if message is not None:
+            return message["chat"]["id"]
+        return query["from"]["id"]
+    return update["update_id"]
+
+
+def shard_for(chat_id: int, shards: int) -> int:
+    """Номер процесса для чата: стабилен между запусками (без hash() со случайной солью)"""
+    return chat_id % shards
+
+
+class ShardWorker:
+    """Цикл процесса-обработчика
+
+    Обновления одного чата выполняются строго по очереди (очередь на чат),
+    разные чаты — параллельно. Процесс держит не больше concurrency
+    обновлений (выполняемых и ждущих своей очереди в чате): следующее
+    берется из очереди процесса только после завершения одного из них,
+    поэтому очередь процесса заполняется, когда обработка не успевает.
+    Обработчик handler — объект с корутинами startup(), process(update)
+    и shutdown(). None в очереди — сигнал дообработать начатое и выйти.
+    """
+
+    def __init__(self, index: int, updates, handler, concurrency: int = 256, ready=None):
+        self.index = index
+        self.updates = updates
+        self.handler = handler
+        self.ready = ready
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chats: Dict[int, Deque[Dict[str, Any]]] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self.processed = 0
+        self.errors = 0
+
+    async def run(self):
+        await self.handler.startup()
+        if self.ready is not None:
+            self.ready.set()
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await self._slots.acquire()
+                update = await loop.run_in_executor(None, self.updates.get)
+                if update is None:
+                    self._slots.release()
+                    break
+                self._dispatch(update)
+            if self._tasks:
+                await asyncio.gather(*self._tasks.values())
+        finally:
+            await self.handler.shutdown()
+            logger.info(f"Worker {self.index} stopped: {self.processed} processed, {self.errors} errors")
+
+    def _dispatch(self, update: Dict[str, Any]):
+        chat_id = update_chat_id(update)
+        pending = self._chats.get(chat_id)
+        if pending is None:
+            pending = self._chats[chat_id] = deque()
+        pending.append(update)
+        if chat_id not in self._tasks:
+            self._tasks[chat_id] = asyncio.create_task(self._drain_chat(chat_id))
+
+    async def _drain_chat(self, chat_id: int):
+        pending = self._chats[chat_id]
+        try:
+            while pending:
+                update = pending.popleft()
+                try:
+                    await self.handler.process(update)
+                    self.processed += 1
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Update {update.get('update_id')} failed in worker {self.index}: {e}")
+                finally:
+                    self._slots.release()
+        finally:
+            del self._chats[chat_id]
+            del self._tasks[chat_id]
+
+
+def _run_worker(index: int, updates, factory: Callable[[], Any], concurrency: int, ready):
+    """Точка входа процесса-обработчика"""
+    # Ctrl+C приходит всей группе процессов; останавливает их фронт через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(ShardWorker(index, updates, factory(), concurrency, ready).run())
+
+
+class ShardRouter:
+    """Распределение обновлений по процессам-обработчикам
+
+    Фронт-процесс принимает обновления и отправляет JSON в процесс
+    shard_for(chat_id) — так обновления одного чата обрабатываются одним
+    процессом по порядку. factory() создает обработчик в дочернем процессе
+    (должна импортироваться по имени: процессы запускаются через spawn).
+    Очереди процессов ограничены queue_size; при заполнении submit ждет,
+    и давление передается в очередь webhook (503 для Telegram). Упавший
+    процесс перезапускается; если процесс жив, но не разбирает очередь
+    дольше submit_timeout секунд, submit бросает ShardUnavailableError —
+    обновление теряется, но прием остальных чатов не останавливается.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        factory: Callable[[], Any],
+        queue_size: int = 1000,
+        concurrency: int = 256,
+        submit_timeout: float = 30.0
+    ):
+        self.workers = workers
+        self.factory = factory
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.submit_timeout = submit_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._queues: List[Any] = []
+        self._ready: List[Any] = []
+        self._processes: List[Any] = []
+        self.dispatched = [0] * workers
+        self.blocked = 0
+        self.restarts = 0
+        self.rejected = 0
+
+    def start(self):
+        for index in range(self.workers):
+            self._queues.append(None)
+            self._ready.append(None)
+            self._processes.append(None)
+            self._spawn(index)
+        logger.info(f"Started {self.workers} worker processes")
+
+    def _spawn(self, index: int):
+        # Новая очередь: упавший процесс мог оставить блокировку старой занятой
+        updates = self._context.Queue(self.queue_size)
+        ready = self._context.Event()
+        process = self._context.Process(
+            target=_run_worker,
+            args=(index, updates, self.factory, self.concurrency, ready),
+            name=f"shard-{index}"
+        )
+        process.start()
+        self._queues[index] = updates
+        self._ready[index] = ready
+        self._processes[index] = process
+
+    def _respawn(self, index: int):
+        """Перезапуск упавшего процесса; неразобранные обновления переносятся в новую очередь"""
+        old = self._queues[index]
+        logger.error(f"Worker shard-{index} died (exit code {self._processes[index].exitcode}), restarting")
+        self.restarts += 1
+        self._spawn(index)
+        moved = 0
+        while True:
+            try:
+                self._queues[index].put_nowait(old.get_nowait())
+                moved += 1
+            except (queue.Empty, queue.Full):
+                break
+        old.close()
+        if moved:
+            logger.info(f"Moved {moved} pending updates to restarted shard-{index}")
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание инициализации всех обработчиков"""
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(None, ready.wait, timeout) for ready in self._ready
+        ))
+        return all(results)
+
+    async def submit(self, update: Dict[str, Any]):
+        """Отправка обновления в процесс его чата"""
+        shard = shard_for(update_chat_id(update), self.workers)
+        started = None
+        warned = False
+        while True:
+            if not self._processes[shard].is_alive():
+                self._respawn(shard)
+            try:
+                self._queues[shard].put_nowait(update)
+                break
+            except queue.Full:
+                pass
+            self.blocked += 1
+            now = time.monotonic()
+            if started is None:
+                started = now
+            waited = now - started
+            if waited >= self.submit_timeout:
+                self.rejected += 1
+                raise ShardUnavailableError(
+                    f"Worker shard-{shard} has not accepted updates for {waited:.0f}s"
+                )
+            if waited >= BLOCKED_WARNING_SECONDS and not warned:
+                warned = True
+                logger.warning(f"Worker shard-{shard} queue is full, intake is waiting (blocked {self.blocked})")
+            await asyncio.sleep(0.01)
+        self.dispatched[shard] += 1
+
+    async def stop(self, timeout: float = 60.0):
+        """Дообработка очередей и остановка процессов (зависшие — terminate)"""
+        await asyncio.gather(*(self._stop_worker(index, timeout) for index in range(len(self._processes))))
+        for updates in self._queues:
+            updates.close()
+        self._queues, self._ready, self._processes = [], [], []
+
+    async def _stop_worker(self, index: int, timeout: float):
+        """Сигнал остановки процессу и ожидание; не принявший сигнал или не вышедший — terminate"""
+        loop = asyncio.get_running_loop()
+        process = self._processes[index]
+        deadline = time.monotonic() + timeout
+        try:
+            # put в пуле потоков: очередь зависшего процесса может быть полна
+            await loop.run_in_executor(None, self._queues[index].put, None, True, timeout)
+        except queue.Full:
+            logger.warning(f"Worker {process.name} queue is full, stop signal not delivered")
+        else:
+            await loop.run_in_executor(None, process.join, max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            logger.warning(f"Worker {process.name} did not stop in {timeout}s, terminating")
+            process.terminate()
+            await loop.run_in_executor(None, process.join)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "alive": sum(process.is_alive() for process in self._processes),
+            "dispatched": list(self.dispatched),
+            "blocked": self.blocked,
+            "restarts": self.restarts,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,127 @@
+"""
+Потоковый вывод ответов: редактирование сообщения-заглушки по мере генерации
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+from .rendering import MESSAGE_LIMIT, PARSE_MODE, Chunk, render_chunks, split_text
+
+logger = logging.getLogger(__name__)
+
+CURSOR = " ▌"
+
+
+def _seconds(value) -> float:
+    """retry_after бывает int или timedelta в зависимости от версии PTB"""
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class StreamingEditor:
+    """Прогрессивное редактирование сообщения-заглушки частичным ответом
+
+    update() не блокирует поток ответа: последний текст запоминается, а правка
+    выполняется фоновой задачей не чаще одного раза в interval секунд (Telegram
+    ограничивает частоту правок; RetryAfter откладывает следующую правку).
+    """
+
+    def __init__(self, message: Message, interval: float = 1.5):
+        self.message = message
+        self.interval = interval
+        self.edits = 0
+        self._pending: Optional[str] = None
+        self._next_edit = time.monotonic() + interval
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, text: str):
+        """Новый частичный текст ответа"""
+        self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._pending is not None:
+            delay = self._next_edit - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text, self._pending = self._pending, None
+            # Незакрытая разметка частичного текста остается видимой до закрытия
+            partial = next(render_chunks(text, MESSAGE_LIMIT - len(CURSOR)), None)
+            if partial is None:
+                continue
+            try:
+                await self._edit(partial.html + CURSOR, parse_mode=PARSE_MODE)
+            except RetryAfter:
+                # Следующая правка отложена, текст покажем после паузы
+                if self._pending is None:
+                    self._pending = text
+            except BadRequest as e:
+                # Частичный текст мог не разобраться — следующая правка исправит
+                logger.debug(f"Partial edit skipped: {e}")
+
+    async def _edit(self, text: str, parse_mode: Optional[str] = None):
+        try:
+            await self.message.edit_text(text, parse_mode=parse_mode)
+            self.edits += 1
+        except RetryAfter as e:
+            self._next_edit = time.monotonic() + _seconds(e.retry_after)
+            raise
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self._next_edit = time.monotonic() + self.interval
+
+    async def finish(self, text: str):
+        """Итоговый ответ: последняя правка заглушки, остаток — новыми сообщениями
+
+        Части отправляются по порядку; следующая форматируется, пока
+        отправляется предыдущая.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        chunks = render_chunks(text) if text.strip() else iter([Chunk("…", "…")])
+        sending: Optional[asyncio.Future] = None
+        for position, chunk in enumerate(chunks):
+            if sending is not None:
+                await sending
+            sending = asyncio.ensure_future(self._send_chunk(position, chunk))
+            # Отдаем управление, чтобы запрос ушел до форматирования следующей части
+            await asyncio.sleep(0)
+        if sending is not None:
+            await sending
+
+    async def _send_chunk(self, position: int, chunk: Chunk):
+        for attempt in range(2):
+            try:
+                await self._send_part(position, chunk)
+                return
+            except RetryAfter as e:
+                if attempt:
+                    raise
+                await asyncio.sleep(_seconds(e.retry_after))
+
+    async def _send_part(self, position: int, chunk: Chunk):
+        try:
+            await self._deliver(position == 0, chunk.html, PARSE_MODE)
+            return
+        except BadRequest:
+            pass
+        # HTML все же не разобрался — исходный текст без разметки; он может быть
+        # длиннее HTML, поэтому при необходимости уходит несколькими сообщениями
+        for index, text in enumerate(split_text(chunk.text) or ["…"]):
+            await self._deliver(position == 0 and index == 0, text, None)
+
+    async def _deliver(self, edit: bool, text: str, parse_mode: Optional[str]):
+        if edit:
+            await self._edit(text, parse_mode=parse_mode)
+        else:
+            await self.message.reply_text(text, parse_mode=parse_mode)
@@ -0,0 +1,373 @@
+"""
+Векторный (семантический) поиск: эмбеддеры, матрицы на NumPy и ANN-индекс IVF
+
+NumPy — опциональная зависимость: без нее база знаний работает только в
+полнотекстовом режиме.
+"""
+import copy
+import os
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - зависит от окружения
+    np = None
+
+from .search import tokenize
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("Vector search requires numpy: pip install numpy")
+
+
+def _save_array(path: Path, array):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class HashingEmbedder:
+    """Детерминированный эмбеддер на хешировании признаков
+
+    Признаки — основы слов и символьные триграммы, хеш crc32 не зависит от
+    процесса. Подходит для тестов и как легкая замена модели.
+    """
+
+    def __init__(self, dim: int = 256):
+        require_numpy()
+        self.dim = dim
+
+    def _features(self, text: str) -> Iterable[Tuple[str, float]]:
+        for token in tokenize(text):
+            yield token, 1.0
+            padded = f"^{token}$"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def embed(self, texts: Sequence[str]):
+        """Эмбеддинги текстов: матрица (len(texts), dim) float32 с единичной нормой"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                matrix[row, h % self.dim] += weight if h & 0x80000000 else -weight
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    """Локальная модель sentence-transformers на CPU"""
+
+    def __init__(self, model_name: str):
+        require_numpy()
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                "Model embeddings require sentence-transformers: pip install sentence-transformers"
+            ) from e
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: Sequence[str]):
+        return self.model.encode(
+            list(texts), normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def create_embedder(spec: str):
+    """Создание эмбеддера по настройке: "" — выключено, "hashing[:dim]" или имя модели"""
+    if not spec:
+        return None
+    if spec == "hashing" or spec.startswith("hashing:"):
+        _, _, dim = spec.partition(":")
+        return HashingEmbedder(int(dim) if dim else 256)
+    return SentenceTransformerEmbedder(spec)
+
+
+def top_k(scores, k: int) -> List[int]:
+    """Номера k наибольших значений, по убыванию (argpartition + сортировка k)"""
+    if k <= 0 or not len(scores):
+        return []
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")].tolist()
+
+
+class VectorIndex:
+    """Матрица нормированных векторов с косинусным top-k поиском
+
+    Векторы хранятся в float32 или в int8 с масштабом на строку (в 4 раза
+    меньше памяти). Индекс из from_arrays/load — только для чтения, номер
+    документа в нем совпадает с номером строки. В изменяемом индексе строки
+    только добавляются: удаленная строка остается дырой до расширения
+    матрицы, поэтому view() для поиска в другом потоке не копирует данные.
+    """
+
+    def __init__(self, dim: int, dtype: str = "float32", capacity: int = 1024):
+        require_numpy()
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        self.dim = dim
+        self.dtype = dtype
+        self._matrix = np.zeros((capacity, dim), dtype=dtype)
+        self._scales = np.ones(capacity, dtype=np.float32) if dtype == "int8" else None
+        self._doc_ids: Optional[List[Optional[int]]] = []
+        self._rows: Dict[int, int] = {}
+        self._holes: List[int] = []
+        self.size = 0
+
+    @classmethod
+    def from_arrays(cls, matrix, scales=None) -> "VectorIndex":
+        index = cls.__new__(cls)
+        index.dim = matrix.shape[1]
+        index.dtype = "int8" if scales is not None else "float32"
+        index._matrix = matrix
+        index._scales = scales
+        index._doc_ids = None
+        index._rows = None
+        index._holes = []
+        index.size = matrix.shape[0]
+        return index
+
+    @property
+    def read_only(self) -> bool:
+        return self._doc_ids is None
+
+    def _quantize(self, vectors):
+        if self.dtype == "float32":
+            return vectors.astype(np.float32), None
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def add(self, doc_idx: int, vector):
+        """Добавление (или замена) вектора документа"""
+        if self.read_only:
+            raise RuntimeError("Vector index is read-only")
+        if doc_idx in self._rows:
+            self.remove(doc_idx)
+        if self.size == len(self._matrix):
+            self._grow()
+        quantized, scales = self._quantize(np.asarray(vector, dtype=np.float32)[None, :])
+        self._matrix[self.size] = quantized[0]
+        if scales is not None:
+            self._scales[self.size] = scales[0]
+        self._doc_ids.append(doc_idx)
+        self._rows[doc_idx] = self.size
+        self.size += 1
+
+    def _grow(self):
+        """Перенос живых строк в новую матрицу (дыры удаленных строк отбрасываются)
+
+        Старые массивы не изменяются — их продолжают читать представления view().
+        """
+        live = [row for row in range(self.size) if self._doc_ids[row] is not None]
+        capacity = max(1024, 2 * len(live))
+        matrix = np.zeros((capacity, self.dim), dtype=self._matrix.dtype)
+        matrix[:len(live)] = self._matrix[live]
+        self._matrix = matrix
+        if self._scales is not None:
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[:len(live)] = self._scales[live]
+            self._scales = scales
+        self._doc_ids = [self._doc_ids[row] for row in live]
+        self._rows = {doc_idx: row for row, doc_idx in enumerate(self._doc_ids)}
+        self._holes = []
+        self.size = len(live)
+
+    def remove(self, doc_idx: int):
+        """Удаление вектора: строка помечается дырой, данные не перемещаются"""
+        if self.read_only:
+            raise RuntimeError("Vector index is read-only")
+        row = self._rows.pop(doc_idx, None)
+        if row is None:
+            return
+        self._doc_ids[row] = None
+        self._holes.append(row)
+
+    def view(self) -> "VectorIndex":
+        """Представление текущих строк для поиска в другом потоке, без копирования
+
+        Строки, добавленные после view(), в представлении не видны, удаленные —
+        видны как удаленные. Представление только для чтения; индекс только
+        для чтения возвращается как есть.
+        """
+        if self.read_only:
+            return self
+        return copy.copy(self)
+
+    def __contains__(self, doc_idx: int) -> bool:
+        return doc_idx < self.size if self.read_only else doc_idx in self._rows
+
+    def row_of(self, doc_idx: int) -> int:
+        return doc_idx if self.read_only else self._rows[doc_idx]
+
+    def doc_of(self, row: int) -> int:
+        return row if self.read_only else self._doc_ids[row]
+
+    def raw(self, doc_idx: int):
+        """Сырые данные вектора (строка и масштаб) — для копирования без потерь"""
+        row = self.row_of(doc_idx)
+        scale = self._scales[row] if self._scales is not None else None
+        return self._matrix[row], scale
+
+    def vectors(self, rows=None):
+        """Векторы в float32 (для обучения IVF и переноса между индексами)"""
+        matrix = self._matrix[:self.size] if rows is None else self._matrix[rows]
+        matrix = matrix.astype(np.float32)
+        if self._scales is not None:
+            scales = self._scales[:self.size] if rows is None else self._scales[rows]
+            matrix *= scales[:, None]
+        return matrix
+
+    def scores(self, query, rows=None):
+        """Косинусная близость запроса ко всем (или к выбранным) строкам"""
+        matrix = self._matrix[:self.size] if rows is None else self._matrix[rows]
+        scores = matrix @ query.astype(np.float32)
+        if self._scales is not None:
+            scores *= self._scales[:self.size] if rows is None else self._scales[rows]
+        return scores
+
+    def search(self, query, k: int = 5, exclude: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """Точный top-k поиск: [(doc_idx, score), ...]"""
+        if not self.size:
+            return []
+        scores = self.scores(query)
+        excluded = [self.row_of(doc_idx) for doc_idx in exclude]
+        excluded += [row for row in self._holes if row < self.size]
+        if excluded:
+            scores[excluded] = -np.inf
+        hits = [(self.doc_of(row), float(scores[row])) for row in top_k(scores, k) if np.isfinite(scores[row])]
+        # Строку могли удалить из индекса, пока шел поиск по представлению
+        return [(doc_idx, score) for doc_idx, score in hits if doc_idx is not None]
+
+    def append_from(self, source: "VectorIndex", doc_idx: int, new_doc_idx: int):
+        """Копирование вектора из другого индекса (без переквантования при том же типе)"""
+        if source.dtype != self.dtype:
+            self.add(new_doc_idx, source.vectors([source.row_of(doc_idx)])[0])
+            return
+        if self.read_only:
+            raise RuntimeError("Vector index is read-only")
+        if self.size == len(self._matrix):
+            self._grow()
+        row, scale = source.raw(doc_idx)
+        self._matrix[self.size] = row
+        if scale is not None:
+            self._scales[self.size] = scale
+        self._doc_ids.append(new_doc_idx)
+        self._rows[new_doc_idx] = self.size
+        self.size += 1
+
+    def save(self, prefix: Path):
+        if self._holes:
+            self._grow()
+        _save_array(Path(f"{prefix}.vectors.npy"), self._matrix[:self.size])
+        scales_path = Path(f"{prefix}.scales.npy")
+        if self._scales is not None:
+            _save_array(scales_path, self._scales[:self.size])
+        else:
+            scales_path.unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, prefix: Path) -> Optional["VectorIndex"]:
+        """Загрузка через mmap; None, если векторы не сохранялись"""
+        require_numpy()
+        vectors_path = Path(f"{prefix}.vectors.npy")
+        if not vectors_path.exists():
+            return None
+        scales_path = Path(f"{prefix}.scales.npy")
+        scales = np.load(scales_path, mmap_mode="r") if scales_path.exists() else None
+        return cls.from_arrays(np.load(vectors_path, mmap_mode="r"), scales)
+
+
+class IVFIndex:
+    """ANN-индекс IVF (inverted file) поверх VectorIndex только для чтения
+
+    Векторы разбиваются k-means на nlist кластеров; запрос просматривает
+    nprobe ближайших кластеров вместо всей матрицы.
+    """
+
+    def __init__(self, vectors: VectorIndex, centroids, order, offsets, nprobe: int = 8):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @classmethod
+    def train(
+        cls,
+        vectors: VectorIndex,
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        iterations: int = 10,
+        sample_size: int = 50_000,
+        seed: int = 0
+    ) -> "IVFIndex":
+        """Обучение k-means (сферического) и раскладка строк по кластерам"""
+        rng = np.random.default_rng(seed)
+        nlist = nlist or max(1, int(4 * np.sqrt(vectors.size)))
+        sample_rows = np.sort(rng.choice(vectors.size, min(sample_size, vectors.size), replace=False))
+        sample = vectors.vectors(sample_rows)
+        nlist = min(nlist, len(sample))
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = sample[assignment == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+        assignment = np.empty(vectors.size, dtype=np.int32)
+        for start in range(0, vectors.size, 65_536):
+            block = vectors.vectors(np.arange(start, min(start + 65_536, vectors.size)))
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        order = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=nlist), out=offsets[1:])
+        return cls(vectors, centroids, order, offsets, nprobe)
+
+    def search(self, query, k: int = 5, exclude: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """Приближенный top-k поиск: [(doc_idx, score), ...]"""
+        probes = top_k(self.centroids @ query.astype(np.float32), self.nprobe)
+        rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes])
+        if not len(rows):
+            return []
+        excluded = set(exclude)
+        if excluded:
+            rows = rows[~np.isin(rows, list(excluded))]
+        scores = self.vectors.scores(query, rows)
+        return [(int(rows[i]), float(scores[i])) for i in top_k(scores, k)]
+
+    def save(self, prefix: Path):
+        _save_array(Path(f"{prefix}.ivf_centroids.npy"), self.centroids)
+        _save_array(Path(f"{prefix}.ivf_order.npy"), self.order)
+        _save_array(Path(f"{prefix}.ivf_offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, prefix: Path, vectors: VectorIndex, nprobe: int = 8) -> Optional["IVFIndex"]:
+        centroids_path = Path(f"{prefix}.ivf_centroids.npy")
+        if not centroids_path.exists():
+            return None
+        return cls(
+            vectors,
+            np.load(centroids_path),
+            np.load(Path(f"{prefix}.ivf_order.npy"), mmap_mode="r"),
+            np.load(Path(f"{prefix}.ivf_offsets.npy")),
+            nprobe
+        )
+
+    @staticmethod
+    def remove_files(prefix: Path):
+        for suffix in ("ivf_centroids", "ivf_order", "ivf_offsets"):
+            Path(f"{prefix}.{suffix}.npy").unlink(missing_ok=True)
@@ -0,0 +1,227 @@
+"""
+Прием обновлений Telegram через webhook (встроенный асинхронный HTTP сервер)
+"""
+import asyncio
+import hmac
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+HEALTH_PATH = "/healthz"
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable"
+}
+
+
+class WebhookServer:
+    """HTTP endpoint для обновлений Telegram с ограниченной очередью
+
+    POST на path с JSON обновления: проверяется заголовок секретного токена
+    (обязателен — без него любой мог бы присылать поддельные обновления),
+    обновления других типов (не из allowed_updates) подтверждаются и
+    отбрасываются, остальные кладутся в очередь на queue_size элементов.
+    Если очередь полна, отвечаем 503 — Telegram повторит доставку позже.
+    Очередь разбирают workers задач, передавая JSON обновления в process
+    (обработка в этом процессе или отправка в процесс-обработчик).
+    GET /healthz возвращает статистику. Локально можно проверить так:
+
+        curl -X POST localhost:8080/telegram -H 'X-Telegram-Bot-Api-Secret-Token: ...' -d @update.json
+    """
+
+    def __init__(
+        self,
+        process: Callable[[Dict[str, Any]], Awaitable[None]],
+        path: str = "/telegram",
+        secret_token: str = "",
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        queue_size: int = 1000,
+        workers: int = 16,
+        allowed_updates: Sequence[str] = ("message", "callback_query"),
+        max_body: int = 1024 * 1024
+    ):
+        if not secret_token:
+            raise ValueError("Webhook secret token is required")
+        self.process = process
+        self.path = path
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.allowed_updates = frozenset(allowed_updates)
+        self.max_body = max_body
+        self.workers = workers
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(queue_size)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks = []
+
+        self.received = 0
+        self.accepted = 0
+        self.filtered = 0
+        self.rejected = 0
+        self.overflow = 0
+        self.processed = 0
+        self.errors = 0
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self, timeout: float = 30.0):
+        """Остановка приема и дообработка очереди (не дольше timeout секунд)"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Webhook queue not drained, {self.queue.qsize()} updates left")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.process(update)
+                self.processed += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Update {update.get('update_id')} failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Запросы одного соединения (Telegram держит соединения открытыми)"""
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                if body is None:
+                    status, payload = 413, {"ok": False}
+                else:
+                    status, payload = self._dispatch(method, target, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close" and body is not None
+                await self._write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(
+        self,
+        reader: asyncio.StreamReader
+    ) -> Optional[Tuple[str, str, Dict[str, str], Optional[bytes]]]:
+        """Строка запроса, заголовки и тело; тело None, если оно больше max_body"""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise
+            return None
+
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", "0"))
+        if length > self.max_body:
+            return method, target, headers, None
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    def _dispatch(
+        self,
+        method: str,
+        target: str,
+        headers: Dict[str, str],
+        body: bytes
+    ) -> Tuple[int, Dict[str, Any]]:
+        path = target.split("?", 1)[0]
+        if path == HEALTH_PATH and method == "GET":
+            return 200, {"ok": True, **self.stats()}
+        if path != self.path:
+            return 404, {"ok": False}
+        if method != "POST":
+            return 405, {"ok": False}
+
+        self.received += 1
+        if not hmac.compare_digest(
+            headers.get(SECRET_HEADER, "").encode(), self.secret_token.encode()
+        ):
+            self.rejected += 1
+            return 403, {"ok": False}
+
+        try:
+            update = json.loads(body)
+            if not isinstance(update, dict) or "update_id" not in update:
+                raise ValueError("not an update object")
+        except ValueError as e:
+            self.rejected += 1
+            logger.warning(f"Invalid webhook update: {e}")
+            return 400, {"ok": False}
+        if not any(kind in update for kind in self.allowed_updates):
+            self.filtered += 1
+            return 200, {"ok": True}
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.overflow += 1
+            return 503, {"ok": False}
+        self.accepted += 1
+        return 200, {"ok": True}
+
+    @staticmethod
+    async def _write_response(
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: Dict[str, Any],
+        keep_alive: bool
+    ):
+        body = json.dumps(payload).encode()
+        head = (
+            f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "received": self.received,
+            "accepted": self.accepted,
+            "filtered": self.filtered,
+            "rejected": self.rejected,
+            "overflow": self.overflow,
+            "processed": self.processed,
+            "errors": self.errors
+        }
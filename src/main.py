@@ -10,7 +10,8 @@ import os
 # Добавляем путь к src
 sys.path.insert(0, os.path.join(os.path.dirname(__file__)))
 
-from core.bot import CEOBot
+from core.bot import CEOBot, run_sharded
+from utils.config import settings
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,9 +26,13 @@ async def main():
     try:
         logger.info("🤖 Starting Telegram bot...")
         
-        # Создаем и запускаем бота
-        bot = CEOBot()
-        await bot.start()
+        # Несколько процессов-обработчиков за одним webhook или один процесс
+        if settings.BOT_WORKERS > 1:
+            await run_sharded()
+        else:
+            # Создаем и запускаем бота
+            bot = CEOBot()
+            await bot.start()
         
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
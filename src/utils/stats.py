@@ -0,0 +1,12 @@
+"""
+Статистика для метрик бота
+"""
+from typing import Iterable
+
+
+def percentile(values: Iterable[float], fraction: float) -> float:
+    """Перцентиль fraction (0..1) значений; 0.0 для пустых"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
@@ -0,0 +1,41 @@
+"""
+Быстрая локальная оценка количества токенов
+"""
+import math
+import re
+from functools import lru_cache
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+# Средняя длина токена в символах: кириллица дробится мельче латиницы
+_CHARS_PER_TOKEN_CYRILLIC = 3
+_CHARS_PER_TOKEN_LATIN = 4
+
+
+def _is_cyrillic(word: str) -> bool:
+    return "а" <= word[0].lower() <= "я" or word[0] in "ёЁ"
+
+
+@lru_cache(maxsize=65536)
+def estimate_word_tokens(word: str) -> int:
+    """Оценка числа токенов одного слова или знака препинания"""
+    if len(word) == 1:
+        return 1
+    chars_per_token = _CHARS_PER_TOKEN_CYRILLIC if _is_cyrillic(word) else _CHARS_PER_TOKEN_LATIN
+    return math.ceil(len(word) / chars_per_token)
+
+
+def count_tokens(text: str) -> int:
+    """Оценка числа токенов текста без обращения к API (без кэша)"""
+    return sum(estimate_word_tokens(piece) for piece in _PIECE_RE.findall(text))
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов текста с кэшем по строке
+
+    Системные промпты, фрагменты базы знаний и реплики истории оцениваются
+    при каждой сборке промпта, поэтому повторная оценка берется из кэша.
+    Для одноразовых строк (например, префиксов при обрезке) — count_tokens.
+    """
+    return count_tokens(text)
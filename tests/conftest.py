@@ -0,0 +1,7 @@
+"""
+Общие настройки тестов: исходники бота импортируются из src
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
@@ -0,0 +1,56 @@
+"""
+RedisMemoryManager на локальной замене Redis (fakeredis)
+"""
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from core.memory import RedisMemoryManager
+
+
+def make_manager(**kwargs) -> RedisMemoryManager:
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    return RedisMemoryManager("test_agent", client=client, **kwargs)
+
+
+def test_history_is_capped_at_max_turns():
+    async def scenario():
+        memory = make_manager(max_turns=3)
+        for i in range(5):
+            await memory.save_conversation(1, f"вопрос {i}", f"ответ {i}")
+        history = await memory.get_conversation_history(1, limit=10)
+        assert [turn.user_message for turn in history] == ["вопрос 2", "вопрос 3", "вопрос 4"]
+        assert await memory.redis.llen(memory._key("turns", 1)) == 3
+        assert await memory.redis.ttl(memory._key("turns", 1)) > 0
+
+    asyncio.run(scenario())
+
+
+def test_summary_round_trip():
+    async def scenario():
+        memory = make_manager()
+        assert await memory.get_summary(1) is None
+        await memory.set_summary(1, "краткое содержание", 1700000000.25)
+        assert await memory.get_summary(1) == {"text": "краткое содержание", "until": 1700000000.25}
+
+    asyncio.run(scenario())
+
+
+def test_clear_user_data_removes_only_that_user():
+    async def scenario():
+        memory = make_manager(cache_ttl=30)
+        for user_id in (1, 2):
+            await memory.save_conversation(user_id, "привет", "здравствуйте")
+            await memory.set_summary(user_id, "итог", 1.0)
+        await memory.get_conversation_history(1)
+
+        await memory.clear_user_data(1)
+
+        assert await memory.get_conversation_history(1) == []
+        assert await memory.get_summary(1) is None
+        assert len(await memory.get_conversation_history(2)) == 1
+        assert await memory.get_summary(2) == {"text": "итог", "until": 1.0}
+
+    asyncio.run(scenario())
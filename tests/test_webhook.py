@@ -0,0 +1,79 @@
+"""
+WebhookServer: POST записанного обновления Telegram через настоящий сокет
+"""
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from core.webhook import SECRET_HEADER, WebhookServer
+
+SECRET = "test-secret"
+UPDATE = (Path(__file__).parent / "fixtures" / "update_message.json").read_bytes()
+
+
+async def post(port: int, body: bytes, headers: dict) -> int:
+    """POST /telegram; возвращает код ответа"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(
+        f"POST /telegram HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n"
+        f"Connection: close\r\n{head}\r\n".encode() + body
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    writer.close()
+    await writer.wait_closed()
+    return int(status_line.split()[1])
+
+
+async def run_server(scenario):
+    received = []
+
+    async def process(update):
+        received.append(update)
+
+    server = WebhookServer(process, secret_token=SECRET, host="127.0.0.1", port=0, workers=1)
+    await server.start()
+    port = server._server.sockets[0].getsockname()[1]
+    try:
+        await scenario(server, port)
+    finally:
+        await server.stop(timeout=5)
+    return server, received
+
+
+def test_recorded_update_is_accepted_and_processed():
+    async def scenario(server, port):
+        assert await post(port, UPDATE, {SECRET_HEADER: SECRET}) == 200
+
+    server, received = asyncio.run(run_server(scenario))
+    assert received == [json.loads(UPDATE)]
+    assert server.stats()["processed"] == 1
+
+
+def test_wrong_or_missing_secret_is_rejected():
+    async def scenario(server, port):
+        assert await post(port, UPDATE, {SECRET_HEADER: "wrong"}) == 403
+        assert await post(port, UPDATE, {}) == 403
+
+    server, received = asyncio.run(run_server(scenario))
+    assert received == []
+    assert server.stats()["rejected"] == 2
+
+
+def test_filtered_and_invalid_updates_are_not_queued():
+    async def scenario(server, port):
+        poll = json.dumps({"update_id": 1, "poll": {"id": "1"}}).encode()
+        assert await post(port, poll, {SECRET_HEADER: SECRET}) == 200
+        assert await post(port, b"not json", {SECRET_HEADER: SECRET}) == 400
+
+    server, received = asyncio.run(run_server(scenario))
+    assert received == []
+    assert server.stats()["filtered"] == 1
+
+
+def test_empty_secret_is_refused():
+    with pytest.raises(ValueError):
+        WebhookServer(lambda update: None, secret_token="")